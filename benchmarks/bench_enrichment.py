@@ -0,0 +1,91 @@
+"""
+Бенчмарк блока поисковых данных для LLM.
+
+Сравнивает прежний рендерер (конкатенация строк, тяжелые заголовки)
+с компактным format_search_results на записанных результатах поиска:
+время рендера и оценка токенов промпта.
+
+Запуск: python -m benchmarks.bench_enrichment
+"""
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+from modules.web_search import format_search_results, estimate_tokens
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures" / "search_results.json"
+ROUNDS = 2000
+
+
+def legacy_format_search_results(search_data):
+    """Прежняя реализация format_search_results (для сравнения)."""
+    if not search_data or 'error' in search_data:
+        return ""
+    total_results = search_data.get('total_results', 0)
+    if total_results == 0:
+        return ""
+    formatted = f"\n=== АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА ПО '{search_data['asset_name']}' ===\n"
+    formatted += f"Найдено {total_results} источников информации:\n\n"
+    if search_data.get('general_info'):
+        formatted += "📊 ДАННЫЕ О КОТИРОВКАХ И ЦЕНАХ:\n"
+        for i, result in enumerate(search_data['general_info'], 1):
+            snippet = result['snippet'][:300] if result['snippet'] else result['title']
+            formatted += f"{i}. {snippet}\n"
+            if result.get('url') and 'investing.com' in result['url'] or 'yahoo.com' in result['url']:
+                formatted += f"   📈 Источник: {result['url']}\n"
+        formatted += "\n"
+    if search_data.get('recent_news'):
+        formatted += "📰 АКТУАЛЬНЫЕ НОВОСТИ И АНАЛИТИКА:\n"
+        for i, result in enumerate(search_data['recent_news'], 1):
+            snippet = result['snippet'][:300] if result['snippet'] else result['title']
+            formatted += f"{i}. {snippet}\n"
+            if result.get('url'):
+                formatted += f"   🔗 Источник: {result['url']}\n"
+        formatted += "\n"
+    formatted += "⚠️ ВАЖНО: Используй эту информацию как дополнение к анализу, проверяй актуальность данных.\n"
+    formatted += "=== КОНЕЦ ПОИСКОВЫХ ДАННЫХ ===\n"
+    return formatted
+
+
+# Обертка промпта в llm.py до и после изменения
+LEGACY_WRAPPER = (
+    "АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА:\n\n\n"
+    "Используй эту информацию в своем анализе, но не копируй дословно. "
+    "Интегрируй данные в свой экспертный анализ.\n\nВОПРОС:\n"
+)
+COMPACT_WRAPPER = "АКТУАЛЬНЫЕ ДАННЫЕ (интегрируй в анализ, не копируй дословно):\n\n\nВОПРОС:\n"
+
+
+def run():
+    fixtures = json.loads(FIXTURES.read_text(encoding="utf-8"))
+    results = []
+    for name, render, wrapper in (
+        ("legacy", legacy_format_search_results, LEGACY_WRAPPER),
+        ("compact", format_search_results, COMPACT_WRAPPER),
+    ):
+        seconds = timeit.timeit(lambda: [render(item) for item in fixtures], number=ROUNDS)
+        tokens = sum(estimate_tokens(wrapper + render(item)) for item in fixtures)
+        results.append({
+            'name': name,
+            'us_per_render': seconds / ROUNDS / len(fixtures) * 1e6,
+            'prompt_tokens': tokens,
+        })
+    return results
+
+
+def main():
+    results = run()
+    legacy_tokens = results[0]['prompt_tokens']
+    print(f"{'renderer':<10}{'мкс/рендер':>12}{'токенов':>10}{'экономия':>10}")
+    for row in results:
+        saved = 1 - row['prompt_tokens'] / legacy_tokens
+        print(f"{row['name']:<10}{row['us_per_render']:>12.1f}{row['prompt_tokens']:>10}{saved:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
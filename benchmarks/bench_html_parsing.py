@@ -0,0 +1,86 @@
+"""
+Бенчмарк разбора страниц поиска на сохраненных страницах.
+
+- DuckDuckGo Lite: прежний regex по всему документу против потокового
+  DuckDuckGoLiteParser с остановкой после max_results ссылок
+- простой веб-поиск: lower() всей страницы против проверки по порциям
+
+Запуск: python -m benchmarks.bench_html_parsing
+"""
+import os
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+
+from modules.web_search import DuckDuckGoLiteParser, RUB_MARKERS, STREAM_CHUNK_SIZE
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+ROUNDS = 300
+MAX_RESULTS = 3
+
+
+def legacy_parse(content: str):
+    """Прежний разбор search_duckduckgo_html."""
+    pattern = r'<a[^>]*href="([^"]*(?:investing|marketwatch|yahoo|finance)[^"]*)"[^>]*>([^<]+)</a>'
+    matches = re.findall(pattern, content, re.IGNORECASE)
+    return [(url, title.strip()) for url, title in matches[:MAX_RESULTS] if len(title.strip()) > 10]
+
+
+def streaming_parse(body: bytes):
+    """Потоковый разбор: декодирование и разбор порциями до первых MAX_RESULTS ссылок."""
+    parser = DuckDuckGoLiteParser(MAX_RESULTS)
+    read = 0
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        chunk = body[start:start + STREAM_CHUNK_SIZE]
+        read += len(chunk)
+        parser.feed(chunk.decode("utf-8", errors="replace"))
+        if parser.done:
+            break
+    return parser.results, read
+
+
+def legacy_rub_check(body: bytes) -> bool:
+    content = body.decode("utf-8").lower()
+    return 'руб' in content or 'rub' in content
+
+
+def streaming_rub_check(body: bytes):
+    tail = ''
+    read = 0
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        chunk = body[start:start + STREAM_CHUNK_SIZE]
+        read += len(chunk)
+        window = (tail + chunk.decode("utf-8", errors="ignore")).lower()
+        if any(marker in window for marker in RUB_MARKERS):
+            return True, read
+        tail = window[-8:]
+    return False, read
+
+
+def measure(func, *args):
+    return timeit.timeit(lambda: func(*args), number=ROUNDS) / ROUNDS * 1e3
+
+
+def main():
+    lite = (FIXTURES / "ddg_lite.html").read_bytes()
+    google = (FIXTURES / "google_search.html").read_bytes()
+
+    _, lite_read = streaming_parse(lite)
+    _, google_read = streaming_rub_check(google)
+    rows = [
+        ("ddg lite: regex", measure(lambda: legacy_parse(lite.decode("utf-8"))), len(lite)),
+        ("ddg lite: stream", measure(streaming_parse, lite), lite_read),
+        ("simple web: lower()", measure(legacy_rub_check, google), len(google)),
+        ("simple web: stream", measure(streaming_rub_check, google), google_read),
+    ]
+    print(f"{'разбор':<22}{'мс':>8}{'байт прочитано':>16}")
+    for name, ms, read in rows:
+        print(f"{name:<22}{ms:>8.3f}{read:>16}")
+
+
+if __name__ == "__main__":
+    main()
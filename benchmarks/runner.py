@@ -0,0 +1,143 @@
+"""
+Микробенчмарки горячих функций с сохраненной базой и отчетом сравнения.
+
+Бенчмарки работают без сети: поисковые провайдеры, yfinance и ЦБ РФ
+подменяются записанными ответами из tests/fixtures. Каждый замер -
+лучшее из нескольких повторов по timeit, число вызовов подбирается
+автоматически (timeit autorange: не меньше 0.2 с на повтор).
+
+Запуск:
+  python -m benchmarks.runner             замер и сравнение с baseline.json
+  python -m benchmarks.runner --save      записать замеры как новую базу
+  python -m benchmarks.runner -k history  только бенчмарки с подстрокой в имени
+  python -m benchmarks.runner --check     код выхода 1 при замедлении больше порога
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark")
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+REPEAT = 5
+# Изменение меньше порога считается шумом
+THRESHOLD = 0.15
+
+def measure(func: Callable[[], Any], repeat: int = REPEAT, number: Optional[int] = None) -> Dict[str, float]:
+    """Время одного вызова в микросекундах: лучшее и медиана по повторам."""
+    loop = None
+    if inspect.iscoroutinefunction(func):
+        loop = asyncio.new_event_loop()
+        coroutine_func = func
+        func = lambda: loop.run_until_complete(coroutine_func())
+    try:
+        timer = timeit.Timer(func)
+        if number is None:
+            number, _ = timer.autorange()
+        times = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    finally:
+        if loop is not None:
+            loop.close()
+    return {'us': round(min(times), 3), 'median_us': round(statistics.median(times), 3), 'number': number}
+
+
+def run(pattern: str = "", repeat: int = REPEAT, number: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    """Выполнить бенчмарки, имена которых содержат pattern."""
+    from benchmarks.suite import BENCHMARKS
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern not in name:
+            continue
+        cases = setup()
+        try:
+            results[name] = measure(next(cases), repeat, number)
+        finally:
+            cases.close()
+    return results
+
+
+def load_baseline(path: Path = BASELINE_FILE) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8")).get('results', {})
+
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: Path = BASELINE_FILE) -> None:
+    """Сохранить замеры как базу (существующие записи других бенчмарков сохраняются)."""
+    merged = {**load_baseline(path), **results}
+    data = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': f"{platform.system()} {platform.machine()}",
+            'date': datetime.now().strftime('%Y-%m-%d'),
+        },
+        'results': dict(sorted(merged.items())),
+    }
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float = THRESHOLD) -> List[Dict[str, Any]]:
+    """Строки отчета: замер, база, отношение и вердикт (faster / slower / same / new)."""
+    rows = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        ratio = result['us'] / base['us'] if base and base['us'] else None
+        if ratio is None:
+            verdict = 'new'
+        elif ratio > 1 + threshold:
+            verdict = 'slower'
+        elif ratio < 1 - threshold:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        rows.append({'name': name, 'us': result['us'], 'baseline_us': base['us'] if base else None,
+                     'ratio': ratio, 'verdict': verdict})
+    return rows
+
+
+VERDICT_MARKS = {'faster': '🟢 быстрее', 'slower': '🔴 медленнее', 'same': '⚪ без изменений', 'new': '🆕 нет базы'}
+
+
+def format_report(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'бенчмарк':<34}{'мкс':>12}{'база, мкс':>12}{'x':>8}  итог"]
+    for row in rows:
+        base = f"{row['baseline_us']:.2f}" if row['baseline_us'] is not None else "-"
+        ratio = f"{row['ratio']:.2f}" if row['ratio'] is not None else "-"
+        lines.append(f"{row['name']:<34}{row['us']:>12.2f}{base:>12}{ratio:>8}  {VERDICT_MARKS[row['verdict']]}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций")
+    parser.add_argument("-k", dest="pattern", default="", help="только бенчмарки с подстрокой в имени")
+    parser.add_argument("--save", action="store_true", help="записать замеры как новую базу")
+    parser.add_argument("--check", action="store_true", help="код выхода 1 при замедлении")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="порог шума (доля)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern)
+    rows = compare(results, load_baseline(args.baseline), args.threshold)
+    print(format_report(rows))
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"\nБаза сохранена: {args.baseline}")
+    if args.check and any(row['verdict'] == 'slower' for row in rows):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
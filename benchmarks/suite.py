@@ -0,0 +1,179 @@
+"""
+Бенчмарки горячих функций для benchmarks.runner.
+
+Данные - записанные ответы из tests/fixtures; сетевые вызовы подменены.
+"""
+import json
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator
+from unittest.mock import patch
+
+import pandas as pd
+
+from config import MAX_HISTORY_MESSAGES
+from modules import finance_data
+from modules.llm import add_to_history, get_chat_context, chat_histories, chat_summaries, pending_evictions
+from modules.web_search import WebSearchClient, format_search_results
+from modules.instruments import instrument_index
+
+FIXTURES = Path(__file__).resolve().parent.parent / "tests" / "fixtures"
+SEARCH_RESULTS = json.loads((FIXTURES / "search_results.json").read_text(encoding="utf-8"))
+CHAT_ID = -1
+
+# Имя -> генератор: подготовка, yield функции для замера (обычной или async), очистка
+BENCHMARKS: Dict[str, Callable[[], Iterator[Callable[[], Any]]]] = {}
+
+
+def benchmark(name: str):
+    """Зарегистрировать бенчмарк (генератор, как фикстура pytest)."""
+    def decorator(setup: Callable[[], Iterator[Callable[[], Any]]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+MESSAGES = [
+    "Какой сейчас курс доллара?",
+    "Проанализируй акции Сбербанка на горизонте года",
+    "Расскажи про стратегию усреднения для долгосрочного инвестора",
+    "Что думаешь про Лукойл после отчетности?",
+    "Привет! Как дела?",
+    "Стоит ли покупать золото, если инфляция ускоряется, а ставки еще высокие?",
+    "Объясни разницу между облигациями федерального займа и корпоративными",
+    "Сравни Apple и Microsoft по мультипликаторам",
+]
+
+
+def fill_chat(messages: int) -> None:
+    chat_histories[CHAT_ID] = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": MESSAGES[i % len(MESSAGES)] * 4}
+        for i in range(messages)
+    ]
+
+
+def reset_chat() -> None:
+    chat_histories.pop(CHAT_ID, None)
+    chat_summaries.pop(CHAT_ID, None)
+    pending_evictions.pop(CHAT_ID, None)
+
+
+@benchmark("llm.add_to_history")
+def bench_add_to_history():
+    """Добавление в заполненную историю: вытеснение старых реплик."""
+    fill_chat(MAX_HISTORY_MESSAGES)
+
+    def add():
+        add_to_history(CHAT_ID, "user", MESSAGES[0])
+        pending_evictions.pop(CHAT_ID, None)
+
+    yield add
+    reset_chat()
+
+
+@benchmark("llm.get_chat_context")
+def bench_get_chat_context():
+    fill_chat(MAX_HISTORY_MESSAGES)
+    chat_summaries[CHAT_ID] = "Пользователь интересуется курсом доллара и акциями Сбербанка. " * 5
+    yield lambda: get_chat_context(CHAT_ID)
+    reset_chat()
+
+
+@benchmark("web_search.detect_financial_query")
+def bench_detect_financial_query():
+    client = WebSearchClient()
+    yield lambda: [client.detect_financial_query(message) for message in MESSAGES]
+    client.session.close()
+
+
+@benchmark("instruments.find")
+def bench_instrument_find():
+    instrument_index.find("")
+    yield lambda: [instrument_index.find(message) for message in MESSAGES]
+
+
+@benchmark("web_search.format_search_results")
+def bench_format_search_results():
+    yield lambda: [format_search_results(item) for item in SEARCH_RESULTS]
+
+
+@benchmark("web_search.search_asset_info")
+def bench_search_asset_info():
+    """Сбор и ранжирование результатов при мгновенных провайдерах (без сети)."""
+    client = WebSearchClient()
+    item = SEARCH_RESULTS[1]
+    quotes = [result for result in item['general_info'] if result.get('quote')]
+    snippets = [result for result in item['general_info'] if not result.get('quote')]
+
+    async def search(query, *args, **kwargs):
+        return list(snippets)
+
+    async def news(query, *args, **kwargs):
+        return list(item['recent_news'])
+
+    async def real(query, *args, **kwargs):
+        return list(quotes)
+
+    client.search_duckduckgo = search
+    client.search_duckduckgo_html = search
+    client.search_simple_web = search
+    client.search_financial_news = news
+    client.get_real_financial_data = real
+
+    async def run():
+        return await client.search_asset_info(item['asset_name'])
+
+    yield run
+    client.session.close()
+
+
+class RecordedTicker:
+    """yf.Ticker с записанными info и history."""
+
+    def __init__(self, info, history):
+        self.info = info
+        self._history = history
+
+    def history(self, period="1d"):
+        return self._history
+
+
+@benchmark("finance_data.fetch_stock_data")
+def bench_fetch_stock_data():
+    """Разбор ответа yfinance (info + дневная история) без сетевых запросов."""
+    recorded = json.loads((FIXTURES / "yfinance_sber.json").read_text(encoding="utf-8"))
+    frame = pd.DataFrame(
+        recorded['history']['data'],
+        columns=recorded['history']['columns'],
+        index=pd.DatetimeIndex(pd.to_datetime(recorded['history']['index']), name="Date"),
+    )
+    ticker = RecordedTicker(recorded['info'], frame)
+
+    class RecordedYFinance:
+        @staticmethod
+        def Ticker(symbol):
+            return ticker
+
+    with patch.object(finance_data, "yf", RecordedYFinance):
+        yield lambda: finance_data.fetch_stock_data("SBER.ME")
+
+
+class RecordedResponse:
+    status_code = 200
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def json(self):
+        return json.loads(self._payload)
+
+
+@benchmark("finance_data._fetch_cbr_rate")
+def bench_fetch_cbr_rate():
+    """Запрос (в потоке) и разбор записанного ответа ЦБ РФ."""
+    payload = (FIXTURES / "cbr_daily.json").read_text(encoding="utf-8")
+    client = finance_data.FinanceDataClient()
+
+    with patch.object(finance_data.requests, "get", lambda url, timeout=None: RecordedResponse(payload)):
+        async def fetch():
+            return await client._fetch_cbr_rate("USD")
+        yield fetch
@@ -19,6 +19,191 @@ MAX_MESSAGE_LENGTH: int = int(os.getenv("MAX_MESSAGE_LENGTH", "4000"))
 MAX_HISTORY_MESSAGES: int = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
 LLM_REQUEST_TIMEOUT: int = int(os.getenv("LLM_REQUEST_TIMEOUT", "30"))
 
+# Model Routing (quote / followup / analysis tiers)
+ROUTING_ENABLED: bool = os.getenv("ROUTING_ENABLED", "true").lower() == "true"
+LLM_MODEL_QUOTE: str = os.getenv("LLM_MODEL_QUOTE", "anthropic/claude-3.5-haiku")
+LLM_MODEL_FOLLOWUP: str = os.getenv("LLM_MODEL_FOLLOWUP", "anthropic/claude-3.5-haiku")
+LLM_MODEL_ANALYSIS: str = os.getenv("LLM_MODEL_ANALYSIS", "anthropic/claude-sonnet-4")
+LLM_FALLBACK_MODEL: str = os.getenv("LLM_FALLBACK_MODEL", "openai/gpt-4o-mini")
+LLM_MAX_TOKENS_QUOTE: int = int(os.getenv("LLM_MAX_TOKENS_QUOTE", "300"))
+LLM_MAX_TOKENS_FOLLOWUP: int = int(os.getenv("LLM_MAX_TOKENS_FOLLOWUP", "600"))
+LLM_MAX_TOKENS_ANALYSIS: int = int(os.getenv("LLM_MAX_TOKENS_ANALYSIS", "1000"))
+LLM_TEMPERATURE_QUOTE: float = float(os.getenv("LLM_TEMPERATURE_QUOTE", "0.3"))
+LLM_TEMPERATURE_FOLLOWUP: float = float(os.getenv("LLM_TEMPERATURE_FOLLOWUP", "0.5"))
+LLM_TEMPERATURE_ANALYSIS: float = float(os.getenv("LLM_TEMPERATURE_ANALYSIS", "0.7"))
+# Доля LLM_REQUEST_TIMEOUT на основную модель, остаток - на резервную.
+# Основная модель получает большую часть времени: по таймауту длинный, но нормальный
+# ответ заменяется ответом более простой резервной модели
+LLM_PRIMARY_TIMEOUT_SHARE: float = float(os.getenv("LLM_PRIMARY_TIMEOUT_SHARE", "0.85"))
+
+# Hedged Requests: второй запрос, если первый токен не пришел за p-й перцентиль TTFT
+LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+# Модель для второго запроса (пусто - та же модель)
+LLM_HEDGE_MODEL: str = os.getenv("LLM_HEDGE_MODEL", "")
+# Доля запросов, которые можно хеджировать (ограничивает рост расходов)
+LLM_HEDGE_BUDGET: float = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "90"))
+# Порог до накопления LLM_HEDGE_MIN_SAMPLES замеров TTFT и нижняя граница порога (сек)
+LLM_HEDGE_DELAY: float = float(os.getenv("LLM_HEDGE_DELAY", "4"))
+LLM_HEDGE_MIN_DELAY: float = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Fast Path: ответы на простые вопросы о цене без LLM
+FAST_PATH_ENABLED: bool = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+FAST_PATH_ANALYSIS: bool = os.getenv("FAST_PATH_ANALYSIS", "false").lower() == "true"
+
+# Prompt Caching (cache_control hints for Anthropic/Gemini via OpenRouter)
+PROMPT_CACHE_ENABLED: bool = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+# Rolling Conversation Summary
+SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_CHUNK: int = int(os.getenv("SUMMARY_CHUNK", "6"))
+LLM_MODEL_SUMMARY: str = os.getenv("LLM_MODEL_SUMMARY", "anthropic/claude-3.5-haiku")
+LLM_MAX_TOKENS_SUMMARY: int = int(os.getenv("LLM_MAX_TOKENS_SUMMARY", "300"))
+
+# Search Enrichment
+ENRICHMENT_MAX_TOKENS: int = int(os.getenv("ENRICHMENT_MAX_TOKENS", "400"))
+SEARCH_TOP_K: int = int(os.getenv("SEARCH_TOP_K", "5"))
+SEARCH_DUP_THRESHOLD: float = float(os.getenv("SEARCH_DUP_THRESHOLD", "0.6"))
+# Отправлять первый запрос к LLM с одними котировками, не дожидаясь новостей
+ENRICHMENT_QUOTES_FIRST: bool = os.getenv("ENRICHMENT_QUOTES_FIRST", "false").lower() == "true"
+
+# Search Cache
+SEARCH_CACHE_ENABLED: bool = os.getenv("SEARCH_CACHE_ENABLED", "true").lower() == "true"
+SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_TTL_WEB: float = float(os.getenv("SEARCH_CACHE_TTL_WEB", "600"))
+SEARCH_CACHE_TTL_NEWS: float = float(os.getenv("SEARCH_CACHE_TTL_NEWS", "1800"))
+# Сколько секунд после TTL запись еще отдается, пока обновляется в фоне
+SEARCH_CACHE_STALE: float = float(os.getenv("SEARCH_CACHE_STALE", "3600"))
+# Файл для сохранения кэша между перезапусками (пусто - только в памяти)
+SEARCH_CACHE_FILE: str = os.getenv("SEARCH_CACHE_FILE", "")
+
+# CoinGecko (crypto prices, one bulk request per refresh)
+COINGECKO_ENABLED: bool = os.getenv("COINGECKO_ENABLED", "true").lower() == "true"
+COINGECKO_BASE_URL: str = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+COINGECKO_API_KEY: str = os.getenv("COINGECKO_API_KEY", "")
+COINGECKO_REFRESH: float = float(os.getenv("COINGECKO_REFRESH", "30"))
+
+# Live Price Feed (WebSocket push into an in-memory quote table)
+PRICE_FEED_ENABLED: bool = os.getenv("PRICE_FEED_ENABLED", "true").lower() == "true"
+PRICE_FEED_URL: str = os.getenv(
+    "PRICE_FEED_URL", "wss://stream.binance.com:9443/stream?streams=btcusdt@miniTicker/ethusdt@miniTicker"
+)
+# Символ фида -> инструмент таблицы (BTC, ETH, GOLD, USD). Поток Binance по умолчанию передает
+# только BTC и ETH; GOLD и USD - для своих фидов, например XAUUSD:GOLD,USDRUB:USD
+PRICE_FEED_SYMBOLS: str = os.getenv("PRICE_FEED_SYMBOLS", "BTCUSDT:BTC,ETHUSDT:ETH")
+# Котировка из фида старше стольких секунд не используется
+PRICE_FEED_MAX_AGE: float = float(os.getenv("PRICE_FEED_MAX_AGE", "60"))
+PRICE_FEED_PING_INTERVAL: float = float(os.getenv("PRICE_FEED_PING_INTERVAL", "20"))
+PRICE_FEED_STALE_AFTER: float = float(os.getenv("PRICE_FEED_STALE_AFTER", "60"))
+PRICE_FEED_BACKOFF_MAX: float = float(os.getenv("PRICE_FEED_BACKOFF_MAX", "60"))
+
+# Price Alerts (/alert)
+ALERTS_ENABLED: bool = os.getenv("ALERTS_ENABLED", "true").lower() == "true"
+# Файл с уведомлениями (пусто - не сохранять между перезапусками)
+ALERTS_FILE: str = os.getenv("ALERTS_FILE", "alerts.json")
+ALERT_MAX_PER_CHAT: int = int(os.getenv("ALERT_MAX_PER_CHAT", "20"))
+# Как часто запрашивать цены инструментов с уведомлениями, если нет потоковых котировок
+ALERT_CHECK_INTERVAL: float = float(os.getenv("ALERT_CHECK_INTERVAL", "60"))
+# Сколько секунд копить сработавшие уведомления, чтобы отправить их одним сообщением
+ALERT_BATCH_INTERVAL: float = float(os.getenv("ALERT_BATCH_INTERVAL", "2"))
+
+# Portfolio Analytics (/portfolio)
+PORTFOLIO_PERIOD: str = os.getenv("PORTFOLIO_PERIOD", "1y")
+PORTFOLIO_BENCHMARK: str = os.getenv("PORTFOLIO_BENCHMARK", "^GSPC")
+PORTFOLIO_MAX_POSITIONS: int = int(os.getenv("PORTFOLIO_MAX_POSITIONS", "60"))
+# Сколько секунд хранить матрицы цен для набора инструментов
+PORTFOLIO_CACHE_TTL: float = float(os.getenv("PORTFOLIO_CACHE_TTL", "3600"))
+
+# Instrument Index (названия, синонимы и тикеры инструментов)
+# Пусто - встроенный список modules/data/instruments.tsv
+INSTRUMENTS_FILE: str = os.getenv("INSTRUMENTS_FILE", "")
+# Порог похожести для опечаток в явных запросах (/alert, /portfolio), 0 - без нечеткого поиска
+INSTRUMENT_FUZZY_CUTOFF: float = float(os.getenv("INSTRUMENT_FUZZY_CUTOFF", "0.8"))
+
+# Market Calendar (торговые сессии бирж и расписание ЦБ РФ)
+MARKET_CALENDAR_ENABLED: bool = os.getenv("MARKET_CALENDAR_ENABLED", "true").lower() == "true"
+# Праздники бирж; пусто - встроенная таблица modules/data/market_holidays.tsv
+MARKET_HOLIDAYS_FILE: str = os.getenv("MARKET_HOLIDAYS_FILE", "")
+# Дополнительные выходные бирж: "MOEX:2026-12-30,US:2026-11-27"
+MARKET_EXTRA_HOLIDAYS: str = os.getenv("MARKET_EXTRA_HOLIDAYS", "")
+# Время публикации официальных курсов ЦБ РФ (МСК)
+CBR_PUBLISH_TIME: str = os.getenv("CBR_PUBLISH_TIME", "15:30")
+# Максимум секунд хранения котировки закрытого рынка (до открытия)
+MARKET_CLOSED_MAX_TTL: float = float(os.getenv("MARKET_CLOSED_MAX_TTL", str(4 * 24 * 3600)))
+
+# Diagnostics (/diag for admins and a local HTTP endpoint)
+# Telegram user id администраторов через запятую (пусто - /diag недоступна)
+ADMIN_IDS: str = os.getenv("ADMIN_IDS", "")
+# Порт эндпоинта http://DIAG_HOST:DIAG_PORT/diag (0 - выключен)
+DIAG_HOST: str = os.getenv("DIAG_HOST", "127.0.0.1")
+DIAG_PORT: int = int(os.getenv("DIAG_PORT", "0"))
+# Максимальная длительность профиля и трассировки памяти (сек)
+DIAG_MAX_SECONDS: float = float(os.getenv("DIAG_MAX_SECONDS", "30"))
+DIAG_SAMPLE_INTERVAL: float = float(os.getenv("DIAG_SAMPLE_INTERVAL", "0.005"))
+
+# Load Governor (ступенчатое упрощение ответов при перегрузке)
+GOVERNOR_ENABLED: bool = os.getenv("GOVERNOR_ENABLED", "true").lower() == "true"
+GOVERNOR_INTERVAL: float = float(os.getenv("GOVERNOR_INTERVAL", "1"))
+# Пороги перегрузки: задержка event loop (сек), запросов к LLM в обработке, доля ошибок LLM API за окно (сек)
+GOVERNOR_LAG_TARGET: float = float(os.getenv("GOVERNOR_LAG_TARGET", "0.2"))
+GOVERNOR_MAX_LLM_IN_FLIGHT: int = int(os.getenv("GOVERNOR_MAX_LLM_IN_FLIGHT", "32"))
+GOVERNOR_ERROR_RATE: float = float(os.getenv("GOVERNOR_ERROR_RATE", "0.3"))
+GOVERNOR_ERROR_WINDOW: float = float(os.getenv("GOVERNOR_ERROR_WINDOW", "60"))
+# Не чаще одной ступени вверх за столько секунд; вниз - после стольких секунд давления ниже доли порога
+GOVERNOR_STEP_UP_AFTER: float = float(os.getenv("GOVERNOR_STEP_UP_AFTER", "2"))
+GOVERNOR_RECOVER_RATIO: float = float(os.getenv("GOVERNOR_RECOVER_RATIO", "0.5"))
+GOVERNOR_RECOVER_AFTER: float = float(os.getenv("GOVERNOR_RECOVER_AFTER", "30"))
+# Высшая ступень (6 - отклонять сообщения, 5 - никогда не отклонять)
+GOVERNOR_MAX_LEVEL: int = int(os.getenv("GOVERNOR_MAX_LEVEL", "6"))
+GOVERNOR_SHORT_HISTORY: int = int(os.getenv("GOVERNOR_SHORT_HISTORY", "6"))
+GOVERNOR_MAX_TOKENS_FACTOR: float = float(os.getenv("GOVERNOR_MAX_TOKENS_FACTOR", "0.5"))
+GOVERNOR_CHEAP_MODEL: str = os.getenv("GOVERNOR_CHEAP_MODEL", LLM_FALLBACK_MODEL)
+# Сколько секунд сообщение ждет места на последней ступени и сколько сообщений может ждать
+GOVERNOR_QUEUE_TIMEOUT: float = float(os.getenv("GOVERNOR_QUEUE_TIMEOUT", "10"))
+GOVERNOR_MAX_QUEUED: int = int(os.getenv("GOVERNOR_MAX_QUEUED", "50"))
+
+# Shared State Configuration (memory | redis)
+STATE_BACKEND: str = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX: str = os.getenv("STATE_KEY_PREFIX", "finbot:")
+HISTORY_TTL: int = int(os.getenv("HISTORY_TTL", str(7 * 24 * 3600)))
+QUOTE_CACHE_TTL: float = float(os.getenv("QUOTE_CACHE_TTL", "60"))
+
+# Rate Limits and Concurrency
+RATE_LIMIT_MESSAGES: int = int(os.getenv("RATE_LIMIT_MESSAGES", "10"))
+RATE_LIMIT_WINDOW: float = float(os.getenv("RATE_LIMIT_WINDOW", "60"))
+CONCURRENT_UPDATES: int = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Background Analysis Jobs (long questions answered asynchronously)
+JOBS_ENABLED: bool = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_PENDING: int = int(os.getenv("JOB_MAX_PENDING", "100"))
+JOB_MAX_PER_CHAT: int = int(os.getenv("JOB_MAX_PER_CHAT", "2"))
+JOB_TIMEOUT: float = float(os.getenv("JOB_TIMEOUT", "180"))
+# Файл с незавершенными заданиями (пусто - не сохранять между перезапусками)
+JOB_QUEUE_FILE: str = os.getenv("JOB_QUEUE_FILE", "jobs.json")
+# Сколько раз запускать задание (в том числе после перезапусков), прежде чем отказаться от него
+JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Задания ждут, пока в обработке столько или больше интерактивных сообщений
+JOB_INTERACTIVE_LIMIT: int = int(os.getenv("JOB_INTERACTIVE_LIMIT", "16"))
+LLM_MODEL_DEEP: str = os.getenv("LLM_MODEL_DEEP", LLM_MODEL_ANALYSIS)
+LLM_MAX_TOKENS_DEEP: int = int(os.getenv("LLM_MAX_TOKENS_DEEP", "3000"))
+
+# Outbound Messages (Telegram limits: ~30 msg/s per bot, ~1 msg/s per chat)
+SEND_GLOBAL_RATE: float = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE: float = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST: float = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_MAX_RETRIES: int = int(os.getenv("SEND_MAX_RETRIES", "3"))
+TYPING_INTERVAL: float = float(os.getenv("TYPING_INTERVAL", "4"))
+
+# Multi-process Mode (0/1 - single process)
+WORKER_PROCESSES: int = int(os.getenv("WORKER_PROCESSES", "0"))
+FINANCE_PROCESS_WORKERS: int = int(os.getenv("FINANCE_PROCESS_WORKERS", "0"))
+
+# Shutdown Configuration
+SHUTDOWN_TIMEOUT: float = float(os.getenv("SHUTDOWN_TIMEOUT", "25"))
+
 def validate_config() -> None:
     """Validate required configuration parameters."""
     if not TELEGRAM_BOT_TOKEN:
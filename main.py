@@ -6,13 +6,27 @@ import logging
 import sys
 import asyncio
 import signal
-from config import TELEGRAM_BOT_TOKEN, validate_config
-from modules.bot import setup_bot
+from telegram.ext import Application
+from config import TELEGRAM_BOT_TOKEN, SHUTDOWN_TIMEOUT, WORKER_PROCESSES, PRICE_FEED_ENABLED, validate_config
+from modules.bot import setup_bot, start_analysis_queue, start_alert_engine
+from modules.finance_data import shutdown_process_pool
+from modules.coingecko import crypto_prices
+from modules.price_feed import price_feed
+from modules.lifecycle import shutdown_manager
+from modules.state import state_backend
+from modules.metrics import metrics
+from modules.outbound import typing_ticker
+from modules.jobs import analysis_queue
+from modules.alerts import alert_engine
+from modules.diagnostics import diag_server
+from modules.governor import governor
+from modules.workers import WorkerPool, setup_front, reshard_file
 try:
-    from modules.web_search import web_search_client
+    from modules.web_search import web_search_client, search_cache
     WEB_SEARCH_AVAILABLE = True
 except ImportError:
     web_search_client = None
+    search_cache = None
     WEB_SEARCH_AVAILABLE = False
 
 # Configure logging
@@ -24,35 +38,34 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def signal_handler(signum, frame):
-    """Handle shutdown signals gracefully."""
-    logger.info(f"Received signal {signum}, shutting down gracefully...")
-    # Закрываем web search сессию (если доступен)
-    if WEB_SEARCH_AVAILABLE and web_search_client:
+def install_signal_handlers(stop_event: asyncio.Event) -> None:
+    """Route SIGINT/SIGTERM to the shutdown event instead of killing the process."""
+    loop = asyncio.get_running_loop()
+
+    def request_stop(signum=None, frame=None):
+        logger.info(f"Received signal {signum}, shutting down gracefully...")
+        loop.call_soon_threadsafe(stop_event.set)
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            asyncio.run(web_search_client.close())
-        except Exception as e:
-            logger.warning(f"Error closing web search client: {e}")
-    sys.exit(0)
+            loop.add_signal_handler(sig, request_stop, sig)
+        except NotImplementedError:
+            # Windows: add_signal_handler не поддерживается
+            signal.signal(sig, request_stop)
 
-def main():
-    """Main entry point for the bot."""
-    # Setup signal handlers for graceful shutdown
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    try:
-        # Validate configuration
-        validate_config()
-        logger.info("Configuration validated successfully")
-        
-        # Setup and start bot
-        application = setup_bot(TELEGRAM_BOT_TOKEN)
-        logger.info("Starting Telegram bot...")
-        logger.info("Bot is running. Press Ctrl+C to stop.")
-        
+async def run_bot(application: Application, background_tasks: bool = True, pool=None) -> None:
+    """Run polling until a stop signal, then shut down without dropping in-flight work.
+
+    background_tasks - run the analysis queue, price alerts and the live price feed in this process
+    (not in the multi-process front).
+    pool - worker pool of the multi-process front: price sources run here and prices are sent to the workers.
+    """
+    stop_event = asyncio.Event()
+    install_signal_handlers(stop_event)
+
+    async with application:
         # Start polling with increased timeouts
-        application.run_polling(
+        await application.updater.start_polling(
             poll_interval=1.0,
             timeout=20,
             bootstrap_retries=3,
@@ -61,13 +74,85 @@ def main():
             connect_timeout=60,
             pool_timeout=10
         )
-            
+        await application.start()
+        if background_tasks:
+            await start_analysis_queue(application)
+            await start_alert_engine(application)
+            if PRICE_FEED_ENABLED:
+                price_feed.start()
+            governor.start()
+        if pool is not None:
+            pool.start_feeds()
+        await diag_server.start()
+        logger.info("Bot is running. Press Ctrl+C to stop.")
+
+        await stop_event.wait()
+
+        # 1. Перестаем принимать новые обновления
+        shutdown_manager.accepting = False
+        await application.updater.stop()
+        logger.info("Stopped fetching updates")
+
+        # 2. Даем запросам в обработке завершиться в пределах дедлайна
+        await shutdown_manager.drain(SHUTDOWN_TIMEOUT)
+        await application.stop()
+
+        # 3. Сбрасываем состояние и закрываем HTTP-сессии
+        await shutdown_manager.run_callbacks()
+
+    logger.info("Bot stopped")
+
+def main():
+    """Main entry point for the bot."""
+    pool = None
+    try:
+        # Validate configuration
+        validate_config()
+        logger.info("Configuration validated successfully")
+
+        # Закрываем web search сессию при завершении (если доступен)
+        if WEB_SEARCH_AVAILABLE and web_search_client:
+            shutdown_manager.register("web_search_session", web_search_client.close, phase="close")
+            shutdown_manager.register("search_cache", search_cache.flush)
+        shutdown_manager.register("state_backend", state_backend.close, phase="close")
+
+        shutdown_manager.register("metrics", metrics.log_summary)
+        shutdown_manager.register("typing_ticker", typing_ticker.stop, phase="close")
+        shutdown_manager.register("finance_process_pool", shutdown_process_pool, phase="close")
+        shutdown_manager.register("crypto_prices", crypto_prices.close, phase="close")
+        shutdown_manager.register("diag_server", diag_server.stop, phase="close")
+
+        # Setup and start bot
+        # Оповещения и задания раскладываются по файлам процессов до их запуска
+        for path in (alert_engine.path, analysis_queue.path):
+            reshard_file(path, WORKER_PROCESSES)
+
+        if WORKER_PROCESSES > 1:
+            pool = WorkerPool(TELEGRAM_BOT_TOKEN, WORKER_PROCESSES)
+            pool.start()
+            # Рабочие процессы сами дожидаются своих запросов, фронт ждет процессы
+            shutdown_manager.register("worker_pool", pool.stop)
+            shutdown_manager.register("price_feed", price_feed.stop, phase="close")
+            application = setup_front(TELEGRAM_BOT_TOKEN, pool)
+        else:
+            application = setup_bot(TELEGRAM_BOT_TOKEN)
+            # Прерванные задания остаются в файле очереди и выполнятся после перезапуска
+            shutdown_manager.register("analysis_queue", analysis_queue.stop)
+            shutdown_manager.register("price_feed", price_feed.stop, phase="close")
+            shutdown_manager.register("alerts", alert_engine.stop)
+            shutdown_manager.register("governor", governor.stop, phase="close")
+        logger.info("Starting Telegram bot...")
+        asyncio.run(run_bot(application, background_tasks=WORKER_PROCESSES <= 1, pool=pool))
+
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
-        signal_handler(signal.SIGINT, None)
     except Exception as e:
         logger.error(f"Bot startup failed: {e}")
         sys.exit(1)
+    finally:
+        # Рабочие процессы не daemon: после сбоя фронта их надо остановить явно
+        if pool is not None:
+            pool.terminate()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,329 @@
+"""
+Ценовые уведомления: "напиши, когда доллар будет 100".
+
+- уведомления хранятся по инструментам в двух отсортированных списках
+  (выше/ниже порога), так что проверка на каждой котировке - бинарный поиск
+  плюс сработавшие уведомления, без перебора всех
+- котировки приходят подпиской на FinanceDataClient (включая тики WebSocket-фида);
+  инструменты, по которым свежих котировок нет, раз в ALERT_CHECK_INTERVAL
+  запрашиваются по одному разу на инструмент, а не на каждое уведомление
+- сработавшие уведомления одного чата собираются в одно сообщение
+- уведомления сохраняются в файл и переживают перезапуск
+"""
+import logging
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+from bisect import bisect_left, insort
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import ALERTS_FILE, ALERT_MAX_PER_CHAT, ALERT_CHECK_INTERVAL, ALERT_BATCH_INTERVAL
+from modules.metrics import metrics
+from modules.instruments import instrument_index
+
+logger = logging.getLogger(__name__)
+
+ABOVE = 'above'
+BELOW = 'below'
+
+# Цена: 100, 92.5, 92,5, 70 000
+PRICE_RE = re.compile(r'\d{1,3}(?:[ \u00a0]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?')
+TICKER_RE = re.compile(r'^[A-Za-z][A-Za-z0-9.=\-]{0,11}$')
+
+
+def parse_alert_request(text: str) -> Optional[Tuple[str, float]]:
+    """'доллар 100' / 'BTC 70 000' -> (ключ инструмента, порог); None, если не распознано."""
+    prices = list(PRICE_RE.finditer(text))
+    if not prices:
+        return None
+    match = prices[-1]
+    threshold = float(match.group().replace(' ', '').replace('\u00a0', '').replace(',', '.'))
+    rest = (text[:match.start()] + ' ' + text[match.end():]).lower()
+    mentioned = instrument_index.find(rest)
+    if mentioned:
+        return mentioned[0].key, threshold
+    for word in rest.split():
+        instrument = instrument_index.resolve(word)
+        if instrument:
+            return instrument.key, threshold
+        if TICKER_RE.match(word):
+            return word.upper(), threshold
+    return None
+
+
+class Alert:
+    """Уведомление о достижении ценой порога."""
+
+    __slots__ = ('id', 'chat_id', 'symbol', 'direction', 'threshold', 'created_at')
+
+    def __init__(self, id: int, chat_id: int, symbol: str, direction: str, threshold: float,
+                 created_at: Optional[float] = None):
+        self.id = id
+        self.chat_id = chat_id
+        self.symbol = symbol
+        self.direction = direction
+        self.threshold = threshold
+        self.created_at = created_at or time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Alert":
+        return cls(**data)
+
+    def describe(self) -> str:
+        sign = '≥' if self.direction == ABOVE else '≤'
+        return f"{self.symbol} {sign} {self.threshold:g}"
+
+
+class SymbolAlerts:
+    """
+    Уведомления одного инструмента.
+
+    Оба списка упорядочены так, что сработавшие уведомления всегда в хвосте:
+    above - по убыванию порога (хранится -threshold), below - по возрастанию.
+    Срабатывание - срез хвоста за O(log n + k).
+    """
+
+    __slots__ = ('above', 'below')
+
+    def __init__(self):
+        self.above: List[Tuple[float, int]] = []  # (-threshold, alert id)
+        self.below: List[Tuple[float, int]] = []  # (threshold, alert id)
+
+    def __len__(self) -> int:
+        return len(self.above) + len(self.below)
+
+    def _entry(self, alert: Alert) -> Tuple[List[Tuple[float, int]], Tuple[float, int]]:
+        if alert.direction == ABOVE:
+            return self.above, (-alert.threshold, alert.id)
+        return self.below, (alert.threshold, alert.id)
+
+    def add(self, alert: Alert) -> None:
+        entries, entry = self._entry(alert)
+        insort(entries, entry)
+
+    def remove(self, alert: Alert) -> None:
+        entries, entry = self._entry(alert)
+        i = bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def pop_triggered(self, price: float) -> List[int]:
+        """Id уведомлений, сработавших при цене price (удаляются из списков)."""
+        triggered = []
+        # above: сработали пороги <= price, т.е. -threshold >= -price
+        i = bisect_left(self.above, (-price, -1))
+        if i < len(self.above):
+            triggered.extend(alert_id for _, alert_id in self.above[i:])
+            del self.above[i:]
+        # below: сработали пороги >= price
+        i = bisect_left(self.below, (price, -1))
+        if i < len(self.below):
+            triggered.extend(alert_id for _, alert_id in self.below[i:])
+            del self.below[i:]
+        return triggered
+
+
+class AlertEngine:
+    """Хранение, проверка и доставка ценовых уведомлений."""
+
+    def __init__(self, path: str = ALERTS_FILE, max_per_chat: int = ALERT_MAX_PER_CHAT,
+                 check_interval: float = ALERT_CHECK_INTERVAL, batch_interval: float = ALERT_BATCH_INTERVAL):
+        self.path = path
+        self.max_per_chat = max_per_chat
+        self.check_interval = check_interval
+        self.batch_interval = batch_interval
+        self._alerts: Dict[int, Alert] = {}
+        self._books: Dict[str, SymbolAlerts] = {}
+        self._ids = itertools.count(1)
+        # Сработавшие уведомления, ожидающие отправки: chat_id -> [(alert, цена)]
+        self._pending: Dict[int, List[Tuple[Alert, float]]] = {}
+        self._dirty = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._deliver: Optional[Callable[[int, str], Awaitable[Any]]] = None
+        self._fetch_quote: Optional[Callable[[str], Awaitable[Optional[Dict]]]] = None
+        self._is_fresh: Optional[Callable[[str], bool]] = None
+
+    def __len__(self) -> int:
+        return len(self._alerts)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def for_chat(self, chat_id: int) -> List[Alert]:
+        return sorted((a for a in self._alerts.values() if a.chat_id == chat_id), key=lambda a: a.id)
+
+    def symbols(self) -> List[str]:
+        """Инструменты с активными уведомлениями."""
+        return [symbol for symbol, book in self._books.items() if book]
+
+    def _index(self, alert: Alert) -> None:
+        self._alerts[alert.id] = alert
+        self._books.setdefault(alert.symbol, SymbolAlerts()).add(alert)
+
+    def add(self, chat_id: int, symbol: str, threshold: float, current_price: float) -> Optional[Alert]:
+        """
+        Добавить уведомление; направление определяется текущей ценой.
+        None, если у чата уже ALERT_MAX_PER_CHAT уведомлений.
+        """
+        if sum(1 for a in self._alerts.values() if a.chat_id == chat_id) >= self.max_per_chat:
+            return None
+        direction = ABOVE if threshold > current_price else BELOW
+        alert = Alert(next(self._ids), chat_id, symbol.upper(), direction, threshold)
+        self._index(alert)
+        self._save()
+        metrics.inc("alerts.created")
+        logger.info(f"🔔 Alert {alert.id} for chat {chat_id}: {alert.describe()} (now {current_price})")
+        return alert
+
+    def remove(self, chat_id: int, alert_id: int) -> bool:
+        alert = self._alerts.get(alert_id)
+        if alert is None or alert.chat_id != chat_id:
+            return False
+        self._drop(alert)
+        self._save()
+        return True
+
+    def clear(self, chat_id: int) -> int:
+        alerts = self.for_chat(chat_id)
+        for alert in alerts:
+            self._drop(alert)
+        if alerts:
+            self._save()
+        return len(alerts)
+
+    def _drop(self, alert: Alert) -> None:
+        del self._alerts[alert.id]
+        book = self._books.get(alert.symbol)
+        if book is not None:
+            book.remove(alert)
+            if not book:
+                del self._books[alert.symbol]
+
+    def on_quote(self, symbol: str, price: float) -> int:
+        """
+        Проверить уведомления инструмента по новой цене (подписчик FinanceDataClient).
+        Возвращает число сработавших уведомлений.
+        """
+        book = self._books.get(symbol)
+        if book is None:
+            return 0
+        triggered = book.pop_triggered(price)
+        if not triggered:
+            return 0
+        if not book:
+            del self._books[symbol]
+        for alert_id in triggered:
+            alert = self._alerts.pop(alert_id)
+            self._pending.setdefault(alert.chat_id, []).append((alert, price))
+        self._dirty = True
+        metrics.inc("alerts.triggered", len(triggered))
+        logger.info(f"🔔 {len(triggered)} alerts triggered for {symbol} at {price}")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return len(triggered)
+
+    @staticmethod
+    def format_notification(items: List[Tuple[Alert, float]]) -> str:
+        lines = [f"• {alert.describe()}: сейчас {price:g}" for alert, price in items]
+        header = "🔔 Цена достигла заданного уровня:" if len(items) == 1 else "🔔 Сработали уведомления о цене:"
+        return "\n".join([header, *lines])
+
+    async def start(self, deliver: Callable[[int, str], Awaitable[Any]],
+                    fetch_quote: Callable[[str], Awaitable[Optional[Dict]]],
+                    is_fresh: Optional[Callable[[str], bool]] = None) -> None:
+        """
+        Запустить доставку и проверку.
+        deliver(chat_id, text) отправляет сообщение, fetch_quote(symbol) запрашивает котировку
+        (и тем самым передает ее подписчикам), is_fresh(symbol) - есть ли по инструменту
+        свежие потоковые котировки, которые не нужно запрашивать.
+        """
+        self._deliver = deliver
+        self._fetch_quote = fetch_quote
+        self._is_fresh = is_fresh
+        self._wakeup = asyncio.Event()
+        for alert in self._load():
+            self._index(alert)
+        if self._alerts:
+            self._ids = itertools.count(max(self._alerts) + 1)
+            logger.info(f"📥 Restored {len(self._alerts)} price alerts")
+        self._tasks = [asyncio.create_task(self._deliver_loop()), asyncio.create_task(self._check_loop())]
+
+    async def _deliver_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # Даем накопиться уведомлениям, сработавшим на соседних тиках
+            await asyncio.sleep(self.batch_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Отправить накопленные уведомления (одно сообщение на чат) и сохранить изменения."""
+        pending, self._pending = self._pending, {}
+        if self._dirty:
+            self._dirty = False
+            self._save()
+        for chat_id, items in pending.items():
+            try:
+                await self._deliver(chat_id, self.format_notification(items))
+                metrics.inc("alerts.delivered", len(items))
+            except Exception as e:
+                logger.error(f"Failed to deliver {len(items)} alerts to chat {chat_id}: {e}")
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    async def check(self) -> None:
+        """Запросить котировки инструментов с уведомлениями, по которым нет потоковых данных."""
+        symbols = [s for s in self.symbols() if not (self._is_fresh and self._is_fresh(s))]
+        if not symbols:
+            return
+        results = await asyncio.gather(*(self._fetch_quote(s) for s in symbols), return_exceptions=True)
+        for symbol, result in zip(symbols, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Alert check failed for {symbol}: {result}")
+
+    def _load(self) -> List[Alert]:
+        if not self.path:
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return [Alert.from_dict(item) for item in json.load(f)]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"⚠️ Alerts file {self.path} is unreadable: {e}")
+            return []
+
+    def _save(self) -> None:
+        """Сохранить уведомления (атомарно, через временный файл)."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([alert.to_dict() for alert in self._alerts.values()], f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save alerts to {self.path}: {e}")
+
+    async def stop(self) -> None:
+        """Остановить проверку, отправить накопленные уведомления и сохранить оставшиеся."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._deliver is not None:
+            await self.flush()
+        self._save()
+
+
+alert_engine = AlertEngine()
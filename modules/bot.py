@@ -2,7 +2,18 @@ import logging
 import asyncio
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from modules.llm import llm_client, clear_chat_history
+from config import CONCURRENT_UPDATES, RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW, JOBS_ENABLED, ALERTS_ENABLED
+from modules.llm import llm_client, reset_chat
+from modules.lifecycle import shutdown_manager
+from modules.state import state_backend, chat_locks
+from modules.outbound import outbound, typing_ticker
+from modules.jobs import analysis_queue, AnalysisJob
+from modules.routing import is_long_analysis
+from modules.alerts import alert_engine, parse_alert_request
+from modules.finance_data import finance_client
+from modules.portfolio import portfolio_analyzer, parse_holdings, format_portfolio_summary
+from modules.diagnostics import diagnostics, format_report
+from modules.governor import governor
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +37,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "⚠️ *Помните: это не персональные инвестиционные советы*\n\n"
         "**Команды:**\n"
         "• /help - подробная справка\n"
+        "• /alert - уведомить, когда цена достигнет уровня\n"
+        "• /portfolio - анализ портфеля: доходность, риск, корреляции\n"
         "• /clear - очистить историю диалога"
     )
     
@@ -36,7 +49,7 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     chat_id = update.effective_chat.id
     user = update.effective_user
     
-    clear_chat_history(chat_id)
+    await reset_chat(chat_id)
     logger.info(f"Chat {chat_id}, User {user.id} ({user.username}) cleared chat history")
     
     await update.message.reply_text("🗑️ История диалога очищена. Начинаем с чистого листа!")
@@ -65,6 +78,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "**Команды:**\n"
         "• `/start` - информация о боте\n"
         "• `/help` - эта справка\n"
+        "• `/alert доллар 100` - уведомление о цене (`/alert` - список)\n"
+        "• `/portfolio AAPL 40, MSFT 30, золото 30` - анализ портфеля\n"
         "• `/clear` - очистить историю\n\n"
         "**Технические ограничения:**\n"
         "• Максимум 4000 символов в сообщении\n"
@@ -76,6 +91,139 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     await update.message.reply_text(help_message, parse_mode='Markdown')
 
+ALERT_USAGE = (
+    "🔔 Уведомления о цене:\n"
+    "• /alert доллар 100 - сообщу, когда курс достигнет 100\n"
+    "• /alert BTC 70000 - то же для биткойна или тикера\n"
+    "• /alert - список ваших уведомлений\n"
+    "• /alert удалить 3 - удалить уведомление (или «удалить все»)"
+)
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /alert command: create, list and delete price alerts."""
+    chat_id = update.effective_chat.id
+    args = context.args or []
+    
+    if not alert_engine.running:
+        await update.message.reply_text("🔕 Уведомления о ценах сейчас недоступны.")
+        return
+    
+    if not args:
+        alerts = alert_engine.for_chat(chat_id)
+        if not alerts:
+            await update.message.reply_text(ALERT_USAGE)
+            return
+        lines = [f"{alert.id}. {alert.describe()}" for alert in alerts]
+        await update.message.reply_text("🔔 Ваши уведомления:\n" + "\n".join(lines))
+        return
+    
+    if args[0].lower() in ("удалить", "delete", "del"):
+        target = args[1].lower() if len(args) > 1 else ""
+        if target in ("все", "all"):
+            removed = alert_engine.clear(chat_id)
+            await update.message.reply_text(f"🗑️ Удалено уведомлений: {removed}")
+        elif target.isdigit() and alert_engine.remove(chat_id, int(target)):
+            await update.message.reply_text(f"🗑️ Уведомление {target} удалено")
+        else:
+            await update.message.reply_text("Не нашел такого уведомления. Список: /alert")
+        return
+    
+    parsed = parse_alert_request(" ".join(args))
+    if not parsed:
+        await update.message.reply_text(ALERT_USAGE)
+        return
+    symbol, threshold = parsed
+    
+    quote = await finance_client.get_instrument_quote(symbol)
+    if not quote:
+        await update.message.reply_text(f"❌ Не удалось получить текущую цену {symbol}. Проверьте тикер.")
+        return
+    price = quote['price']
+    currency = quote.get('currency', '')
+    if threshold == price:
+        await update.message.reply_text(f"Цена {symbol} уже {price} {currency}.")
+        return
+    
+    alert = alert_engine.add(chat_id, symbol, threshold, price)
+    if alert is None:
+        await update.message.reply_text(
+            f"⚠️ Достигнут лимит уведомлений ({alert_engine.max_per_chat}). Удалите ненужные: /alert"
+        )
+        return
+    logger.info(f"Chat {chat_id} set alert {alert.id}: {alert.describe()}")
+    await update.message.reply_text(
+        f"✅ Сообщу, когда {alert.describe()} {currency}. Сейчас: {price} {currency}.\n"
+        f"Удалить: /alert удалить {alert.id}"
+    )
+
+PORTFOLIO_USAGE = (
+    "📊 Анализ портфеля за последний год:\n"
+    "• /portfolio AAPL 40, MSFT 30, золото 30 - тикеры и веса (доли, проценты или суммы)\n"
+    "• /portfolio SBER.ME GAZP.ME LKOH.ME - без весов позиции считаются равными\n"
+    "Посчитаю доходность, волатильность, бету, максимальную просадку и корреляции."
+)
+
+async def portfolio_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /portfolio command: compute portfolio analytics and add LLM commentary."""
+    chat_id = update.effective_chat.id
+    request = " ".join(context.args or [])
+    
+    rejected = []
+    holdings = parse_holdings(request, rejected)
+    if rejected:
+        # Без нераспознанных позиций веса остальных были бы неверными
+        await update.message.reply_text(
+            f"❓ Не удалось распознать: {', '.join(rejected)}\n\n{PORTFOLIO_USAGE}"
+        )
+        return
+    if not holdings:
+        await update.message.reply_text(PORTFOLIO_USAGE)
+        return
+    
+    if not shutdown_manager.accepting:
+        await update.message.reply_text("🔄 Бот перезапускается. Пожалуйста, повторите запрос через минуту.")
+        return
+    
+    async def send_typing():
+        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    async with shutdown_manager.track("portfolio"), typing_ticker.track(chat_id, send_typing), chat_locks(chat_id):
+        result = await portfolio_analyzer.analyze(holdings)
+        if not result:
+            await update.message.reply_text("❌ Не удалось получить историю цен для портфеля. Попробуйте позже.")
+            return
+        summary = format_portfolio_summary(result, portfolio_analyzer.benchmark)
+        logger.info(f"Chat {chat_id} portfolio analytics for {len(holdings)} positions")
+        
+        reply = summary
+        if result.get('symbols'):
+            try:
+                reply = await llm_client.generate_portfolio_commentary(request, summary, chat_id)
+            except Exception as e:
+                # Цифры посчитаны и без LLM - отправляем их без комментария
+                logger.error(f"Portfolio commentary failed for chat {chat_id}: {e}")
+        
+        async with typing_ticker.paused(chat_id):
+            await outbound.send_text(chat_id, reply, update.message.reply_text)
+
+async def diag_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /diag command: runtime diagnostics for admins (summary, memory, profile)."""
+    user = update.effective_user
+    chat_id = update.effective_chat.id
+    if not diagnostics.is_admin(user.id if user else None):
+        logger.warning(f"Chat {chat_id}, User {user.id if user else None} tried /diag without admin rights")
+        return
+    
+    args = context.args or []
+    command = args[0].lower() if args else ""
+    seconds = args[1] if len(args) > 1 else None
+    if command in ("memory", "mem", "profile", "prof"):
+        await update.message.reply_text(f"⏱️ Собираю данные {diagnostics.clamp_seconds(seconds):g} с...")
+    
+    logger.info(f"Chat {chat_id}, User {user.id} requested diagnostics: {command or 'summary'}")
+    report = await diagnostics.run(command, seconds)
+    await outbound.send_text(chat_id, format_report(report), update.message.reply_text)
+
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle text messages using LLM."""
     user = update.effective_user
@@ -84,44 +232,83 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     logger.info(f"Chat {chat_id}, User {user.id} ({user.username}) sent: {message_text[:50]}...")
     
+    # Во время остановки новые запросы не берем, чтобы успеть завершить текущие
+    if not shutdown_manager.accepting:
+        logger.info(f"Bot is shutting down, rejecting message from chat {chat_id}")
+        try:
+            await update.message.reply_text("🔄 Бот перезапускается. Пожалуйста, повторите вопрос через минуту.")
+        except Exception as e:
+            logger.warning(f"Failed to send shutdown notice to chat {chat_id}: {e}")
+        return
+    
+    # Ограничение частоты сообщений (общее для всех экземпляров бота)
     try:
-        # Показываем индикатор "печатает..."
-        logger.info(f"🔄 Sending typing indicator to chat {chat_id}")
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        logger.info(f"✅ Typing indicator sent to chat {chat_id}")
+        limited = await state_backend.hit_rate_limit(f"chat:{chat_id}", RATE_LIMIT_MESSAGES, RATE_LIMIT_WINDOW)
+    except Exception as e:
+        logger.warning(f"Rate limit check failed for chat {chat_id}: {e}")
+        limited = False
+    if limited:
+        logger.warning(f"Rate limit exceeded for chat {chat_id}")
+        await update.message.reply_text("⏳ Слишком много сообщений. Пожалуйста, подождите немного.")
+        return
+    
+    # Развернутый анализ не уложится в таймаут ответа: выполняем в фоне, ответ придет отдельно
+    if JOBS_ENABLED and analysis_queue.running and is_long_analysis(message_text):
+        job = analysis_queue.submit(chat_id, message_text, priority=len(message_text.split()))
+        if job:
+            await update.message.reply_text(
+                "🕐 Вопрос требует развернутого анализа. Подготовлю его в фоне и пришлю "
+                f"отдельным сообщением (место в очереди: {analysis_queue.position(job)})."
+            )
+            return
+        logger.warning(f"Analysis queue is full, answering chat {chat_id} interactively")
+    
+    # При сильной перегрузке сообщение ждет места или отклоняется (см. modules.governor)
+    if not await governor.admit():
+        logger.warning(f"Overloaded (level {governor.level_name}), rejecting message from chat {chat_id}")
+        await update.message.reply_text("🚦 Сейчас очень много запросов. Пожалуйста, повторите вопрос через минуту.")
+        return
+    
+    try:
+        # Поиск данных начинаем сразу, не дожидаясь индикатора "печатает..." и истории
+        enrichment = llm_client.start_enrichment(message_text)
         
-        # Генерируем ответ через LLM с учетом истории чата
-        # Создаем задачу для периодического обновления typing indicator
-        async def keep_typing():
-            while True:
-                await asyncio.sleep(4)  # Обновляем каждые 4 секунды
-                try:
-                    await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-                    logger.debug(f"🔄 Refreshed typing indicator for chat {chat_id}")
-                except:
-                    break
+        # Индикатор "печатает..." показывается, пока у чата есть необработанные сообщения,
+        # в том числе ждущие своей очереди; обновляет его общий таймер
+        async def send_typing():
+            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
         
-        typing_task = asyncio.create_task(keep_typing())
+        # Сообщения одного чата обрабатываем строго по порядку
+        async with shutdown_manager.track("message"), typing_ticker.track(chat_id, send_typing), chat_locks(chat_id):
+            await _process_text_message(update, context, enrichment)
+    finally:
+        # Место освобождается только после ответа: поиск тоже занимает ресурсы
+        governor.release()
+
+async def _process_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE, enrichment=None) -> None:
+    """Generate the LLM answer for a text message and deliver it."""
+    chat_id = update.effective_chat.id
+    message_text = update.message.text
+    
+    try:
+        async def reply(text: str):
+            # Пока уходит ответ, индикатор не обновляем - Telegram снимает его при отправке
+            async with typing_ticker.paused(chat_id):
+                return await outbound.send_text(chat_id, text, update.message.reply_text)
         
-        try:
-            response = await llm_client.generate_response(message_text, chat_id)
-        finally:
-            typing_task.cancel()  # Останавливаем typing indicator
+        response = await llm_client.generate_response(
+            message_text, chat_id, followup=reply, enrichment=enrichment
+        )
         
-        # Пытаемся отправить ответ с retry
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                await update.message.reply_text(response)
-                logger.info(f"LLM response sent to chat {chat_id} (attempt {attempt + 1})")
-                break
-            except Exception as send_error:
-                logger.warning(f"Failed to send response attempt {attempt + 1}: {send_error}")
-                if attempt == max_retries - 1:
-                    # Последняя попытка с упрощенным сообщением
-                    await update.message.reply_text("Ответ получен, но возникли проблемы с отправкой. Попробуйте повторить запрос.")
-                else:
-                    await asyncio.sleep(1)  # Пауза перед retry
+        # Длинный ответ уходит несколькими сообщениями, с учетом лимитов Telegram
+        try:
+            await reply(response)
+            logger.info(f"LLM response sent to chat {chat_id}")
+            # Ответ отправлен - обновляем сводку диалога в фоне
+            llm_client.schedule_summary(chat_id)
+        except Exception as send_error:
+            logger.warning(f"Failed to send response to chat {chat_id}: {send_error}")
+            await update.message.reply_text("Ответ получен, но возникли проблемы с отправкой. Попробуйте повторить запрос.")
         
     except Exception as e:
         logger.error(f"Error processing message for chat {chat_id}: {e}")
@@ -131,14 +318,55 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         except:
             logger.error(f"Failed to send error message to chat {chat_id}")
 
-def setup_bot(token: str) -> Application:
-    """Setup and configure the Telegram bot."""
-    application = Application.builder().token(token).build()
+async def start_analysis_queue(application: Application) -> None:
+    """Запустить фоновую очередь развернутых анализов (после application.start())."""
+    if not JOBS_ENABLED:
+        return
+    
+    async def handle(job: AnalysisJob) -> str:
+        answer = await llm_client.generate_deep_analysis(job.question, job.chat_id, analysis_queue.timeout)
+        llm_client.schedule_summary(job.chat_id)
+        question = job.question if len(job.question) <= 80 else job.question[:80] + "…"
+        return f"📊 Развернутый анализ по вопросу «{question}»:\n\n{answer}"
+    
+    async def deliver(chat_id: int, text: str) -> None:
+        await outbound.send_text(chat_id, text, lambda part: application.bot.send_message(chat_id=chat_id, text=part))
+    
+    await analysis_queue.start(handle, deliver)
+
+async def start_alert_engine(application: Application) -> None:
+    """Запустить проверку и доставку ценовых уведомлений (после application.start())."""
+    if not ALERTS_ENABLED:
+        return
+    
+    async def deliver(chat_id: int, text: str) -> None:
+        await outbound.send_text(chat_id, text, lambda part: application.bot.send_message(chat_id=chat_id, text=part))
+    
+    # Потоковые котировки приходят сами, такие инструменты не запрашиваем
+    def is_fresh(symbol: str) -> bool:
+        return finance_client.get_live_quote(symbol) is not None
+    
+    finance_client.add_quote_listener(alert_engine.on_quote)
+    await alert_engine.start(deliver, finance_client.get_instrument_quote, is_fresh)
+
+def setup_bot(token: str, with_updater: bool = True) -> Application:
+    """Setup and configure the Telegram bot.
+
+    Worker processes get updates from the front process, so they are built without an Updater.
+    """
+    # Разные чаты обрабатываются параллельно, порядок внутри чата держит chat_locks
+    builder = Application.builder().token(token).concurrent_updates(CONCURRENT_UPDATES)
+    if not with_updater:
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("clear", clear_command))
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("portfolio", portfolio_command))
+    application.add_handler(CommandHandler("diag", diag_command))
     
     # Add message handler for text messages (LLM functionality)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -0,0 +1,186 @@
+"""
+Цены криптовалют из CoinGecko.
+
+Один bulk-запрос /simple/price обновляет таблицу цен всех отслеживаемых монет
+раз в COINGECKO_REFRESH секунд; get_crypto_price отдает цену из памяти.
+"""
+import logging
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import requests
+from config import COINGECKO_BASE_URL, COINGECKO_API_KEY, COINGECKO_REFRESH
+
+logger = logging.getLogger(__name__)
+
+# Тикер -> id монеты в CoinGecko
+COIN_IDS: Dict[str, str] = {
+    'BTC': 'bitcoin',
+    'ETH': 'ethereum',
+    'USDT': 'tether',
+    'BNB': 'binancecoin',
+    'SOL': 'solana',
+    'XRP': 'ripple',
+    'USDC': 'usd-coin',
+    'TON': 'the-open-network',
+    'DOGE': 'dogecoin',
+    'ADA': 'cardano',
+    'TRX': 'tron',
+    'AVAX': 'avalanche-2',
+    'DOT': 'polkadot',
+    'LINK': 'chainlink',
+    'LTC': 'litecoin',
+    'BCH': 'bitcoin-cash',
+    'XLM': 'stellar',
+    'ATOM': 'cosmos',
+    'NEAR': 'near',
+    'SHIB': 'shiba-inu',
+}
+
+COIN_NAMES: Dict[str, str] = {
+    'BTC': 'Bitcoin', 'ETH': 'Ethereum', 'USDT': 'Tether', 'BNB': 'BNB', 'SOL': 'Solana',
+    'XRP': 'XRP', 'USDC': 'USD Coin', 'TON': 'Toncoin', 'DOGE': 'Dogecoin', 'ADA': 'Cardano',
+    'TRX': 'TRON', 'AVAX': 'Avalanche', 'DOT': 'Polkadot', 'LINK': 'Chainlink', 'LTC': 'Litecoin',
+    'BCH': 'Bitcoin Cash', 'XLM': 'Stellar', 'ATOM': 'Cosmos', 'NEAR': 'NEAR Protocol', 'SHIB': 'Shiba Inu',
+}
+
+# Таблица старше стольких интервалов обновления считается недостоверной
+MAX_AGE_INTERVALS = 5
+
+
+class CoinGeckoPrices:
+    """Таблица цен криптовалют в памяти с фоновым обновлением."""
+
+    def __init__(self, base_url: str = COINGECKO_BASE_URL, api_key: str = COINGECKO_API_KEY,
+                 refresh_interval: float = COINGECKO_REFRESH, coins: Optional[Dict[str, str]] = None):
+        self.base_url = base_url.rstrip('/')
+        self.refresh_interval = refresh_interval
+        self.coins = coins or COIN_IDS
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json'})
+        if api_key:
+            self.session.headers['x-cg-demo-api-key'] = api_key
+        self.prices: Dict[str, Dict] = {}
+        self.updated_at = 0.0  # time.monotonic() последнего успешного обновления
+        self._task: Optional[asyncio.Task] = None
+        self._first_load: Optional[asyncio.Task] = None
+        # Цены приходят из другого процесса (load), свое обновление не запускается
+        self.remote = False
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self.prices) and time.monotonic() - self.updated_at < self.refresh_interval * MAX_AGE_INTERVALS
+
+    def lookup(self, symbol: str) -> Optional[Dict]:
+        """Цена монеты из таблицы (без ожидания сети); None, если данных нет или они устарели."""
+        if not self.fresh:
+            return None
+        return self.prices.get(symbol.upper())
+
+    async def get_price(self, symbol: str) -> Optional[Dict]:
+        """Цена монеты; при первом обращении дожидается загрузки таблицы."""
+        symbol = symbol.upper()
+        if symbol not in self.coins:
+            return None
+        self.start()
+        if not self.prices and self._first_load is not None:
+            await asyncio.shield(self._first_load)
+        return self.lookup(symbol)
+
+    def start(self) -> None:
+        """Запустить фоновое обновление (идемпотентно)."""
+        if self.remote:
+            return
+        if self._task is None or self._task.done():
+            if not self.prices:
+                self._first_load = asyncio.create_task(self.refresh())
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        if self._first_load is not None:
+            await asyncio.gather(self._first_load, return_exceptions=True)
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def refresh(self) -> bool:
+        """Обновить цены всех монет одним запросом."""
+        started = time.monotonic()
+        try:
+            data = await asyncio.to_thread(self._fetch)
+        except Exception as e:
+            logger.warning(f"⚠️ CoinGecko refresh failed: {e}")
+            return False
+
+        timestamp = datetime.now().isoformat()
+        prices = {}
+        for symbol, coin_id in self.coins.items():
+            entry = data.get(coin_id)
+            if not entry or entry.get('usd') is None:
+                continue
+            price = float(entry['usd'])
+            change_percent = float(entry.get('usd_24h_change') or 0.0)
+            # Изменение за 24 часа в пересчете из процента
+            previous = price / (1 + change_percent / 100) if change_percent > -100 else price
+            updated = entry.get('last_updated_at')
+            prices[symbol] = {
+                'symbol': f"{symbol}-USD",
+                'price': round(price, 6) if price < 1 else round(price, 2),
+                'change': round(price - previous, 6) if price < 1 else round(price - previous, 2),
+                'change_percent': round(change_percent, 2),
+                'currency': 'USD',
+                'name': COIN_NAMES.get(symbol, symbol),
+                'market_cap': entry.get('usd_market_cap'),
+                'volume': entry.get('usd_24h_vol'),
+                'source': 'CoinGecko',
+                'timestamp': datetime.fromtimestamp(updated).isoformat() if updated else timestamp,
+            }
+        if not prices:
+            logger.warning("⚠️ CoinGecko returned no prices")
+            return False
+
+        self.prices = prices
+        self.updated_at = time.monotonic()
+        logger.info(f"🪙 CoinGecko prices updated: {len(prices)} coins in {time.monotonic() - started:.2f}s")
+        return True
+
+    def snapshot(self) -> Tuple[Dict[str, Dict], float]:
+        """Таблица цен и ее возраст в секундах - для передачи в другой процесс."""
+        return self.prices, time.monotonic() - self.updated_at
+
+    def load(self, prices: Dict[str, Dict], age: float) -> None:
+        """Применить снимок другого процесса (см. snapshot)."""
+        if prices:
+            self.prices = prices
+            self.updated_at = time.monotonic() - age
+
+    def _fetch(self) -> Dict:
+        """Bulk-запрос цен (выполняется в потоке)."""
+        response = self.session.get(
+            f"{self.base_url}/simple/price",
+            params={
+                'ids': ','.join(self.coins.values()),
+                'vs_currencies': 'usd',
+                'include_market_cap': 'true',
+                'include_24hr_vol': 'true',
+                'include_24hr_change': 'true',
+                'include_last_updated_at': 'true',
+            },
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self) -> None:
+        """Остановить обновление и закрыть HTTP-сессию."""
+        for task in (self._task, self._first_load):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(t for t in (self._task, self._first_load) if t is not None), return_exceptions=True)
+        self._task = None
+        self._first_load = None
+        self.session.close()
+
+
+crypto_prices = CoinGeckoPrices()
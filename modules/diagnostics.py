@@ -0,0 +1,337 @@
+"""
+Диагностика работающего процесса для операторов: /diag и локальный HTTP-эндпоинт.
+
+Все замеры выполняются только по запросу, в простое модуль ничего не делает:
+- задержка event loop - несколько коротких sleep с измерением опоздания
+- запросы в обработке по этапам, очереди пулов потоков и процессов
+- размеры истории и кешей, распределение памяти по файлам (tracemalloc)
+- профиль по выборкам стеков всех потоков за ограниченное время
+"""
+import json
+import logging
+import asyncio
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit, parse_qs
+from config import ADMIN_IDS, DIAG_HOST, DIAG_PORT, DIAG_MAX_SECONDS, DIAG_SAMPLE_INTERVAL
+from modules import finance_data
+from modules.lifecycle import shutdown_manager
+from modules.llm import chat_histories, chat_summaries, pending_evictions
+from modules.jobs import analysis_queue
+from modules.alerts import alert_engine
+from modules.portfolio import portfolio_analyzer
+from modules.state import state_backend, chat_locks
+from modules.outbound import typing_ticker
+from modules.governor import governor
+try:
+    from modules.web_search import search_cache
+except ImportError:
+    search_cache = None
+
+logger = logging.getLogger(__name__)
+
+LAG_SAMPLES = 5
+LAG_INTERVAL = 0.02
+TOP_ENTRIES = 15
+
+# Кадры, в которых поток ждет (select в event loop, пустая очередь пула), в профиль не попадают
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+
+
+def parse_admin_ids(value: str) -> Set[int]:
+    """"123, 456" -> {123, 456}; нечисловые значения пропускаются."""
+    return {int(part) for part in value.replace(";", ",").split(",") if part.strip().lstrip("-").isdigit()}
+
+
+def _frame_label(code) -> str:
+    """Функция в профиле: файл:функция:строка определения."""
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}"
+
+
+class Diagnostics:
+    """Снимки состояния процесса, профиль и память по запросу оператора."""
+
+    def __init__(self, admin_ids: str = ADMIN_IDS, max_seconds: float = DIAG_MAX_SECONDS,
+                 sample_interval: float = DIAG_SAMPLE_INTERVAL):
+        self.admin_ids = parse_admin_ids(admin_ids)
+        self.max_seconds = max_seconds
+        self.sample_interval = sample_interval
+        # Профиль и трассировка памяти одновременно не запускаются
+        self._busy: Optional[asyncio.Lock] = None
+
+    def is_admin(self, user_id: Optional[int]) -> bool:
+        return user_id is not None and user_id in self.admin_ids
+
+    def clamp_seconds(self, value: Any, default: float = 5) -> float:
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            seconds = default
+        return max(0.1, min(seconds, self.max_seconds))
+
+    @property
+    def busy(self) -> asyncio.Lock:
+        if self._busy is None:
+            self._busy = asyncio.Lock()
+        return self._busy
+
+    async def loop_lag(self, samples: int = LAG_SAMPLES, interval: float = LAG_INTERVAL) -> Dict[str, float]:
+        """Насколько позже запланированного просыпается корутина (мс)."""
+        lags = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - started - interval) * 1000)
+        return {'avg_ms': round(sum(lags) / len(lags), 2), 'max_ms': round(max(lags), 2)}
+
+    def executors(self) -> Dict[str, Dict[str, int]]:
+        """Очереди пула потоков event loop и пула процессов finance_data."""
+        result = {}
+        thread_pool = getattr(asyncio.get_running_loop(), "_default_executor", None)
+        if thread_pool is not None:
+            result['threads'] = {
+                'workers': len(thread_pool._threads),
+                'max_workers': thread_pool._max_workers,
+                'queued': thread_pool._work_queue.qsize(),
+            }
+        process_pool = finance_data._process_pool
+        if process_pool is not None:
+            result['processes'] = {
+                'workers': len(process_pool._processes or {}),
+                'max_workers': process_pool._max_workers,
+                'queued': len(process_pool._pending_work_items),
+            }
+        return result
+
+    def caches(self) -> Dict[str, int]:
+        """Размеры истории, очередей и кешей (число записей)."""
+        sizes = {
+            'chat_histories': len(chat_histories),
+            'history_messages': sum(len(history) for history in chat_histories.values()),
+            'history_chars': sum(len(m['content']) for history in chat_histories.values() for m in history),
+            'chat_summaries': len(chat_summaries),
+            'pending_evictions': sum(len(messages) for messages in pending_evictions.values()),
+            'chat_locks': len(chat_locks),
+            'typing_chats': len(typing_ticker),
+            'analysis_jobs': len(analysis_queue),
+            'alerts': len(alert_engine),
+            'portfolio_matrices': len(portfolio_analyzer._cache),
+        }
+        quotes = getattr(state_backend, "_quotes", None)
+        if quotes is not None:
+            sizes['quote_cache'] = len(quotes)
+        if search_cache is not None:
+            sizes['search_cache'] = len(search_cache._entries)
+        return sizes
+
+    async def snapshot(self) -> Dict[str, Any]:
+        """Сводка: задержка loop, запросы по этапам, пулы, кеши."""
+        return {
+            'pid': os.getpid(),
+            'loop_lag': await self.loop_lag(),
+            'tasks': len(asyncio.all_tasks()),
+            'in_flight': shutdown_manager.in_flight_by_stage(),
+            'load': governor.snapshot(),
+            'executors': self.executors(),
+            'caches': self.caches(),
+            'tracemalloc': tracemalloc.is_tracing(),
+        }
+
+    async def memory(self, seconds: float = 5, top: int = TOP_ENTRIES) -> Dict[str, Any]:
+        """
+        Распределение памяти по файлам.
+
+        Если трассировка уже включена (python -X tracemalloc), снимок берется сразу;
+        иначе она включается на seconds и показывает только выделенное за это время.
+        """
+        async with self.busy:
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start()
+            try:
+                if started_here:
+                    await asyncio.sleep(seconds)
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                if started_here:
+                    tracemalloc.stop()
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        stats = snapshot.statistics("filename")
+        return {
+            'window_seconds': seconds if started_here else None,
+            'traced_kb': round(current / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'top': [
+                {'file': str(stat.traceback[0].filename), 'kb': round(stat.size / 1024, 1), 'blocks': stat.count}
+                for stat in stats[:top]
+            ],
+        }
+
+    async def profile(self, seconds: float = 5, top: int = TOP_ENTRIES) -> Dict[str, Any]:
+        """
+        Профиль по выборкам: каждые sample_interval снимаются стеки всех потоков.
+
+        self - где поток находился в момент выборки, total - функция была в стеке.
+        Доля busy - сколько выборок поток event loop не ждал событий.
+        """
+        async with self.busy:
+            loop_thread = threading.get_ident()
+            done = threading.Event()
+            result: Dict[str, Any] = {}
+            sampler = threading.Thread(
+                target=self._sample, args=(done, loop_thread, result), name="diag-profiler", daemon=True
+            )
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                done.set()
+                await asyncio.to_thread(sampler.join)
+
+        samples = result['samples'] or 1
+        return {
+            'seconds': seconds,
+            'samples': result['samples'],
+            'loop_busy': round(result['loop_busy'] / samples, 3),
+            'self': [{'function': name, 'share': round(count / samples, 3)}
+                     for name, count in result['self'].most_common(top)],
+            'total': [{'function': name, 'share': round(count / samples, 3)}
+                      for name, count in result['total'].most_common(top)],
+        }
+
+    def _sample(self, done: threading.Event, loop_thread: int, result: Dict[str, Any]) -> None:
+        own = threading.get_ident()
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        samples = loop_busy = 0
+        while not done.wait(self.sample_interval):
+            samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                if ident == loop_thread:
+                    loop_busy += 1
+                self_counts[f"{_frame_label(frame.f_code)}@{frame.f_lineno}"] += 1
+                seen = set()
+                while frame is not None:
+                    label = _frame_label(frame.f_code)
+                    if label not in seen:
+                        seen.add(label)
+                        total_counts[label] += 1
+                    frame = frame.f_back
+        result.update(samples=samples, loop_busy=loop_busy, self=self_counts, total=total_counts)
+
+    async def run(self, command: str = "", seconds: Any = None) -> Dict[str, Any]:
+        """Выполнить команду: "" - сводка, "memory" - память, "profile" - профиль."""
+        if command in ("mem", "memory"):
+            return await self.memory(self.clamp_seconds(seconds))
+        if command in ("prof", "profile"):
+            return await self.profile(self.clamp_seconds(seconds))
+        return await self.snapshot()
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Отчет диагностики для Telegram (без разметки)."""
+    lines = []
+    if 'loop_lag' in report:
+        lag = report['loop_lag']
+        lines.append(f"🩺 pid {report['pid']}: задержка loop {lag['avg_ms']} мс (макс {lag['max_ms']}), "
+                     f"задач {report['tasks']}")
+        in_flight = ", ".join(f"{stage} {count}" for stage, count in sorted(report['in_flight'].items()))
+        lines.append(f"⏳ В обработке: {in_flight or 'нет'}")
+        load = report['load']
+        lines.append(f"🚦 Нагрузка: уровень {load['level']} ({load['name']}), LLM в обработке "
+                     f"{load['llm_in_flight']}, ошибок {load['error_rate']:.0%}, ждут {load['queued']}")
+        for name, pool in report['executors'].items():
+            lines.append(f"⚙️ Пул {name}: {pool['workers']}/{pool['max_workers']}, в очереди {pool['queued']}")
+        lines.append("🗄️ " + ", ".join(f"{name} {size}" for name, size in report['caches'].items()))
+    elif 'traced_kb' in report:
+        window = f"выделено за {report['window_seconds']:g} с" if report['window_seconds'] else "с запуска"
+        lines.append(f"🧠 Память ({window}): {report['traced_kb']} КБ, пик {report['peak_kb']} КБ")
+        lines.extend(f"{item['kb']:>10} КБ  {item['blocks']:>7}  {item['file']}" for item in report['top'])
+    elif 'samples' in report:
+        lines.append(f"🔬 Профиль {report['seconds']:g} с: {report['samples']} выборок, "
+                     f"loop занят {report['loop_busy']:.0%}")
+        lines.append("Где (self):")
+        lines.extend(f"{item['share']:>6.1%}  {item['function']}" for item in report['self'])
+        lines.append("В стеке (total):")
+        lines.extend(f"{item['share']:>6.1%}  {item['function']}" for item in report['total'])
+    return "\n".join(lines)
+
+
+class DiagServer:
+    """
+    Локальный HTTP-эндпоинт с теми же отчетами в JSON:
+      GET /diag
+      GET /diag/memory?seconds=5
+      GET /diag/profile?seconds=5
+    """
+
+    def __init__(self, diagnostics: Diagnostics, host: str = DIAG_HOST, port: int = DIAG_PORT):
+        self.diagnostics = diagnostics
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        if not self.port or self._server is not None:
+            return
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"🩺 Diagnostics endpoint on http://{self.host}:{self.port}/diag")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки не нужны, но их надо дочитать
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            status, body = await self._route(request_line.decode("latin-1"))
+        except asyncio.TimeoutError:
+            status, body = "408 Request Timeout", {'error': 'timeout'}
+        except Exception as e:
+            logger.warning(f"Diagnostics request failed: {e}")
+            status, body = "500 Internal Server Error", {'error': str(e)}
+        payload = json.dumps(body, ensure_ascii=False, indent=2).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, request_line: str) -> Tuple[str, Dict[str, Any]]:
+        parts = request_line.split()
+        if len(parts) < 2 or parts[0] != "GET":
+            return "405 Method Not Allowed", {'error': 'GET only'}
+        url = urlsplit(parts[1])
+        path = url.path.rstrip("/")
+        if path != "/diag" and not path.startswith("/diag/"):
+            return "404 Not Found", {'error': 'unknown path'}
+        command = path[len("/diag/"):] if path.startswith("/diag/") else ""
+        if command not in ("", "mem", "memory", "prof", "profile"):
+            return "404 Not Found", {'error': f'unknown report {command}'}
+        seconds = parse_qs(url.query).get('seconds', [None])[0]
+        return "200 OK", await self.diagnostics.run(command, seconds)
+
+
+# Глобальные экземпляры
+diagnostics = Diagnostics()
+diag_server = DiagServer(diagnostics)
@@ -0,0 +1,79 @@
+"""
+Быстрые ответы на простые вопросы о цене без обращения к LLM.
+
+"курс евро", "сколько стоит биткойн" - ответ собирается по шаблону
+из структурированной котировки (ЦБ РФ / Yahoo Finance) за миллисекунды.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CURRENCY_SIGNS = {'RUB': '₽', 'USD': '$', 'EUR': '€'}
+
+# Инструкция для необязательного короткого комментария LLM после быстрого ответа
+ANALYSIS_PROMPT = (
+    "Пользователь уже получил котировку: {quote}. "
+    "Дай краткий комментарий к текущей цене в 2-3 предложениях без повторения цифр целиком."
+)
+
+
+def asset_emoji(symbol: str) -> str:
+    """Эмодзи по типу инструмента."""
+    if symbol.endswith('/RUB') or symbol.endswith('=X'):
+        return '💱'
+    if symbol.endswith('-USD'):
+        return '₿'
+    if symbol.endswith('=F'):
+        return '🥇'
+    return '📈'
+
+
+def format_price(value: float, currency: str) -> str:
+    """Цена с разделителями разрядов и знаком валюты."""
+    text = f"{value:,.4f}".rstrip('0').rstrip('.') if abs(value) < 10 else f"{value:,.2f}"
+    text = text.replace(',', ' ')
+    sign = CURRENCY_SIGNS.get(currency)
+    if sign == '$':
+        return f"${text}"
+    return f"{text} {sign or currency}"
+
+
+def format_timestamp(timestamp: Optional[str]) -> str:
+    """Дата котировки в формате ДД.ММ.ГГГГ ЧЧ:ММ."""
+    if not timestamp:
+        return ""
+    try:
+        return datetime.fromisoformat(timestamp).strftime("%d.%m.%Y %H:%M")
+    except ValueError:
+        return str(timestamp)
+
+
+def render_quote_answer(quote: Dict) -> str:
+    """Ответ пользователю по структурированной котировке."""
+    symbol = quote['symbol']
+    currency = quote.get('currency', 'USD')
+    change = quote.get('change') or 0
+    change_percent = quote.get('change_percent') or 0
+    arrow = '↗️' if change > 0 else '↘️' if change < 0 else '➡️'
+    sign = '+' if change > 0 else ''
+
+    closing = " (цена закрытия)" if quote.get('market_closed') else ""
+    lines = [
+        f"{asset_emoji(symbol)} {quote.get('name') or symbol} ({symbol}): {format_price(quote['price'], currency)}{closing}",
+        f"{arrow} {sign}{change} ({sign}{change_percent}%) за день",
+    ]
+    source = quote.get('source', 'Yahoo Finance')
+    when = format_timestamp(quote.get('timestamp'))
+    lines.append(f"🏦 Источник: {source}" + (f", {when}" if when else ""))
+    lines.append("⚠️ Не является инвестиционной рекомендацией")
+    return "\n".join(lines)
+
+
+def pick_quote(results: List[Dict]) -> Optional[Dict]:
+    """Котировка для быстрого ответа: ровно одна структурированная котировка в результатах."""
+    quotes = [result['quote'] for result in results if result.get('quote')]
+    if len(quotes) != 1:
+        return None
+    return quotes[0]
@@ -3,9 +3,20 @@
 """
 import logging
 import asyncio
-from typing import Dict, Optional, List
-from datetime import datetime, timedelta
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, List
+from datetime import datetime, timedelta, timezone
 import requests
+from config import (
+    QUOTE_CACHE_TTL, FINANCE_PROCESS_WORKERS, COINGECKO_ENABLED, PRICE_FEED_ENABLED, PRICE_FEED_MAX_AGE,
+    MARKET_CALENDAR_ENABLED
+)
+from modules.state import state_backend
+from modules.coingecko import crypto_prices, COIN_IDS
+from modules.price_feed import quote_table
+from modules.instruments import instrument_index
+from modules.market_calendar import market_calendar
 
 try:
     import yfinance as yf
@@ -16,6 +27,117 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Символы Yahoo Finance -> инструменты таблицы потоковых котировок
+LIVE_FEED_SYMBOLS = {'BTC-USD': 'BTC', 'ETH-USD': 'ETH', 'GC=F': 'GOLD', 'USDRUB=X': 'USD'}
+
+# Валюты, курс которых к рублю публикует ЦБ РФ
+CURRENCY_KEYS = ('USD', 'EUR', 'CNY', 'GBP', 'CHF', 'JPY', 'TRY', 'KZT')
+
+def yahoo_symbol(key: str) -> str:
+    """Символ Yahoo Finance по ключу инструмента: USD -> USDRUB=X, BTC -> BTC-USD, GAZP -> GAZP.ME."""
+    key = key.upper()
+    instrument = instrument_index.by_key(key)
+    if instrument:
+        return instrument.symbol
+    if key in CURRENCY_KEYS:
+        return f"{key}RUB=X"
+    if key in COIN_IDS:
+        return f"{key}-USD"
+    return key
+
+def instrument_key(symbol: str) -> str:
+    """Ключ инструмента по символу котировки: USD/RUB, USDRUB=X -> USD; BTC-USD -> BTC; GC=F -> GOLD."""
+    symbol = symbol.upper()
+    for suffix in ('/RUB', 'RUB=X', '-USD'):
+        if symbol.endswith(suffix):
+            return symbol[:-len(suffix)]
+    instrument = instrument_index.by_symbol(symbol)
+    return instrument.key if instrument else symbol
+
+# Пул процессов для разбора данных yfinance/pandas (CPU-bound, упирается в GIL)
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+async def run_cpu_bound(func: Callable, *args):
+    """Выполнить тяжелую функцию в пуле процессов (или в потоке, если пул отключен)."""
+    global _process_pool
+    if FINANCE_PROCESS_WORKERS <= 0:
+        return await asyncio.to_thread(func, *args)
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=FINANCE_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"⚙️ Finance process pool started with {FINANCE_PROCESS_WORKERS} workers")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_process_pool, func, *args)
+
+def shutdown_process_pool() -> None:
+    """Остановить пул процессов."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+        logger.info("Finance process pool stopped")
+
+def fetch_stock_data(symbol: str) -> Optional[Dict]:
+    """Синхронная функция для получения данных через yfinance (выполняется в потоке или процессе)."""
+    try:
+        ticker = yf.Ticker(symbol)
+        info = ticker.info
+        hist = ticker.history(period="1d")
+        
+        if hist.empty:
+            return None
+            
+        current_price = hist['Close'].iloc[-1]
+        volume = hist['Volume'].iloc[-1]
+        prev_close = info.get('previousClose', current_price)
+        change = current_price - prev_close
+        change_percent = (change / prev_close) * 100 if prev_close else 0
+        
+        return {
+            'symbol': symbol,
+            'price': round(float(current_price), 2),
+            'change': round(float(change), 2),
+            'change_percent': round(float(change_percent), 2),
+            'currency': info.get('currency', 'USD'),
+            'name': info.get('longName', symbol),
+            'market_cap': info.get('marketCap'),
+            'volume': int(volume) if volume == volume else None,  # NaN != NaN
+            'timestamp': datetime.now().isoformat()
+        }
+    except Exception as e:
+        logger.error(f"_fetch_stock_data error: {e}")
+        return None
+
+def fetch_price_history(symbols: List[str], period: str) -> Optional[Dict]:
+    """
+    Дневные цены закрытия нескольких инструментов одним запросом yf.download
+    (выполняется в потоке или процессе). Результат - только списки, чтобы дешево передавался между процессами:
+    {'dates': [...], 'closes': {symbol: [цена или NaN по каждой дате]}}
+    """
+    try:
+        data = yf.download(
+            symbols, period=period, interval="1d", auto_adjust=True,
+            progress=False, threads=True, group_by='column'
+        )
+        if data is None or data.empty:
+            return None
+        close = data['Close']
+        if not hasattr(close, 'columns'):
+            close = close.to_frame(name=symbols[0])
+        close = close.dropna(how='all')
+        return {
+            'dates': [index.strftime('%Y-%m-%d') for index in close.index],
+            'closes': {
+                str(column): [float(value) for value in close[column].tolist()]
+                for column in close.columns if close[column].notna().any()
+            },
+        }
+    except Exception as e:
+        logger.error(f"fetch_price_history error: {e}")
+        return None
+
 class FinanceDataClient:
     """
     Клиент для получения финансовых данных через API.
@@ -23,38 +145,101 @@ class FinanceDataClient:
     ДОСТУПНЫЕ ИНТЕГРАЦИИ:
     - Yahoo Finance API - реальные котировки ✅
     - ЦБ РФ API - курсы валют ✅
-    - CoinGecko - криптовалютные данные (планируется)
+    - CoinGecko - криптовалютные данные (таблица цен в памяти) ✅
+    - WebSocket-фид - потоковые котировки BTC, ETH, золота и USD/RUB ✅
     """
     
     def __init__(self):
         self.supported_apis = {
             'yahoo_finance': YFINANCE_AVAILABLE,
             'cbr_ru': True,           # ЦБ РФ не требует библиотек
-            'coinGecko': False,       # TODO: реализовать
+            'coinGecko': COINGECKO_ENABLED,
+            'price_feed': PRICE_FEED_ENABLED,
         }
+        # Подписчики на котировки: callback(ключ инструмента, цена)
+        self._quote_listeners: List[Callable[[str, float], None]] = []
         logger.info(f"🏦 Finance data client initialized. Available APIs: {[k for k, v in self.supported_apis.items() if v]}")
         if not YFINANCE_AVAILABLE:
             logger.error("❌ yfinance NOT INSTALLED! Run: pip install yfinance")
         else:
             logger.info("✅ yfinance available for real data")
     
+    def add_quote_listener(self, callback: Callable[[str, float], None]) -> None:
+        """
+        Подписаться на все котировки, которые получает клиент:
+        ответы API, кеш и тики потокового фида.
+        """
+        self._quote_listeners.append(callback)
+        quote_table.listeners.append(callback)
+    
+    def _publish(self, quote: Optional[Dict]) -> Optional[Dict]:
+        """Передать котировку подписчикам и вернуть ее без изменений."""
+        if quote and self._quote_listeners and quote.get('price') is not None:
+            key = instrument_key(quote['symbol'])
+            for listener in self._quote_listeners:
+                try:
+                    listener(key, quote['price'])
+                except Exception as e:
+                    logger.warning(f"Quote listener failed for {key}: {e}")
+        return quote
+    
+    async def get_instrument_quote(self, key: str) -> Optional[Dict]:
+        """Котировка по ключу инструмента (USD, BTC, GOLD, SBER, AAPL...) или символу Yahoo Finance."""
+        key = key.upper()
+        if key in CURRENCY_KEYS:
+            return await self.get_currency_rate(key, "RUB")
+        if key in COIN_IDS:
+            return await self.get_crypto_price(key)
+        return await self.get_stock_quote(yahoo_symbol(key))
+    
+    async def get_price_history(self, symbols: List[str], period: str = "1y") -> Optional[Dict]:
+        """Дневные цены закрытия нескольких инструментов одним запросом (см. fetch_price_history)."""
+        if not YFINANCE_AVAILABLE or not symbols:
+            return None
+        logger.info(f"🔍 Getting {period} price history for {len(symbols)} symbols")
+        return await run_cpu_bound(fetch_price_history, list(symbols), period)
+    
+    def get_live_quote(self, key: str) -> Optional[Dict]:
+        """
+        Котировка из таблицы потокового фида (без сетевых запросов).
+        None, если фид отключен, инструмент не транслируется или данные устарели.
+        """
+        if not self.supported_apis['price_feed']:
+            return None
+        quote = quote_table.get(key, max_age=PRICE_FEED_MAX_AGE)
+        if quote:
+            logger.debug(f"📡 Live quote for {key}: {quote['price']} ({quote['age']}s old)")
+        return quote
+    
     async def get_stock_quote(self, symbol: str) -> Optional[Dict]:
         """
         Получить текущую котировку акции через Yahoo Finance.
         """
+        live_key = LIVE_FEED_SYMBOLS.get(symbol)
+        if live_key:
+            live = self.get_live_quote(live_key)
+            if live:
+                return self._publish(live)
+        
         if not YFINANCE_AVAILABLE:
             logger.warning("yfinance not available")
             return None
             
         try:
+            cached = await self._get_cached_quote(f"stock:{symbol}")
+            if cached:
+                return self._publish(cached)
+            
             logger.info(f"🔍 Getting stock quote for {symbol}")
             
-            # Выполняем запрос в отдельном потоке
-            ticker_data = await asyncio.to_thread(self._fetch_stock_data, symbol)
+            # Выполняем запрос и разбор в отдельном потоке или процессе
+            ticker_data = await run_cpu_bound(fetch_stock_data, symbol)
             
             if ticker_data:
                 logger.info(f"✅ Stock data found for {symbol}: {ticker_data['price']}")
-                return ticker_data
+                ttl = self._market_cache_ttl(symbol, ticker_data)
+                await self._cache_quote(f"stock:{symbol}", ticker_data, ttl)
+                return self._publish(ticker_data)
             else:
                 logger.warning(f"❌ No stock data found for {symbol}")
                 return None
@@ -63,36 +248,57 @@ class FinanceDataClient:
             logger.error(f"Error getting stock quote for {symbol}: {e}")
             return None
     
-    def _fetch_stock_data(self, symbol: str) -> Optional[Dict]:
-        """Синхронная функция для получения данных через yfinance."""
+    async def _get_cached_quote(self, key: str) -> Optional[Dict]:
+        """Котировка из кеша (общего для всех экземпляров бота при STATE_BACKEND=redis)."""
         try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
-            hist = ticker.history(period="1d")
-            
-            if hist.empty:
-                return None
-                
-            current_price = hist['Close'].iloc[-1]
-            prev_close = info.get('previousClose', current_price)
-            change = current_price - prev_close
-            change_percent = (change / prev_close) * 100 if prev_close else 0
-            
-            return {
-                'symbol': symbol,
-                'price': round(current_price, 2),
-                'change': round(change, 2),
-                'change_percent': round(change_percent, 2),
-                'currency': info.get('currency', 'USD'),
-                'name': info.get('longName', symbol),
-                'market_cap': info.get('marketCap'),
-                'volume': hist['Volume'].iloc[-1] if not hist.empty else None,
-                'timestamp': datetime.now().isoformat()
-            }
+            cached = await state_backend.get_quote(key)
+            if cached:
+                logger.debug(f"📦 Quote cache hit: {key}")
+            return cached
         except Exception as e:
-            logger.error(f"_fetch_stock_data error: {e}")
+            logger.warning(f"Quote cache read failed for {key}: {e}")
             return None
     
+    async def _cache_quote(self, key: str, data: Dict, ttl: float = QUOTE_CACHE_TTL) -> None:
+        """Сохранить котировку в кеш на ttl секунд (по умолчанию QUOTE_CACHE_TTL)."""
+        try:
+            await state_backend.set_quote(key, data, ttl)
+        except Exception as e:
+            logger.warning(f"Quote cache write failed for {key}: {e}")
+    
+    def _market_cache_ttl(self, symbol: str, quote: Dict) -> float:
+        """
+        Сколько хранить котировку: пока рынок закрыт, цена не изменится до открытия,
+        поэтому она хранится до него и помечается как цена закрытия.
+        """
+        if not MARKET_CALENDAR_ENABLED:
+            return QUOTE_CACHE_TTL
+        now = datetime.now(timezone.utc)
+        state = market_calendar.state(symbol, now)
+        if state is None or not state.settled(now):
+            return QUOTE_CACHE_TTL
+        quote['market_closed'] = True
+        if state.last_close:
+            quote['timestamp'] = state.last_close.isoformat()
+        ttl = max(QUOTE_CACHE_TTL, state.seconds_to_open(now))
+        logger.info(f"🌙 {state.market.name} is closed, keeping {symbol} until {state.next_open}")
+        return ttl
+    
+    def _cbr_cache_ttl(self, rate: Dict) -> float:
+        """Курс ЦБ не меняется до следующей публикации (если это уже курс последней публикации)."""
+        if not MARKET_CALENDAR_ENABLED:
+            return QUOTE_CACHE_TTL
+        try:
+            rate_date = datetime.fromisoformat(rate['timestamp']).date()
+        except (KeyError, TypeError, ValueError):
+            return QUOTE_CACHE_TTL
+        ttl = market_calendar.cbr_rate_ttl(rate_date)
+        return max(QUOTE_CACHE_TTL, ttl) if ttl else QUOTE_CACHE_TTL
+    
+    def _fetch_stock_data(self, symbol: str) -> Optional[Dict]:
+        """Синхронная функция для получения данных через yfinance."""
+        return fetch_stock_data(symbol)
+    
     async def get_currency_rate(self, from_currency: str = "USD", to_currency: str = "RUB") -> Optional[Dict]:
         """
         Получить курс валют через ЦБ РФ или Yahoo Finance.
@@ -100,11 +306,21 @@ class FinanceDataClient:
         try:
             logger.info(f"🔍 Getting currency rate {from_currency}/{to_currency}")
             
+            # Потоковый фид (если транслирует пару)
+            if to_currency == "RUB":
+                live = self.get_live_quote(from_currency.upper())
+                if live and live['symbol'] == f"{from_currency.upper()}/RUB":
+                    return self._publish(live)
+            
             # Сначала пробуем ЦБ РФ для рублевых пар
             if to_currency == "RUB":
+                cached = await self._get_cached_quote(f"cbr:{from_currency.upper()}")
+                if cached:
+                    return self._publish(cached)
                 cbr_data = await self._fetch_cbr_rate(from_currency)
                 if cbr_data:
-                    return cbr_data
+                    await self._cache_quote(f"cbr:{from_currency.upper()}", cbr_data, self._cbr_cache_ttl(cbr_data))
+                    return self._publish(cbr_data)
             
             # Fallback на Yahoo Finance
             if YFINANCE_AVAILABLE:
@@ -150,8 +366,18 @@ class FinanceDataClient:
     
     async def get_crypto_price(self, symbol: str) -> Optional[Dict]:
         """
-        Получить цену криптовалюты через Yahoo Finance.
+        Получить цену криптовалюты: из потокового фида или таблицы CoinGecko в памяти,
+        при недоступности обоих - через Yahoo Finance.
         """
+        live = self.get_live_quote(symbol.upper())
+        if live and live['symbol'] == f"{symbol.upper()}-USD":
+            return self._publish(live)
+        
+        if self.supported_apis['coinGecko']:
+            quote = await crypto_prices.get_price(symbol)
+            if quote:
+                return self._publish(quote)
+            
         if not YFINANCE_AVAILABLE:
             return None
             
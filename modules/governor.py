@@ -0,0 +1,279 @@
+"""
+Регулятор нагрузки: при перегрузке ответы упрощаются по ступеням, а не
+обрабатываются все медленнее, пока не упрутся в таймауты.
+
+Сигналы: задержка event loop, число запросов к LLM в обработке и доля
+ошибок LLM API за последнее окно. Уровни накопительные:
+
+0 normal           - полный конвейер
+1 no_scraping      - без новостей, HTML-поиска и простого веб-поиска
+2 quotes_only      - в промпт идут только котировки
+3 short_history    - в промпт идут последние GOVERNOR_SHORT_HISTORY реплик
+4 small_max_tokens - max_tokens интерактивных ответов уменьшается
+5 cheap_model      - интерактивные ответы дает GOVERNOR_CHEAP_MODEL
+6 shed             - новые сообщения ждут свободного места в очереди или отклоняются
+                     (одновременно обрабатывается не больше GOVERNOR_MAX_LLM_IN_FLIGHT сообщений)
+
+Уровень повышается на одну ступень, если давление (худший сигнал относительно
+порога) больше 1, и понижается, только когда давление держится ниже
+GOVERNOR_RECOVER_RATIO не меньше GOVERNOR_RECOVER_AFTER секунд.
+"""
+import logging
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+from config import (
+    GOVERNOR_ENABLED, GOVERNOR_INTERVAL, GOVERNOR_LAG_TARGET, GOVERNOR_MAX_LLM_IN_FLIGHT,
+    GOVERNOR_ERROR_RATE, GOVERNOR_ERROR_WINDOW, GOVERNOR_STEP_UP_AFTER, GOVERNOR_RECOVER_RATIO,
+    GOVERNOR_RECOVER_AFTER, GOVERNOR_MAX_LEVEL, GOVERNOR_SHORT_HISTORY, GOVERNOR_MAX_TOKENS_FACTOR,
+    GOVERNOR_CHEAP_MODEL, GOVERNOR_QUEUE_TIMEOUT, GOVERNOR_MAX_QUEUED
+)
+from modules.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_NO_SCRAPING = 1
+LEVEL_QUOTES_ONLY = 2
+LEVEL_SHORT_HISTORY = 3
+LEVEL_SMALL_MAX_TOKENS = 4
+LEVEL_CHEAP_MODEL = 5
+LEVEL_SHED = 6
+
+LEVEL_NAMES = (
+    "normal", "no_scraping", "quotes_only", "short_history", "small_max_tokens", "cheap_model", "shed",
+)
+
+# Доля ошибок не считается, пока в окне меньше стольких запросов
+MIN_ERROR_SAMPLES = 10
+
+
+class LoadGovernor:
+    """Уровень деградации по сигналам нагрузки, с гистерезисом и автоматическим восстановлением."""
+
+    def __init__(self, enabled: bool = GOVERNOR_ENABLED, interval: float = GOVERNOR_INTERVAL,
+                 lag_target: float = GOVERNOR_LAG_TARGET, max_llm_in_flight: int = GOVERNOR_MAX_LLM_IN_FLIGHT,
+                 error_rate: float = GOVERNOR_ERROR_RATE, error_window: float = GOVERNOR_ERROR_WINDOW,
+                 step_up_after: float = GOVERNOR_STEP_UP_AFTER, recover_ratio: float = GOVERNOR_RECOVER_RATIO,
+                 recover_after: float = GOVERNOR_RECOVER_AFTER, max_level: int = GOVERNOR_MAX_LEVEL):
+        self.enabled = enabled
+        self.interval = interval
+        self.lag_target = lag_target
+        self.max_llm_in_flight = max_llm_in_flight
+        self.error_rate_target = error_rate
+        self.error_window = error_window
+        self.step_up_after = step_up_after
+        self.recover_ratio = recover_ratio
+        self.recover_after = recover_after
+        self.max_level = min(max_level, LEVEL_SHED)
+        self.max_queued = GOVERNOR_MAX_QUEUED
+
+        self.level = LEVEL_NORMAL
+        self.lag = 0.0
+        self.llm_in_flight = 0
+        # Сообщения, допущенные admit() и еще не освобожденные release()
+        self.admitted = 0
+        # (время, успех) запросов к LLM за последние error_window секунд
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._changed_at = 0.0
+        self._calm_since: Optional[float] = None
+        # Ожидающие места на уровне shed, по порядку прихода; место передается первому
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def level_name(self) -> str:
+        return LEVEL_NAMES[self.level]
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def skip_scraping(self) -> bool:
+        return self.level >= LEVEL_NO_SCRAPING
+
+    @property
+    def quotes_only(self) -> bool:
+        return self.level >= LEVEL_QUOTES_ONLY
+
+    @property
+    def history_limit(self) -> Optional[int]:
+        """Сколько последних реплик истории отправлять в промпт (None - все)."""
+        return GOVERNOR_SHORT_HISTORY if self.level >= LEVEL_SHORT_HISTORY else None
+
+    def adjust_params(self, params: Dict) -> Dict:
+        """Параметры интерактивного запроса с учетом уровня: меньше max_tokens, дешевле модель."""
+        if self.level < LEVEL_SMALL_MAX_TOKENS:
+            return params
+        params = dict(params, max_tokens=max(1, int(params['max_tokens'] * GOVERNOR_MAX_TOKENS_FACTOR)))
+        if self.level >= LEVEL_CHEAP_MODEL and GOVERNOR_CHEAP_MODEL:
+            params['model'] = GOVERNOR_CHEAP_MODEL
+        return params
+
+    def error_rate(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        while self._outcomes and self._outcomes[0][0] < now - self.error_window:
+            self._outcomes.popleft()
+        if len(self._outcomes) < MIN_ERROR_SAMPLES:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def pressure(self, now: Optional[float] = None) -> float:
+        """Худший из сигналов относительно его порога: больше 1 - перегрузка."""
+        signals = [self.lag / self.lag_target if self.lag_target else 0.0]
+        if self.max_llm_in_flight:
+            signals.append(self.llm_in_flight / self.max_llm_in_flight)
+        if self.error_rate_target:
+            signals.append(self.error_rate(now) / self.error_rate_target)
+        return max(signals)
+
+    def update(self, lag: Optional[float] = None, now: Optional[float] = None) -> int:
+        """Учесть новый замер задержки loop и при необходимости сменить уровень."""
+        now = time.monotonic() if now is None else now
+        if lag is not None:
+            self.lag = lag
+        pressure = self.pressure(now)
+
+        if pressure > 1:
+            self._calm_since = None
+            if self.level < self.max_level and now - self._changed_at >= self.step_up_after:
+                self._set_level(self.level + 1, pressure, now)
+        elif pressure < self.recover_ratio:
+            if self._calm_since is None:
+                self._calm_since = now
+            calm_for = now - max(self._calm_since, self._changed_at)
+            if self.level > LEVEL_NORMAL and calm_for >= self.recover_after:
+                self._set_level(self.level - 1, pressure, now)
+        else:
+            # Между порогами уровень держится, отсчет спокойного времени начинается заново
+            self._calm_since = None
+        return self.level
+
+    def _set_level(self, level: int, pressure: float, now: float) -> None:
+        previous = self.level
+        self.level = level
+        self._changed_at = now
+        metrics.inc("governor.level_changes")
+        message = (
+            f"🚦 Load level {previous} ({LEVEL_NAMES[previous]}) -> {level} ({LEVEL_NAMES[level]}): "
+            f"pressure={pressure:.2f} lag={self.lag * 1000:.0f}ms llm_in_flight={self.llm_in_flight} "
+            f"errors={self.error_rate(now):.0%} queued={self.queued}"
+        )
+        if level > previous:
+            logger.warning(message)
+        else:
+            logger.info(message)
+        if level < previous:
+            self._wake_waiters()
+
+    @asynccontextmanager
+    async def track_llm(self):
+        """Учет запроса к LLM API: число в обработке и исход (ошибка или успех)."""
+        self.llm_in_flight += 1
+        ok = False
+        try:
+            yield
+            ok = True
+        except asyncio.CancelledError:
+            # Отмена (например, проигравший хедж) - не ошибка upstream
+            ok = True
+            raise
+        finally:
+            self.llm_in_flight -= 1
+            self._outcomes.append((time.monotonic(), ok))
+            if not ok:
+                metrics.inc("governor.llm_errors")
+
+    def _has_slot(self) -> bool:
+        return self.level < LEVEL_SHED or self.admitted < self.max_llm_in_flight
+
+    def _wake_waiters(self) -> None:
+        """Передать освободившиеся места ожидающим, по одному на место."""
+        while self._waiters and self._has_slot():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.admitted += 1
+                waiter.set_result(True)
+
+    def release(self) -> None:
+        """Освободить место, занятое admit() (после ответа на сообщение)."""
+        self.admitted -= 1
+        self._wake_waiters()
+
+    async def admit(self, timeout: float = GOVERNOR_QUEUE_TIMEOUT) -> bool:
+        """
+        Занять место для обработки нового сообщения; при True вызывающий обязан вызвать release().
+        На уровне shed сообщение ждет, пока освободится место, но не дольше timeout;
+        при переполненной очереди сразу отклоняется.
+        """
+        if self._has_slot() and not self._waiters:
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queued:
+            metrics.inc("governor.rejected")
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # wait, а не wait_for: переданное по таймауту место не должно потеряться
+            await asyncio.wait({waiter}, timeout=timeout)
+        except BaseException:
+            if waiter.done():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+        if waiter.cancelled():
+            metrics.inc("governor.rejected")
+            return False
+        return True
+
+    def snapshot(self) -> Dict:
+        return {
+            'level': self.level,
+            'name': self.level_name,
+            'lag_ms': round(self.lag * 1000, 1),
+            'llm_in_flight': self.llm_in_flight,
+            'error_rate': round(self.error_rate(), 3),
+            'queued': self.queued,
+        }
+
+    async def _monitor(self) -> None:
+        """Замер задержки loop: насколько позже запланированного просыпается корутина."""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.update(max(0.0, now - started - self.interval), now)
+
+    def share(self, processes: int) -> None:
+        """
+        Рабочий процесс из processes: лимиты делятся между процессами, чтобы в сумме
+        не превышать настроенных. Задержка loop и доля ошибок - свои у каждого процесса,
+        поэтому уровень определяется по процессу, в который пришел чат.
+        """
+        self.max_llm_in_flight = max(1, math.ceil(self.max_llm_in_flight / processes))
+        self.max_queued = max(1, math.ceil(self.max_queued / processes))
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._monitor())
+        logger.info(f"🚦 Load governor started (max level {self.max_level} {LEVEL_NAMES[self.max_level]})")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+# Глобальный экземпляр
+governor = LoadGovernor()
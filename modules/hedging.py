@@ -0,0 +1,110 @@
+"""
+Хеджирование запросов к LLM: если первый токен не пришел за обычное время
+(скользящий перцентиль TTFT), отправляем второй запрос и берем ответ того,
+кто начнет отвечать первым. Второй запрос отменяется.
+
+Число хеджей ограничено бюджетом - долей от всех запросов, поэтому
+расход токенов растет не больше чем на эту долю.
+"""
+import logging
+import asyncio
+from typing import Awaitable, Callable, Optional, TypeVar
+from modules.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class HedgeBudget:
+    """Каждый запрос добавляет ratio токена, хедж стоит один токен; запас - не больше burst."""
+
+    def __init__(self, ratio: float, burst: float = 2.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def on_request(self) -> None:
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def hedge_delay(metric: str, percentile: float, default: float, min_delay: float, min_samples: int) -> float:
+    """Через сколько секунд без первого токена хеджировать: перцентиль TTFT или default, пока данных мало."""
+    samples = metrics.observations.get(metric)
+    if not samples or len(samples) < min_samples:
+        return default
+    return max(min_delay, metrics.percentile(metric, percentile))
+
+
+async def _first_signal(task: asyncio.Task, started: asyncio.Event, timeout: Optional[float] = None) -> bool:
+    """Дождаться первого токена или завершения задачи; False - не дождались за timeout."""
+    waiter = asyncio.create_task(started.wait())
+    try:
+        done, _ = await asyncio.wait({task, waiter}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        return bool(done)
+    finally:
+        waiter.cancel()
+
+
+async def run_hedged(call: Callable[[asyncio.Event], Awaitable[T]],
+                     hedge_call: Callable[[asyncio.Event], Awaitable[T]],
+                     delay: float, budget: HedgeBudget, metric_prefix: str) -> T:
+    """
+    Выполнить call(started) с хеджированием: если за delay started не установлен
+    и бюджет позволяет, запускается hedge_call(started). Ответ берется у того,
+    кто первым начнет отвечать (или завершится успешно); второй отменяется.
+    """
+    budget.on_request()
+    primary_started = asyncio.Event()
+    primary = asyncio.create_task(call(primary_started))
+    tasks = {primary}
+    try:
+        if await _first_signal(primary, primary_started, delay):
+            return await primary
+        if not budget.try_spend():
+            metrics.inc(f"{metric_prefix}.hedge_budget_exhausted")
+            return await primary
+
+        metrics.inc(f"{metric_prefix}.hedges")
+        logger.info(f"🪝 No first token after {delay:.2f}s, sending hedged request ({metric_prefix})")
+        hedge_started = asyncio.Event()
+        hedge = asyncio.create_task(hedge_call(hedge_started))
+        tasks.add(hedge)
+        started = {primary: primary_started, hedge: hedge_started}
+
+        while True:
+            winner = next((t for t in (primary, hedge) if t in tasks and started[t].is_set()), None)
+            if winner is None:
+                winner = next((t for t in (primary, hedge) if t in tasks and t.done() and not t.exception()), None)
+            if winner is not None:
+                break
+            for task in [t for t in tasks if t.done()]:
+                # Упавший запрос выбывает; если упали оба - пробрасываем ошибку последнего
+                tasks.discard(task)
+                if not tasks:
+                    return task.result()
+            waiters = [asyncio.create_task(started[t].wait()) for t in tasks]
+            try:
+                await asyncio.wait({*tasks, *waiters}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+        if winner is hedge:
+            metrics.inc(f"{metric_prefix}.hedge_wins")
+        for task in tasks - {winner}:
+            task.cancel()
+        tasks = {winner}
+        return await winner
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,204 @@
+"""
+Индекс инструментов: названия, русские и английские синонимы, тикеры и
+символы Yahoo Finance (с суффиксами бирж вроде .ME) из файла data/instruments.tsv.
+
+- упоминания в свободном тексте ищутся по отсортированному массиву синонимов:
+  один проход по началам слов, префикс удлиняется посимвольно и ищется bisect,
+  пока с него начинается хоть один синоним; побеждает самое длинное совпадение
+  ("газпром нефть" раньше "газпром"), синонимы со звездочкой допускают окончания
+  ("газпрома"). Два плоских массива вместо дерева из словарей по узлу на букву
+  занимают в каждом процессе в разы меньше памяти и строятся одной сортировкой
+- явные запросы (/alert, /portfolio) дополнительно принимают тикер, символ
+  и опечатки (difflib по синонимам на ту же букву)
+"""
+import logging
+import difflib
+import os
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from config import INSTRUMENTS_FILE, INSTRUMENT_FUZZY_CUTOFF
+
+logger = logging.getLogger(__name__)
+
+CURRENCY = 'currency'
+CRYPTO = 'crypto'
+STOCK = 'stock'
+COMMODITY = 'commodity'
+INDEX = 'index'
+ETF = 'etf'
+
+DEFAULT_INSTRUMENTS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'instruments.tsv')
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+
+class Instrument:
+    """Инструмент индекса."""
+
+    __slots__ = ('key', 'symbol', 'kind', 'exchange', 'name')
+
+    def __init__(self, key: str, symbol: str, kind: str, exchange: str, name: str):
+        self.key = key
+        self.symbol = symbol
+        self.kind = kind
+        self.exchange = exchange
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Instrument({self.key}, {self.symbol}, {self.kind})"
+
+
+class InstrumentIndex:
+    """Поиск инструментов по тексту; файл читается при первом обращении."""
+
+    def __init__(self, path: str = INSTRUMENTS_FILE, fuzzy_cutoff: float = INSTRUMENT_FUZZY_CUTOFF):
+        self.path = path or DEFAULT_INSTRUMENTS_FILE
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._instruments: List[Instrument] = []
+        self._by_key: Dict[str, Instrument] = {}
+        self._by_symbol: Dict[str, Instrument] = {}
+        # Синонимы по алфавиту и параллельно - номер инструмента * 2 + допускается ли окончание
+        self._aliases: List[str] = []
+        self._alias_targets = array('l')
+        # Первая буква -> синонимы и названия для нечеткого поиска
+        self._fuzzy: Dict[str, List[str]] = {}
+        self._fuzzy_targets: Dict[str, int] = {}
+        self._loaded = False
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._instruments)
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            self.load()
+
+    def load(self) -> None:
+        """Прочитать файл инструментов и построить отсортированный массив синонимов."""
+        started = time.perf_counter()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            logger.error(f"❌ Failed to load instruments from {self.path}: {e}")
+            return
+
+        aliases_map: Dict[str, int] = {}
+        for line in lines:
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 6:
+                logger.warning(f"⚠️ Skipping malformed instrument line: {line[:60]}")
+                continue
+            key, symbol, kind, exchange, name, aliases = fields
+            index = len(self._instruments)
+            instrument = Instrument(key, symbol, kind, exchange, name)
+            self._instruments.append(instrument)
+            self._by_key.setdefault(key.upper(), instrument)
+            self._by_symbol.setdefault(symbol.upper(), instrument)
+            for alias in aliases.split(','):
+                alias = normalize(alias.strip())
+                if alias:
+                    aliases_map.setdefault(alias.rstrip('*'), index * 2 + alias.endswith('*'))
+                    self._add_fuzzy(alias.rstrip('*'), index)
+            self._add_fuzzy(normalize(name), index)
+
+        self._aliases = sorted(aliases_map)
+        self._alias_targets = array('l', (aliases_map[alias] for alias in self._aliases))
+
+        logger.info(
+            f"🗂️ Instrument index loaded: {len(self._instruments)} instruments "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    def _add_fuzzy(self, text: str, index: int) -> None:
+        if text and text not in self._fuzzy_targets:
+            self._fuzzy_targets[text] = index
+            self._fuzzy.setdefault(text[0], []).append(text)
+
+    def _match_at(self, text: str, start: int) -> Optional[Tuple[int, int]]:
+        """Самый длинный синоним, начинающийся с позиции start: (конец слова, номер инструмента)."""
+        aliases = self._aliases
+        best = None
+        length = len(text)
+        low = 0
+        for pos in range(start, length):
+            prefix = text[start:pos + 1]
+            # Синонимы с этим префиксом идут подряд не раньше синонимов с более коротким
+            low = bisect_left(aliases, prefix, low)
+            if low == len(aliases) or not aliases[low].startswith(prefix):
+                break
+            if aliases[low] != prefix:
+                continue
+            index, stem = divmod(self._alias_targets[low], 2)
+            end = pos + 1
+            if end < length and text[end].isalnum():
+                if not stem:
+                    continue
+                while end < length and text[end].isalnum():
+                    end += 1
+            best = (end, index)
+        return best
+
+    def find(self, text: str) -> List[Instrument]:
+        """Инструменты, упомянутые в тексте, в порядке упоминания (без повторов)."""
+        self._ensure_loaded()
+        text = normalize(text)
+        found: List[Instrument] = []
+        position = 0
+        length = len(text)
+        while position < length:
+            if text[position].isalnum() and (position == 0 or not text[position - 1].isalnum()):
+                match = self._match_at(text, position)
+                if match:
+                    instrument = self._instruments[match[1]]
+                    if instrument not in found:
+                        found.append(instrument)
+                    position = match[0]
+                    continue
+            position += 1
+        return found
+
+    def match_prefix(self, text: str, start: int = 0) -> Optional[Tuple[Instrument, int]]:
+        """Самый длинный синоним, начинающийся с позиции start: (инструмент, конец совпадения)."""
+        self._ensure_loaded()
+        match = self._match_at(normalize(text), start)
+        if match is None:
+            return None
+        return self._instruments[match[1]], match[0]
+
+    def resolve(self, name: str) -> Optional[Instrument]:
+        """Инструмент по явному названию: ключ, символ, синоним или похожее название."""
+        self._ensure_loaded()
+        text = normalize(name.strip())
+        if not text:
+            return None
+        instrument = self._by_key.get(text.upper()) or self._by_symbol.get(text.upper())
+        if instrument:
+            return instrument
+        match = self._match_at(text, 0)
+        if match and match[0] == len(text):
+            return self._instruments[match[1]]
+        if self.fuzzy_cutoff > 0:
+            close = difflib.get_close_matches(text, self._fuzzy.get(text[0], []), n=1, cutoff=self.fuzzy_cutoff)
+            if close:
+                return self._instruments[self._fuzzy_targets[close[0]]]
+        return None
+
+    def by_key(self, key: str) -> Optional[Instrument]:
+        self._ensure_loaded()
+        return self._by_key.get(key.upper())
+
+    def by_symbol(self, symbol: str) -> Optional[Instrument]:
+        self._ensure_loaded()
+        return self._by_symbol.get(symbol.upper())
+
+
+# Глобальный индекс инструментов
+instrument_index = InstrumentIndex()
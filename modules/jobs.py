@@ -0,0 +1,225 @@
+"""
+Очередь долгих аналитических запросов.
+
+Вопросы вроде "сравни 5 ETF на горизонте 10 лет" не укладываются в
+LLM_REQUEST_TIMEOUT. Бот ставит их в очередь, сразу отвечает пользователю,
+а готовый анализ присылает отдельным сообщением.
+
+- ограниченное число обработчиков (JOB_WORKERS)
+- интерактивные сообщения важнее: пока их в обработке много, задания ждут
+- внутри очереди сначала более простые задания (меньше priority)
+- незавершенные задания сохраняются в файл и выполняются после перезапуска,
+  но не больше JOB_MAX_ATTEMPTS раз: задание, роняющее процесс, не повторяется вечно
+"""
+import logging
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import (
+    JOB_WORKERS, JOB_MAX_PENDING, JOB_MAX_PER_CHAT, JOB_TIMEOUT, JOB_QUEUE_FILE, JOB_INTERACTIVE_LIMIT,
+    JOB_MAX_ATTEMPTS,
+)
+from modules.lifecycle import shutdown_manager
+from modules.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, освободились ли ресурсы от интерактивных запросов
+JOB_DEFER_INTERVAL = 0.5
+
+JOB_TIMEOUT_MESSAGE = "⏱️ Анализ по вашему вопросу занял слишком много времени. Попробуйте сузить вопрос."
+JOB_ERROR_MESSAGE = "❌ Не удалось подготовить анализ по вашему вопросу. Попробуйте позже."
+JOB_ABANDONED_MESSAGE = "❌ Анализ по вашему вопросу не удалось подготовить после нескольких попыток. Попробуйте сформулировать вопрос иначе."
+
+
+class AnalysisJob:
+    """Задание на развернутый анализ."""
+
+    __slots__ = ('id', 'chat_id', 'question', 'priority', 'created_at', 'attempts')
+
+    def __init__(self, chat_id: int, question: str, priority: int = 0,
+                 id: Optional[str] = None, created_at: Optional[float] = None, attempts: int = 0):
+        self.id = id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.question = question
+        self.priority = priority
+        self.created_at = created_at or time.time()
+        self.attempts = attempts
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AnalysisJob":
+        return cls(**data)
+
+
+class AnalysisQueue:
+    """Очередь заданий с ограниченным числом обработчиков и сохранением на диск."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 max_per_chat: int = JOB_MAX_PER_CHAT, timeout: float = JOB_TIMEOUT,
+                 path: str = JOB_QUEUE_FILE, interactive_limit: int = JOB_INTERACTIVE_LIMIT,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self.max_per_chat = max_per_chat
+        self.timeout = timeout
+        self.path = path
+        self.interactive_limit = interactive_limit
+        # Все незавершенные задания (в очереди и в работе) - именно они сохраняются
+        self._jobs: Dict[str, AnalysisJob] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._handler: Optional[Callable[[AnalysisJob], Awaitable[str]]] = None
+        self._deliver: Optional[Callable[[int, str], Awaitable[Any]]] = None
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def pending_for(self, chat_id: int) -> int:
+        return sum(1 for job in self._jobs.values() if job.chat_id == chat_id)
+
+    async def start(self, handler: Callable[[AnalysisJob], Awaitable[str]],
+                    deliver: Callable[[int, str], Awaitable[Any]]) -> None:
+        """
+        Запустить обработчики. handler готовит ответ по заданию,
+        deliver(chat_id, text) отправляет его пользователю.
+        """
+        self._handler = handler
+        self._deliver = deliver
+        self._queue = asyncio.PriorityQueue()
+        for job in self._load():
+            self._jobs[job.id] = job
+            self._put(job)
+        if self._jobs:
+            logger.info(f"📥 Restored {len(self._jobs)} pending analysis jobs")
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Analysis queue started with {self.workers} workers")
+
+    def submit(self, chat_id: int, question: str, priority: int = 0) -> Optional[AnalysisJob]:
+        """Поставить задание в очередь; None, если очередь или лимит чата заполнены."""
+        if not self.running:
+            return None
+        if len(self._jobs) >= self.max_pending or self.pending_for(chat_id) >= self.max_per_chat:
+            metrics.inc("jobs.rejected")
+            return None
+        job = AnalysisJob(chat_id, question, priority)
+        self._jobs[job.id] = job
+        self._put(job)
+        self._save()
+        metrics.inc("jobs.submitted")
+        logger.info(f"📝 Analysis job {job.id} queued for chat {chat_id} (priority {priority}, pending {len(self._jobs)})")
+        return job
+
+    def position(self, job: AnalysisJob) -> int:
+        """Место задания в очереди (1 - следующее)."""
+        return sum(
+            1 for other in self._jobs.values()
+            if (other.priority, other.created_at) <= (job.priority, job.created_at)
+        )
+
+    def _put(self, job: AnalysisJob) -> None:
+        self._queue.put_nowait((job.priority, next(self._sequence), job))
+
+    async def _wait_for_capacity(self) -> None:
+        """Пока интерактивных сообщений в обработке много, задание ждет."""
+        deferred = False
+        while shutdown_manager.in_flight_by_stage().get("message", 0) >= self.interactive_limit:
+            if not deferred:
+                metrics.inc("jobs.deferred")
+                deferred = True
+            await asyncio.sleep(JOB_DEFER_INTERVAL)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._wait_for_capacity()
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: AnalysisJob) -> None:
+        if job.attempts >= self.max_attempts:
+            logger.error(f"Analysis job {job.id} abandoned after {job.attempts} attempts")
+            metrics.inc("jobs.abandoned")
+            answer = JOB_ABANDONED_MESSAGE
+        else:
+            # Попытка сохраняется до запуска: прерванный запуск тоже засчитывается
+            job.attempts += 1
+            self._save()
+            answer = await self._answer(job)
+
+        try:
+            await self._deliver(job.chat_id, answer)
+            logger.info(f"📬 Analysis job {job.id} delivered to chat {job.chat_id}")
+        except Exception as e:
+            logger.error(f"Failed to deliver analysis job {job.id} to chat {job.chat_id}: {e}")
+        finally:
+            self._jobs.pop(job.id, None)
+            self._save()
+
+    async def _answer(self, job: AnalysisJob) -> str:
+        started = time.monotonic()
+        metrics.observe("jobs.wait", time.time() - job.created_at)
+        try:
+            answer = await asyncio.wait_for(self._handler(job), timeout=self.timeout)
+            metrics.inc("jobs.completed")
+        except asyncio.TimeoutError:
+            logger.error(f"Analysis job {job.id} timed out after {self.timeout}s")
+            metrics.inc("jobs.timeouts")
+            answer = JOB_TIMEOUT_MESSAGE
+        except Exception as e:
+            logger.error(f"Analysis job {job.id} failed: {e}")
+            metrics.inc("jobs.failed")
+            answer = JOB_ERROR_MESSAGE
+        metrics.observe("jobs.latency", time.monotonic() - started)
+        return answer
+
+    def _load(self) -> List[AnalysisJob]:
+        if not self.path:
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return [AnalysisJob.from_dict(item) for item in json.load(f)]
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"⚠️ Job queue file {self.path} is unreadable: {e}")
+            return []
+
+    def _save(self) -> None:
+        """Сохранить незавершенные задания (атомарно, через временный файл)."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([job.to_dict() for job in self._jobs.values()], f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to save job queue to {self.path}: {e}")
+
+    async def stop(self) -> None:
+        """Остановить обработчики; прерванные задания остаются в файле и выполнятся после перезапуска."""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._save()
+        if self._jobs:
+            logger.info(f"💾 {len(self._jobs)} analysis jobs saved for the next start")
+
+
+analysis_queue = AnalysisQueue()
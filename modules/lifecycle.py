@@ -0,0 +1,118 @@
+"""
+Управление жизненным циклом бота: учёт запросов в обработке и корректное завершение.
+"""
+import logging
+import asyncio
+import inspect
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Фазы завершения: сначала сбрасываем состояние, потом закрываем соединения
+SHUTDOWN_PHASES = ("flush", "close")
+
+# Сколько ждать выхода из отмененных запросов после дедлайна
+CANCEL_GRACE = 2.0
+
+
+class ShutdownManager:
+    """
+    Координатор корректного завершения работы.
+
+    Порядок остановки:
+    1. Перестаём принимать новые сообщения (accepting = False)
+    2. Ждём завершения запросов в обработке, но не дольше дедлайна
+    3. Фаза "flush" - сбрасываем кеши, историю, метрики
+    4. Фаза "close" - закрываем HTTP-сессии и прочие соединения
+    """
+
+    def __init__(self):
+        self.accepting = True
+        # Каждый запрос - свой Future (выполняется при выходе из track) -> (этап, задача).
+        # Задача может быть долгоживущей (без concurrent_updates обработчики выполняет
+        # _update_fetcher PTB), поэтому ждем именно запрос, а не завершение задачи.
+        self._in_flight: Dict[asyncio.Future, Tuple[str, Optional[asyncio.Task]]] = {}
+        self._callbacks: Dict[str, List[Tuple[str, Callable]]] = {phase: [] for phase in SHUTDOWN_PHASES}
+
+    @property
+    def in_flight_count(self) -> int:
+        """Количество запросов в обработке."""
+        return len(self._in_flight)
+
+    def in_flight_by_stage(self) -> Dict[str, int]:
+        """Количество запросов в обработке по типам."""
+        stages: Dict[str, int] = {}
+        for stage, _ in self._in_flight.values():
+            stages[stage] = stages.get(stage, 0) + 1
+        return stages
+
+    @asynccontextmanager
+    async def track(self, stage: str = "message"):
+        """Отметить текущую задачу как запрос в обработке."""
+        done = asyncio.get_running_loop().create_future()
+        self._in_flight[done] = (stage, asyncio.current_task())
+        try:
+            yield
+        finally:
+            self._in_flight.pop(done, None)
+            done.set_result(None)
+
+    def register(self, name: str, callback: Callable, phase: str = "flush") -> None:
+        """Зарегистрировать действие, выполняемое при завершении (sync или async)."""
+        if phase not in self._callbacks:
+            raise ValueError(f"Unknown shutdown phase: {phase}")
+        self._callbacks[phase].append((name, callback))
+        logger.debug(f"Registered shutdown callback '{name}' for phase '{phase}'")
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Дождаться завершения запросов в обработке.
+        Возвращает True, если все запросы успели завершиться до дедлайна.
+        """
+        current = asyncio.current_task()
+        pending: Set[asyncio.Future] = {
+            done for done, (_, task) in self._in_flight.items() if task is not current
+        }
+        if not pending:
+            return True
+
+        logger.info(f"⏳ Waiting for {len(pending)} in-flight requests (timeout {timeout}s)")
+        done, still_pending = await asyncio.wait(pending, timeout=timeout)
+
+        if still_pending:
+            logger.warning(f"⚠️ Cancelling {len(still_pending)} requests that missed the shutdown deadline")
+            for request in still_pending:
+                _, task = self._in_flight.get(request, (None, None))
+                if task is not None:
+                    task.cancel()
+            # Ждем выхода из track, а не задачи: долгоживущая задача может подавить отмену
+            _, stuck = await asyncio.wait(still_pending, timeout=CANCEL_GRACE)
+            if stuck:
+                logger.warning(f"⚠️ {len(stuck)} requests ignored cancellation, continuing shutdown")
+            return False
+
+        logger.info(f"✅ All {len(done)} in-flight requests completed")
+        return True
+
+    async def run_callbacks(self) -> None:
+        """Выполнить зарегистрированные действия по фазам, не прерываясь на ошибках."""
+        for phase in SHUTDOWN_PHASES:
+            for name, callback in self._callbacks[phase]:
+                try:
+                    result = callback()
+                    if inspect.isawaitable(result):
+                        await result
+                    logger.info(f"✅ Shutdown step '{name}' ({phase}) done")
+                except Exception as e:
+                    logger.warning(f"Error in shutdown step '{name}' ({phase}): {e}")
+
+    async def shutdown(self, timeout: float) -> None:
+        """Полная процедура завершения: перестать принимать, дождаться, сбросить, закрыть."""
+        self.accepting = False
+        await self.drain(timeout)
+        await self.run_callbacks()
+
+
+# Глобальный экземпляр
+shutdown_manager = ShutdownManager()
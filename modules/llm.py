@@ -1,19 +1,40 @@
 import logging
 import openai
 import asyncio
-from typing import List, Dict, Any, Optional
-from config import OPENROUTER_API_KEY, MAX_MESSAGE_LENGTH, MAX_HISTORY_MESSAGES, LLM_REQUEST_TIMEOUT
+import time
+from types import SimpleNamespace
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Set
+from config import (
+    OPENROUTER_API_KEY, MAX_MESSAGE_LENGTH, MAX_HISTORY_MESSAGES, LLM_REQUEST_TIMEOUT,
+    LLM_FALLBACK_MODEL, LLM_PRIMARY_TIMEOUT_SHARE, FAST_PATH_ENABLED, FAST_PATH_ANALYSIS,
+    PROMPT_CACHE_ENABLED, SUMMARY_ENABLED, SUMMARY_CHUNK, ENRICHMENT_QUOTES_FIRST, ENRICHMENT_MAX_TOKENS,
+    LLM_HEDGE_ENABLED, LLM_HEDGE_MODEL, LLM_HEDGE_BUDGET, LLM_HEDGE_PERCENTILE, LLM_HEDGE_DELAY,
+    LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MIN_SAMPLES
+)
+from modules.state import state_backend
+from modules.routing import (
+    classify_request, get_tier_params, TIER_QUOTE, TIER_FOLLOWUP, TIER_ANALYSIS, TIER_SUMMARY, TIER_DEEP
+)
+from modules.metrics import metrics
+from modules.lifecycle import shutdown_manager
+from modules.fast_path import render_quote_answer, pick_quote, ANALYSIS_PROMPT
+from modules.hedging import HedgeBudget, hedge_delay, run_hedged
+from modules.governor import governor
 
 logger = logging.getLogger(__name__)
 
 try:
-    from modules.web_search import web_search_client, format_search_results
+    from modules.web_search import (
+        web_search_client, format_search_results, detect_real_data_assets, Enrichment
+    )
     WEB_SEARCH_AVAILABLE = True
 except ImportError as e:
     logger.warning(f"Web search not available: {e}")
     WEB_SEARCH_AVAILABLE = False
     web_search_client = None
     format_search_results = None
+    detect_real_data_assets = None
+    Enrichment = None
 
 # Системный промпт как константа
 SYSTEM_PROMPT = """Ты - опытный финансовый аналитик и консультант по инвестициям с глубокими знаниями фондового и валютного рынков.
@@ -64,9 +85,32 @@ SYSTEM_PROMPT = """Ты - опытный финансовый аналитик 
 - Без лишних деталей и повторений
 - Максимум конкретики, минимум текста"""
 
+# Обертка актуальных данных из поиска в последнем сообщении пользователя
+ENRICHMENT_HEADER = "АКТУАЛЬНЫЕ ДАННЫЕ (интегрируй в анализ, не копируй дословно):"
+
+# Провайдеры, поддерживающие явные точки кеширования промпта
+PROMPT_CACHE_PROVIDERS = ("anthropic/", "google/")
+
+# Сколько упомянутых инструментов котировать для развернутого анализа
+DEEP_ANALYSIS_MAX_INSTRUMENTS = 8
+
+# Уровни, которые хеджируются: пользователь ждет ответа (сводки и фоновые анализы - нет)
+HEDGED_TIERS = (TIER_QUOTE, TIER_FOLLOWUP, TIER_ANALYSIS)
+
+# Сводка ранних реплик, вытесненных из истории
+SUMMARY_HEADER = "КРАТКОЕ СОДЕРЖАНИЕ ПРЕДЫДУЩЕГО ДИАЛОГА:"
+SUMMARY_PROMPT = """Ты ведешь краткую сводку диалога финансового ассистента с пользователем.
+Обнови сводку с учетом новых реплик. Сохрани: активы и тикеры, о которых спрашивал пользователь,
+его цели, горизонт и отношение к риску, ключевые цифры и выводы ассистента.
+Не более 120 слов. Ответь только текстом сводки."""
+
 # Глобальное хранилище истории диалогов: chat_id -> list сообщений
 chat_histories: Dict[int, List[Dict[str, str]]] = {}
 
+# Сводки диалогов и реплики, ожидающие добавления в сводку
+chat_summaries: Dict[int, str] = {}
+pending_evictions: Dict[int, List[Dict[str, str]]] = {}
+
 def add_to_history(chat_id: int, role: str, content: str) -> None:
     """Добавить сообщение в историю чата."""
     if chat_id not in chat_histories:
@@ -75,26 +119,118 @@ def add_to_history(chat_id: int, role: str, content: str) -> None:
     chat_histories[chat_id].append({"role": role, "content": content})
     
     # Ограничиваем историю последними N сообщениями (исключая системный промпт)
-    if len(chat_histories[chat_id]) > MAX_HISTORY_MESSAGES:
-        chat_histories[chat_id] = chat_histories[chat_id][-MAX_HISTORY_MESSAGES:]
+    history = chat_histories[chat_id]
+    if len(history) > MAX_HISTORY_MESSAGES:
+        evict_count = len(history) - MAX_HISTORY_MESSAGES
+        if SUMMARY_ENABLED:
+            # Вытесняем пачкой: префикс промпта меняется реже, а сводка обновляется реже
+            evict_count = min(max(evict_count, SUMMARY_CHUNK), len(history) - 1)
+            pending_evictions.setdefault(chat_id, []).extend(history[:evict_count])
+        chat_histories[chat_id] = history[evict_count:]
     
     logger.debug(f"Added {role} message to chat {chat_id} history, total messages: {len(chat_histories[chat_id])}")
 
-def get_chat_context(chat_id: int) -> List[Dict[str, str]]:
-    """Получить контекст чата для LLM (системный промпт + история)."""
+def get_chat_context(chat_id: int, max_messages: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Получить контекст чата для LLM (системный промпт + сводка + история).
+    max_messages - только последние реплики истории (начиная с реплики пользователя).
+    """
     messages = [{"role": "system", "content": SYSTEM_PROMPT}]
     
+    if chat_summaries.get(chat_id):
+        messages.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{chat_summaries[chat_id]}"})
+    
     if chat_id in chat_histories:
-        messages.extend(chat_histories[chat_id])
+        history = chat_histories[chat_id]
+        if max_messages is not None and len(history) > max_messages:
+            history = history[-max_messages:]
+            if history and history[0]["role"] == "assistant":
+                history = history[1:]
+        messages.extend(history)
     
     return messages
 
 def clear_chat_history(chat_id: int) -> None:
     """Очистить историю чата."""
+    chat_summaries.pop(chat_id, None)
+    pending_evictions.pop(chat_id, None)
     if chat_id in chat_histories:
         del chat_histories[chat_id]
         logger.info(f"Chat history cleared for chat {chat_id}")
 
+def build_prompt(chat_id: int, enrichment: str = "", question: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Промпт в порядке, удобном для кеширования у провайдера:
+    неизменный системный промпт -> история (только дописывается) -> изменчивые данные в конце.
+    Актуальные данные из поиска добавляются к последнему сообщению пользователя,
+    а не отдельным system-сообщением (Anthropic переносит system в начало и ломает префикс).
+    question - вопрос, которого еще нет в истории (фоновые задания дописывают историю по готовности).
+    """
+    # При перегрузке в промпт идет только конец истории (см. modules.governor)
+    messages = get_chat_context(chat_id, governor.history_limit)
+    if question is not None:
+        messages.append({"role": "user", "content": question})
+    if enrichment and messages[-1]["role"] == "user":
+        question = messages[-1]["content"]
+        # Новый dict: сама история не должна содержать данных поиска
+        messages[-1] = {
+            "role": "user",
+            "content": f"{ENRICHMENT_HEADER}\n{enrichment}\n\nВОПРОС:\n{question}"
+        }
+    return messages
+
+def apply_cache_hints(messages: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+    """
+    Пометить стабильный префикс (системный промпт и историю до текущего вопроса)
+    для кеширования промпта у провайдера (cache_control у Anthropic/Gemini через OpenRouter).
+    """
+    if not PROMPT_CACHE_ENABLED or not model.startswith(PROMPT_CACHE_PROVIDERS):
+        return messages
+    
+    hinted = list(messages)
+    breakpoints = [0]
+    if len(hinted) > 2:
+        breakpoints.append(len(hinted) - 2)  # Последняя реплика перед текущим вопросом
+    for index in breakpoints:
+        message = hinted[index]
+        if isinstance(message["content"], str):
+            hinted[index] = {
+                **message,
+                "content": [{"type": "text", "text": message["content"], "cache_control": {"type": "ephemeral"}}]
+            }
+    return hinted
+
+async def load_chat_history(chat_id: int) -> None:
+    """Подтянуть историю чата из общего хранилища (если бот запущен в нескольких экземплярах)."""
+    if not state_backend.shared:
+        return
+    try:
+        history, summary = await state_backend.load_chat(chat_id)
+        chat_histories[chat_id] = history
+        if summary:
+            chat_summaries[chat_id] = summary
+    except Exception as e:
+        logger.warning(f"Failed to load shared history for chat {chat_id}, using local copy: {e}")
+
+async def save_chat_turn(chat_id: int, messages: List[Dict[str, str]]) -> None:
+    """Сохранить реплики хода в общее хранилище одним пакетом."""
+    if not state_backend.shared:
+        return
+    try:
+        # Храним столько же реплик, сколько осталось локально после вытеснения в сводку
+        keep = len(chat_histories.get(chat_id, [])) or MAX_HISTORY_MESSAGES
+        await state_backend.append_history(chat_id, messages, keep)
+        # Источник истины - общее хранилище, локальная копия больше не нужна
+        chat_histories.pop(chat_id, None)
+    except Exception as e:
+        logger.warning(f"Failed to save shared history for chat {chat_id}: {e}")
+
+async def reset_chat(chat_id: int) -> None:
+    """Очистить историю чата локально и в общем хранилище."""
+    clear_chat_history(chat_id)
+    if state_backend.shared:
+        await state_backend.clear_history(chat_id)
+
 class LLMClient:
     """Клиент для работы с OpenRouter API через OpenAI SDK."""
     
@@ -104,15 +240,50 @@ class LLMClient:
         if not self.api_key:
             raise ValueError("OpenRouter API key is required")
             
-        self.client = openai.OpenAI(
+        # Асинхронный клиент: запрос, не уложившийся в таймаут, отменяется вместе
+        # с соединением, а не продолжает работать в потоке после перехода на резервную модель
+        self.async_client = openai.AsyncOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=self.api_key
         )
+        self._hedge_budgets: Dict[str, HedgeBudget] = {}
+        
+        # Фоновые задачи (комментарии к быстрым ответам), чтобы их не собрал GC
+        self._background_tasks: Set[asyncio.Task] = set()
+        self._summarizing: Set[int] = set()
         
         logger.info("LLM client initialized")
     
-    async def generate_response(self, user_message: str, chat_id: int) -> str:
-        """Генерация ответа через LLM с учетом истории чата."""
+    def start_enrichment(self, user_message: str) -> Optional["Enrichment"]:
+        """
+        Начать поиск данных сразу при получении сообщения, до индикатора "печатает..."
+        и загрузки истории. Для кандидатов на быстрый ответ запрашиваются только
+        котировки: полный поиск запустится, если быстрый ответ не получится.
+        """
+        if not (WEB_SEARCH_AVAILABLE and web_search_client):
+            return None
+        if not user_message.strip() or len(user_message) > MAX_MESSAGE_LENGTH:
+            return None
+        
+        enrichment = Enrichment(user_message, web_search_client)
+        # Уровень quote не зависит от истории, поэтому решение можно принять до ее загрузки
+        fast_path_candidate = (
+            FAST_PATH_ENABLED
+            and classify_request(user_message) == TIER_QUOTE
+            and len(detect_real_data_assets(user_message)) == 1
+        )
+        if not fast_path_candidate and not governor.quotes_only:
+            enrichment.start_search()
+        return enrichment
+    
+    async def generate_response(self, user_message: str, chat_id: int,
+                                followup: Optional[Callable[[str], Awaitable[Any]]] = None,
+                                enrichment: Optional["Enrichment"] = None) -> str:
+        """
+        Генерация ответа через LLM с учетом истории чата.
+        followup - отправка дополнительного сообщения (комментарий LLM после быстрого ответа).
+        enrichment - поиск данных, запущенный заранее (start_enrichment).
+        """
         # Валидация длины сообщения
         if len(user_message) > MAX_MESSAGE_LENGTH:
             logger.warning(f"Message too long from chat {chat_id}: {len(user_message)} chars")
@@ -122,18 +293,32 @@ class LLMClient:
         if not user_message.strip():
             return "Пожалуйста, напишите ваш вопрос."
             
+        if enrichment is None:
+            enrichment = self.start_enrichment(user_message)
+            
         try:
             logger.debug(f"LLM request from chat {chat_id}: {user_message[:100]}...")
             
+            # История нужна для выбора уровня модели (короткое уточнение или новый вопрос)
+            await load_chat_history(chat_id)
+            tier = classify_request(user_message, has_history=bool(chat_histories.get(chat_id)))
+            logger.info(f"🧭 Request from chat {chat_id} routed to tier '{tier}'")
+            
+            # Простой вопрос о цене - отвечаем по шаблону из котировки, без LLM
+            if tier == TIER_QUOTE and FAST_PATH_ENABLED and enrichment is not None:
+                fast_answer = await self._try_fast_path(user_message, chat_id, followup, enrichment)
+                if fast_answer:
+                    return fast_answer
+            
             # Проверяем, нужна ли актуальная информация (только если web search доступен)
             current_info = ""
             
-            if WEB_SEARCH_AVAILABLE and web_search_client:
-                search_query = web_search_client.detect_financial_query(user_message)
+            if enrichment is not None:
+                search_query = enrichment.query
                 if search_query:
                     logger.info(f"🔍 DETECTED FINANCIAL QUERY: {search_query}")
                     try:
-                        search_results = await web_search_client.search_asset_info(search_query)
+                        search_results = await self._wait_enrichment(enrichment)
                         logger.info(f"📊 SEARCH RESULTS: {search_results}")
                         current_info = format_search_results(search_results)
                         logger.info(f"📝 FORMATTED INFO LENGTH: {len(current_info)} chars")
@@ -152,35 +337,17 @@ class LLMClient:
             # Добавляем сообщение пользователя в историю
             add_to_history(chat_id, "user", user_message)
             
-            # Получаем контекст чата (системный промпт + история)
-            messages = get_chat_context(chat_id)
-            
-            # Если есть актуальная информация, добавляем её в контекст
+            # Получаем контекст чата: системный промпт + история + актуальные данные в конце
             if current_info:
                 logger.info("🔗 ADDING SEARCH INFO TO LLM CONTEXT")
-                # Добавляем актуальную информацию как системное сообщение
-                messages.append({
-                    "role": "system", 
-                    "content": f"АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА:\n{current_info}\n\nИспользуй эту информацию в своем анализе, но не копируй дословно. Интегрируй данные в свой экспертный анализ."
-                })
             else:
                 logger.info("📝 NO SEARCH INFO TO ADD, using LLM knowledge only")
+            messages = build_prompt(chat_id, current_info)
             
             logger.info(f"🚀 SENDING REQUEST TO LLM with {len(messages)} messages")
             
-            # Отправляем запрос к OpenRouter с таймаутом
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    self.client.chat.completions.create,
-                    model="anthropic/claude-sonnet-4",
-                    messages=messages,
-                    max_tokens=1000,
-                    temperature=0.7
-                ),
-                timeout=LLM_REQUEST_TIMEOUT
-            )
-            
-            logger.info("✅ LLM RESPONSE RECEIVED")
+            # Отправляем запрос к OpenRouter (с резервной моделью при таймауте/лимите)
+            response = await self._complete(messages, tier)
             
             # Извлекаем ответ
             llm_response = response.choices[0].message.content
@@ -191,6 +358,10 @@ class LLMClient:
             
             # Добавляем ответ ассистента в историю
             add_to_history(chat_id, "assistant", llm_response)
+            await save_chat_turn(chat_id, [
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": llm_response}
+            ])
             
             logger.debug(f"LLM response to chat {chat_id}: {llm_response[:100]}...")
             logger.info(f"LLM request completed successfully for chat {chat_id}")
@@ -216,6 +387,301 @@ class LLMClient:
         except Exception as e:
             logger.error(f"Unexpected error for chat {chat_id}: {e}")
             return "Произошла неожиданная ошибка. Попробуйте позже или обратитесь к поддержке."
+        
+        finally:
+            # Незавершенный поиск дорабатывает в фоне и попадает в кэш, лишние котировки отменяются
+            if enrichment is not None:
+                enrichment.cancel(keep_search=True)
+    
+    async def _wait_enrichment(self, enrichment: "Enrichment") -> Optional[Dict[str, Any]]:
+        """
+        Результаты поиска для промпта.
+        В режиме ENRICHMENT_QUOTES_FIRST запрос к LLM уходит, как только готовы
+        котировки, если новости и веб-поиск еще загружаются.
+        При перегрузке (governor.quotes_only) поиск не запускается вовсе.
+        """
+        if governor.quotes_only and (enrichment.search is None or not enrichment.search.done()):
+            quotes = await enrichment.get_quotes()
+            metrics.inc("enrichment.governor_quotes_only")
+            return enrichment.quotes_only(quotes) if quotes else None
+        if ENRICHMENT_QUOTES_FIRST and enrichment.quotes is not None:
+            quotes = await enrichment.get_quotes()
+            enrichment.start_search()
+            if quotes and enrichment.search is not None and not enrichment.search.done():
+                metrics.inc("enrichment.quotes_first")
+                logger.info("⚡ Quotes ready, news still loading: sending quotes-only context")
+                return enrichment.quotes_only(quotes)
+        return await enrichment.get_search()
+
+    async def _try_fast_path(self, user_message: str, chat_id: int,
+                             followup: Optional[Callable[[str], Awaitable[Any]]],
+                             enrichment: "Enrichment") -> Optional[str]:
+        """Ответ по шаблону, если в вопросе ровно один актив с точной котировкой."""
+        if len(detect_real_data_assets(user_message)) != 1:
+            return None
+        
+        started = time.monotonic()
+        results = await enrichment.get_quotes()
+        quote = pick_quote(results)
+        if not quote:
+            metrics.inc("fast_path.misses")
+            return None
+        
+        answer = render_quote_answer(quote)
+        add_to_history(chat_id, "user", user_message)
+        add_to_history(chat_id, "assistant", answer)
+        await save_chat_turn(chat_id, [
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": answer}
+        ])
+        
+        metrics.inc("fast_path.hits")
+        metrics.observe("fast_path.latency", time.monotonic() - started)
+        logger.info(f"⚡ Fast path answer for chat {chat_id}: {quote['symbol']} = {quote['price']}")
+        
+        if followup and FAST_PATH_ANALYSIS:
+            task = asyncio.create_task(self._fast_path_analysis(answer, chat_id, followup))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+        
+        return answer
+    
+    async def _fast_path_analysis(self, answer: str, chat_id: int,
+                                  followup: Callable[[str], Awaitable[Any]]) -> None:
+        """Короткий комментарий LLM к быстрому ответу, отправляется отдельным сообщением."""
+        async with shutdown_manager.track("fast_path_analysis"):
+            try:
+                messages = get_chat_context(chat_id)
+                messages.append({"role": "user", "content": ANALYSIS_PROMPT.format(quote=answer)})
+                response = await self._complete(messages, TIER_FOLLOWUP)
+                comment = response.choices[0].message.content
+                if comment:
+                    await followup(comment)
+            except Exception as e:
+                logger.warning(f"Fast path analysis failed for chat {chat_id}: {e}")
+    
+    async def generate_deep_analysis(self, question: str, chat_id: int, timeout: float) -> str:
+        """
+        Развернутый анализ для фоновой очереди (modules/jobs): данные по всем
+        упомянутым активам, больший max_tokens и свой таймаут.
+        История дописывается только по готовности, поэтому чат не блокируется.
+        """
+        started = time.monotonic()
+        await load_chat_history(chat_id)
+        
+        enrichment = ""
+        if WEB_SEARCH_AVAILABLE and web_search_client:
+            try:
+                search_data = await self._multi_asset_search(question)
+                if search_data:
+                    enrichment = format_search_results(search_data, max_tokens=ENRICHMENT_MAX_TOKENS * 2)
+            except Exception as e:
+                logger.error(f"❌ SEARCH ERROR in deep analysis: {e}")
+        
+        messages = build_prompt(chat_id, enrichment, question=question)
+        remaining = timeout - (time.monotonic() - started)
+        response = await self._complete(messages, TIER_DEEP, timeout=remaining)
+        answer = response.choices[0].message.content
+        if not answer:
+            return "Получен пустой ответ от ассистента. Попробуйте переформулировать вопрос."
+        
+        add_to_history(chat_id, "user", question)
+        add_to_history(chat_id, "assistant", answer)
+        await save_chat_turn(chat_id, [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer}
+        ])
+        return answer
+
+    async def generate_portfolio_commentary(self, request: str, summary: str, chat_id: int) -> str:
+        """
+        Комментарий к расчетам /portfolio: цифры уже посчитаны (modules/portfolio),
+        LLM получает их как данные и только интерпретирует.
+        """
+        await load_chat_history(chat_id)
+        question = f"Прокомментируй мой портфель: {request}"
+        enrichment = f"РАСЧЕТ ПОРТФЕЛЯ (исторические дневные цены, посчитано ботом):\n{summary}"
+        messages = build_prompt(chat_id, enrichment, question=question)
+        response = await self._complete(messages, TIER_ANALYSIS)
+        answer = response.choices[0].message.content
+        if not answer:
+            return summary
+
+        reply = f"{summary}\n\n{answer}"
+        add_to_history(chat_id, "user", question)
+        add_to_history(chat_id, "assistant", reply)
+        await save_chat_turn(chat_id, [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": reply}
+        ])
+        return reply
+
+    async def _multi_asset_search(self, question: str) -> Optional[Dict[str, Any]]:
+        """Поиск по вопросу с котировками каждого упомянутого актива (параллельно)."""
+        quotes = web_search_client.get_real_financial_data(question, max_instruments=DEEP_ANALYSIS_MAX_INSTRUMENTS)
+        return await web_search_client.search_asset_info(question, real_results=quotes)
+    
+    def schedule_summary(self, chat_id: int) -> None:
+        """Обновить сводку диалога в фоне (вызывается после отправки ответа)."""
+        if not SUMMARY_ENABLED or not pending_evictions.get(chat_id) or chat_id in self._summarizing:
+            return
+        self._summarizing.add(chat_id)
+        task = asyncio.create_task(self._summarize(chat_id))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _summarize(self, chat_id: int) -> None:
+        """Свернуть вытесненные реплики в сводку с помощью дешевой модели."""
+        evicted = pending_evictions.pop(chat_id, [])
+        try:
+            async with shutdown_manager.track("summary"):
+                transcript = "\n".join(
+                    f"{'Пользователь' if m['role'] == 'user' else 'Ассистент'}: {m['content'][:1000]}"
+                    for m in evicted
+                )
+                messages = [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": (
+                        f"ТЕКУЩАЯ СВОДКА:\n{chat_summaries.get(chat_id) or 'нет'}\n\n"
+                        f"НОВЫЕ РЕПЛИКИ:\n{transcript}"
+                    )}
+                ]
+                response = await self._complete(messages, TIER_SUMMARY)
+                summary = (response.choices[0].message.content or "").strip()
+                if not summary:
+                    raise ValueError("empty summary")
+                chat_summaries[chat_id] = summary
+                if state_backend.shared:
+                    await state_backend.set_summary(chat_id, summary)
+                logger.info(f"🧾 Summary updated for chat {chat_id}: {len(evicted)} messages folded, {len(summary)} chars")
+        except Exception as e:
+            # Возвращаем реплики, чтобы попробовать в следующий раз (с ограничением объема)
+            logger.warning(f"Failed to update summary for chat {chat_id}: {e}")
+            pending_evictions[chat_id] = (evicted + pending_evictions.get(chat_id, []))[-MAX_HISTORY_MESSAGES:]
+        finally:
+            self._summarizing.discard(chat_id)
+    
+    async def _request(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                       temperature: float, timeout: float):
+        """Один запрос к OpenRouter с таймаутом; по таймауту запрос отменяется, соединение закрывается."""
+        return await asyncio.wait_for(
+            self.async_client.chat.completions.create(
+                model=model,
+                messages=apply_cache_hints(messages, model),
+                max_tokens=max_tokens,
+                temperature=temperature
+            ),
+            timeout=timeout
+        )
+    
+    async def _stream_request(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                              temperature: float, started: asyncio.Event, tier: str):
+        """Потоковый запрос; started устанавливается с первым токеном. Ответ в форме ChatCompletion."""
+        request_started = time.monotonic()
+        stream = await self.async_client.chat.completions.create(
+            model=model,
+            messages=apply_cache_hints(messages, model),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        parts: List[str] = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    if not started.is_set():
+                        started.set()
+                        metrics.observe(f"llm.{tier}.ttft", time.monotonic() - request_started)
+                    parts.append(content)
+        finally:
+            # Закрываем соединение и при отмене: проигравший запрос перестает генерировать
+            await stream.close()
+        message = SimpleNamespace(content="".join(parts), role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage, model=model)
+    
+    async def _hedged_request(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                              temperature: float, timeout: float, tier: str):
+        """Запрос с хеджированием: нет первого токена дольше p90 TTFT - второй запрос, побеждает первый ответивший."""
+        budget = self._hedge_budgets.setdefault(tier, HedgeBudget(LLM_HEDGE_BUDGET))
+        delay = hedge_delay(
+            f"llm.{tier}.ttft", LLM_HEDGE_PERCENTILE, LLM_HEDGE_DELAY, LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MIN_SAMPLES
+        )
+        hedge_model = LLM_HEDGE_MODEL or model
+        return await asyncio.wait_for(
+            run_hedged(
+                lambda started: self._stream_request(messages, model, max_tokens, temperature, started, tier),
+                lambda started: self._stream_request(messages, hedge_model, max_tokens, temperature, started, tier),
+                delay, budget, f"llm.{tier}"
+            ),
+            timeout=timeout
+        )
+    
+    async def _complete(self, messages: List[Dict[str, Any]], tier: str, timeout: float = LLM_REQUEST_TIMEOUT):
+        """
+        Запрос к модели уровня tier.
+        При таймауте или RateLimitError повторяем на резервной модели в пределах timeout.
+        Интерактивные запросы при LLM_HEDGE_ENABLED хеджируются (см. modules.hedging).
+        """
+        send = self._request
+        if LLM_HEDGE_ENABLED and tier in HEDGED_TIERS:
+            async def send(messages, model, max_tokens, temperature, timeout):
+                return await self._hedged_request(messages, model, max_tokens, temperature, timeout, tier)
+        
+        # Регулятор нагрузки учитывает запросы в обработке и ошибки LLM API
+        async def request(*args):
+            async with governor.track_llm():
+                return await send(*args)
+        
+        params = get_tier_params(tier)
+        if tier in HEDGED_TIERS:
+            # Интерактивные ответы при перегрузке короче и дешевле (см. modules.governor)
+            params = governor.adjust_params(params)
+        model = params['model']
+        use_fallback = bool(LLM_FALLBACK_MODEL) and LLM_FALLBACK_MODEL != model
+        primary_timeout = timeout * LLM_PRIMARY_TIMEOUT_SHARE if use_fallback else timeout
+        
+        started = time.monotonic()
+        try:
+            response = await request(messages, model, params['max_tokens'], params['temperature'], primary_timeout)
+        except (asyncio.TimeoutError, openai.RateLimitError) as e:
+            if not use_fallback:
+                raise
+            metrics.inc(f"llm.{tier}.fallbacks")
+            if isinstance(e, asyncio.TimeoutError):
+                # Ответ основной модели не дождались - пользователь получит ответ резервной
+                metrics.inc(f"llm.{tier}.timeout_fallbacks")
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 1:
+                raise
+            logger.warning(f"⚠️ {model} failed ({type(e).__name__}), falling back to {LLM_FALLBACK_MODEL}")
+            model = LLM_FALLBACK_MODEL
+            response = await request(messages, model, params['max_tokens'], params['temperature'], remaining)
+        
+        latency = time.monotonic() - started
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+        
+        metrics.inc(f"llm.{tier}.requests")
+        metrics.observe(f"llm.{tier}.latency", latency)
+        metrics.inc(f"llm.{tier}.prompt_tokens", prompt_tokens)
+        metrics.inc(f"llm.{tier}.cached_prompt_tokens", cached_tokens)
+        metrics.inc(f"llm.{tier}.completion_tokens", completion_tokens)
+        logger.info(
+            f"✅ LLM RESPONSE RECEIVED: tier={tier} model={model} latency={latency:.2f}s "
+            f"tokens={prompt_tokens}+{completion_tokens} "
+            f"(cached {cached_tokens}, uncached {prompt_tokens - cached_tokens})"
+        )
+        return response
 
 # Глобальный экземпляр клиента
 llm_client = LLMClient()
@@ -0,0 +1,274 @@
+"""
+Календарь бирж: торговые сессии, праздники и часовые пояса, расписание
+публикации курсов ЦБ РФ.
+
+FinanceDataClient по нему решает, может ли котировка измениться: пока рынок
+закрыт, последняя цена окончательная, поэтому она хранится в кеше до открытия
+и помечается как цена закрытия. Официальный курс ЦБ хранится до следующей
+публикации.
+"""
+import logging
+import copy
+import os
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+from config import MARKET_EXTRA_HOLIDAYS, MARKET_HOLIDAYS_FILE, CBR_PUBLISH_TIME, MARKET_CLOSED_MAX_TTL
+from modules.instruments import instrument_index
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# Yahoo Finance отдает часть бирж с задержкой: сразу после закрытия цена может быть еще не итоговой
+SETTLE_SECONDS = 20 * 60
+
+DEFAULT_HOLIDAYS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'market_holidays.tsv')
+
+
+def load_holidays(path: str = MARKET_HOLIDAYS_FILE) -> Dict[str, List[str]]:
+    """Праздники бирж из файла: "MOEX<TAB>2026-01-01" -> {'MOEX': ['2026-01-01', ...]}."""
+    path = path or DEFAULT_HOLIDAYS_FILE
+    holidays: Dict[str, List[str]] = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        logger.error(f"❌ Failed to load market holidays from {path}: {e}")
+        return holidays
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        try:
+            code, day = fields[0].strip().upper(), fields[1].strip()
+            date.fromisoformat(day)
+        except (IndexError, ValueError):
+            logger.warning(f"⚠️ Skipping malformed market holiday line: {line[:60]}")
+            continue
+        holidays.setdefault(code, []).append(day)
+    return holidays
+
+
+HOLIDAYS = load_holidays()
+
+
+def weekdays(start: str, end: str, days: Iterable[int] = range(5)) -> List[Tuple[int, int]]:
+    """Ежедневные сессии start-end (местное время) в указанные дни недели (0 - понедельник)."""
+    start_hour, start_minute = map(int, start.split(':'))
+    end_hour, end_minute = map(int, end.split(':'))
+    intervals = []
+    for day in days:
+        begin = day * MINUTES_PER_DAY + start_hour * 60 + start_minute
+        finish = day * MINUTES_PER_DAY + end_hour * 60 + end_minute
+        if finish <= begin:
+            finish += MINUTES_PER_DAY  # сессия через полночь
+        intervals.append((begin, finish))
+    return intervals
+
+
+class Market:
+    """
+    Биржа: часовой пояс, сессии (минуты от начала недели по местному времени)
+    и праздники, в которые сессии, начинающиеся в этот день, не проводятся.
+    Для биржи с праздниками запрос за год, которого нет в таблице, один раз
+    предупреждает в логе: праздники этого года считаются торговыми днями.
+    """
+
+    def __init__(self, code: str, name: str, tz: str, sessions: List[Tuple[int, int]],
+                 holidays: Iterable[str] = ()):
+        self.code = code
+        self.name = name
+        self.tz = ZoneInfo(tz)
+        self.sessions = sorted(sessions)
+        self.holidays: FrozenSet[date] = frozenset(date.fromisoformat(day) for day in holidays)
+        # Годы, покрытые таблицей праздников (дополнительные выходные их не расширяют)
+        self.holiday_years: FrozenSet[int] = frozenset(day.year for day in self.holidays)
+        self._warned_years: Set[int] = set()
+
+    def check_year(self, year: int) -> None:
+        """Предупредить (один раз за год), если таблица праздников не покрывает год."""
+        if not self.holiday_years or year in self.holiday_years or year in self._warned_years:
+            return
+        self._warned_years.add(year)
+        logger.warning(
+            f"⚠️ No {self.code} holidays for {year} in the market calendar: "
+            f"holidays will be treated as trading days, add them to the holidays file"
+        )
+
+    def with_holidays(self, days: Iterable[date]) -> "Market":
+        """Копия биржи с дополнительными выходными."""
+        market = copy.copy(self)
+        market.holidays = self.holidays | frozenset(days)
+        return market
+
+    def _session_bounds(self, local: datetime, days_back: int, days_forward: int):
+        """Сессии (начало, конец) с датами, начинающиеся в окне вокруг local, по времени начала."""
+        week_start = datetime.combine(local.date() - timedelta(days=local.weekday()), dt_time(), tzinfo=self.tz)
+        first = local.date() - timedelta(days=days_back)
+        last = local.date() + timedelta(days=days_forward)
+        self.check_year(first.year)
+        self.check_year(last.year)
+        bounds = []
+        for week in range(-(days_back // 7 + 1), days_forward // 7 + 2):
+            for begin, finish in self.sessions:
+                # Арифметика по местному времени: сессии не сдвигаются при переходе на летнее время
+                start = week_start + timedelta(weeks=week, minutes=begin)
+                if not first <= start.date() <= last or start.date() in self.holidays:
+                    continue
+                end = week_start + timedelta(weeks=week, minutes=finish)
+                bounds.append((start, end))
+        bounds.sort()
+        return bounds
+
+    def is_open(self, now: datetime) -> bool:
+        local = now.astimezone(self.tz)
+        return any(start <= local < end for start, end in self._session_bounds(local, 7, 0))
+
+    def next_open(self, now: datetime) -> Optional[datetime]:
+        """Начало ближайшей будущей сессии (None, если в ближайшие недели торгов нет)."""
+        local = now.astimezone(self.tz)
+        for start, _ in self._session_bounds(local, 0, 21):
+            if start > local:
+                return start
+        return None
+
+    def last_close(self, now: datetime) -> Optional[datetime]:
+        """Конец последней завершившейся сессии."""
+        local = now.astimezone(self.tz)
+        closes = [end for _, end in self._session_bounds(local, 21, 0) if end <= local]
+        return max(closes) if closes else None
+
+
+class MarketState:
+    """Состояние рынка инструмента на момент запроса."""
+
+    __slots__ = ('market', 'is_open', 'last_close', 'next_open')
+
+    def __init__(self, market: Market, is_open: bool, last_close: Optional[datetime], next_open: Optional[datetime]):
+        self.market = market
+        self.is_open = is_open
+        self.last_close = last_close
+        self.next_open = next_open
+
+    def settled(self, now: datetime) -> bool:
+        """Рынок закрыт достаточно давно, чтобы последняя цена была итоговой."""
+        return not self.is_open and (self.last_close is None or (now - self.last_close).total_seconds() >= SETTLE_SECONDS)
+
+    def seconds_to_open(self, now: datetime) -> float:
+        if self.next_open is None:
+            return MARKET_CLOSED_MAX_TTL
+        return min(MARKET_CLOSED_MAX_TTL, max(0.0, (self.next_open - now).total_seconds()))
+
+
+# Все биржи; ключ - код, на который ссылаются EXCHANGE_MARKETS и суффиксы символов
+MARKETS: Dict[str, Market] = {
+    # Основная и вечерняя сессии фондового рынка (с утренней сессией)
+    'MOEX': Market('MOEX', 'Московская биржа', 'Europe/Moscow', weekdays('06:50', '23:50'), HOLIDAYS.get('MOEX', ())),
+    'US': Market('US', 'NYSE/Nasdaq', 'America/New_York', weekdays('09:30', '16:00'), HOLIDAYS.get('US', ())),
+    'XETRA': Market('XETRA', 'Xetra', 'Europe/Berlin', weekdays('09:00', '17:30'), HOLIDAYS.get('XETRA', ())),
+    # Фьючерсы CME Globex: с вечера воскресенья до вечера пятницы с часовым перерывом
+    'FUTURES': Market('FUTURES', 'CME Globex', 'America/Chicago', weekdays('17:00', '16:00', (6, 0, 1, 2, 3))),
+    # Межбанковский валютный рынок: с 17:00 воскресенья до 17:00 пятницы по Нью-Йорку
+    'FX': Market('FX', 'Forex', 'America/New_York', [(6 * MINUTES_PER_DAY + 17 * 60, MINUTES_PER_WEEK + 4 * MINUTES_PER_DAY + 17 * 60)]),
+}
+
+# Биржа из индекса инструментов -> календарь (криптовалюты торгуются круглосуточно)
+EXCHANGE_MARKETS = {
+    'MOEX': 'MOEX', 'NYSE': 'US', 'NASDAQ': 'US', 'CBOE': 'US', 'XETRA': 'XETRA',
+    'COMEX': 'FUTURES', 'NYMEX': 'FUTURES', 'CBOT': 'FUTURES', 'ICE': 'FUTURES',
+}
+
+
+def parse_extra_holidays(spec: str) -> Dict[str, List[date]]:
+    """Разбор MARKET_EXTRA_HOLIDAYS: "MOEX:2026-12-30,US:2026-11-27" -> {'MOEX': [...], 'US': [...]}."""
+    result: Dict[str, List[date]] = {}
+    for item in spec.split(','):
+        if ':' not in item:
+            continue
+        code, day = item.split(':', 1)
+        try:
+            result.setdefault(code.strip().upper(), []).append(date.fromisoformat(day.strip()))
+        except ValueError:
+            logger.warning(f"⚠️ Invalid market holiday: {item}")
+    return result
+
+
+class MarketCalendar:
+    """Состояние рынков по символам Yahoo Finance и расписание курсов ЦБ РФ."""
+
+    def __init__(self, markets: Dict[str, Market] = MARKETS, extra_holidays: str = MARKET_EXTRA_HOLIDAYS,
+                 cbr_publish_time: str = CBR_PUBLISH_TIME):
+        extra = parse_extra_holidays(extra_holidays)
+        self.markets = {code: market.with_holidays(extra.get(code, ())) for code, market in markets.items()}
+        hour, minute = map(int, cbr_publish_time.split(':'))
+        self.cbr_publish_time = dt_time(hour, minute)
+        self.cbr_tz = ZoneInfo('Europe/Moscow')
+        # ЦБ не работает в нерабочие дни в России - те же, что у Московской биржи
+        self.ru_calendar = markets['MOEX']
+
+    def market_for(self, symbol: str) -> Optional[Market]:
+        """Биржа символа Yahoo Finance; None - рынок круглосуточный (криптовалюты)."""
+        symbol = symbol.upper()
+        if symbol.endswith('-USD'):
+            return None
+        if symbol.endswith('=X'):
+            return self.markets['FX']
+        if symbol.endswith('=F'):
+            return self.markets['FUTURES']
+        if symbol.endswith('.ME'):
+            return self.markets['MOEX']
+        instrument = instrument_index.by_symbol(symbol)
+        if instrument:
+            if instrument.exchange == 'CRYPTO':
+                return None
+            return self.markets.get(EXCHANGE_MARKETS.get(instrument.exchange, 'US'))
+        return self.markets['US']
+
+    def state(self, symbol: str, now: Optional[datetime] = None) -> Optional[MarketState]:
+        """Открыт ли рынок символа, когда закрылся и когда откроется; None для круглосуточных."""
+        market = self.market_for(symbol)
+        if market is None:
+            return None
+        now = now or datetime.now(market.tz)
+        if market.is_open(now):
+            return MarketState(market, True, None, None)
+        return MarketState(market, False, market.last_close(now), market.next_open(now))
+
+    def _cbr_working_day(self, day: date) -> bool:
+        self.ru_calendar.check_year(day.year)
+        return day.weekday() < 5 and day not in self.ru_calendar.holidays
+
+    def last_cbr_publication(self, now: datetime) -> datetime:
+        """Последняя публикация курсов ЦБ РФ не позже now."""
+        local = now.astimezone(self.cbr_tz)
+        day = local.date()
+        while True:
+            published = datetime.combine(day, self.cbr_publish_time, tzinfo=self.cbr_tz)
+            if self._cbr_working_day(day) and published <= local:
+                return published
+            day -= timedelta(days=1)
+
+    def next_cbr_publication(self, now: datetime) -> datetime:
+        """Ближайшая публикация курсов ЦБ РФ после now."""
+        local = now.astimezone(self.cbr_tz)
+        day = local.date()
+        while True:
+            published = datetime.combine(day, self.cbr_publish_time, tzinfo=self.cbr_tz)
+            if self._cbr_working_day(day) and published > local:
+                return published
+            day += timedelta(days=1)
+
+    def cbr_rate_ttl(self, rate_date: date, now: Optional[datetime] = None) -> Optional[float]:
+        """
+        Сколько секунд курс ЦБ на дату rate_date остается актуальным;
+        None, если это еще не курс последней публикации (зеркало не обновилось).
+        """
+        now = now or datetime.now(self.cbr_tz)
+        if rate_date <= self.last_cbr_publication(now).date():
+            return None
+        return min(MARKET_CLOSED_MAX_TTL, (self.next_cbr_publication(now) - now).total_seconds())
+
+
+# Глобальный календарь
+market_calendar = MarketCalendar()
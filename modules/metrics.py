@@ -0,0 +1,71 @@
+"""
+Простые метрики в памяти процесса: счетчики и распределения задержек.
+"""
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Счетчики и последние N наблюдений для перцентилей."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counters: Dict[str, float] = {}
+        self.observations: Dict[str, Deque[float]] = {}
+        self.observation_counts: Dict[str, int] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        """Увеличить счетчик."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """Записать наблюдение (например, задержку в секундах)."""
+        if name not in self.observations:
+            self.observations[name] = deque(maxlen=self.window)
+        self.observations[name].append(value)
+        self.observation_counts[name] = self.observation_counts.get(name, 0) + 1
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """Перцентиль по последним наблюдениям (q от 0 до 100)."""
+        values = self.observations.get(name)
+        if not values:
+            return None
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Текущее состояние всех метрик."""
+        summaries = {}
+        for name, values in self.observations.items():
+            summaries[name] = {
+                'count': self.observation_counts[name],
+                'p50': self.percentile(name, 50),
+                'p90': self.percentile(name, 90),
+                'p95': self.percentile(name, 95),
+                'max': max(values),
+            }
+        return {'counters': dict(self.counters), 'observations': summaries}
+
+    def log_summary(self) -> None:
+        """Вывести сводку метрик в лог."""
+        snapshot = self.snapshot()
+        for name, value in sorted(snapshot['counters'].items()):
+            logger.info(f"📈 {name} = {value:g}")
+        for name, summary in sorted(snapshot['observations'].items()):
+            logger.info(
+                f"📈 {name}: n={summary['count']} p50={summary['p50']:.3f} "
+                f"p90={summary['p90']:.3f} p95={summary['p95']:.3f} max={summary['max']:.3f}"
+            )
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.observations.clear()
+        self.observation_counts.clear()
+
+
+# Глобальный экземпляр
+metrics = Metrics()
@@ -0,0 +1,283 @@
+"""
+Отправка сообщений в Telegram.
+
+- длинные ответы делятся на части до 4096 символов по абзацам
+- лимиты Telegram (общий и на чат) соблюдаются через token bucket
+- RetryAfter: ждем столько, сколько сказал Telegram, сетевые ошибки - повтор с паузой
+- индикатор "печатает..." для всех чатов обновляет один общий таймер
+"""
+import logging
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from config import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_MAX_RETRIES, TYPING_INTERVAL,
+)
+from modules.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина текста одного сообщения Telegram (в кодовых единицах UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Разделители в порядке предпочтения: абзац, строка, предложение, слово
+SPLIT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+# Сколько корзин чатов держать, прежде чем удалять полные (неактивные)
+MAX_CHAT_BUCKETS = 10000
+
+
+def telegram_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram: эмодзи вне BMP занимают две единицы UTF-16."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _prefix_within(text: str, limit: int) -> int:
+    """Сколько символов с начала text укладывается в limit единиц UTF-16."""
+    length = 0
+    for index, char in enumerate(text):
+        length += 2 if ord(char) > 0xFFFF else 1
+        if length > limit:
+            return index
+    return len(text)
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Разбить текст на части не длиннее limit (по счету Telegram), по возможности по границам абзацев."""
+    parts: List[str] = []
+    rest = text.strip()
+    while telegram_length(rest) > limit:
+        end = _prefix_within(rest, limit)
+        window = rest[:end]
+        cut = -1
+        for separator in SPLIT_SEPARATORS:
+            position = window.rfind(separator)
+            # Слишком короткие части хуже, чем разрез по менее удачному разделителю
+            if position > end // 2:
+                cut = position + len(separator)
+                break
+        if cut <= 0:
+            cut = end
+        parts.append(rest[:cut].rstrip())
+        rest = rest[cut:].lstrip()
+    if rest:
+        parts.append(rest)
+    return parts
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self) -> float:
+        """Взять токен; 0 - успех, иначе сколько секунд подождать."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """Дождаться токена."""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Пауза из RetryAfter (int в PTB 20, timedelta в новых версиях)."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+
+class OutboundSender:
+    """Отправка сообщений с учетом лимитов Telegram и повторами."""
+
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, max_retries: int = SEND_MAX_RETRIES,
+                 backoff: float = 0.5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                # Полная корзина ничем не отличается от новой - такие можно забыть
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.full}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить вызов Bot API для чата с учетом лимитов.
+        RetryAfter и сетевые ошибки повторяются, BadRequest и Forbidden - нет.
+        """
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(1, self.max_retries + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                result = await call()
+                metrics.inc("telegram.sent")
+                return result
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                metrics.inc("telegram.retry_after")
+                logger.warning(f"⏳ Flood control for chat {chat_id}: retry in {wait}s (attempt {attempt})")
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(wait)
+            except (BadRequest, Forbidden):
+                raise
+            except NetworkError as e:
+                metrics.inc("telegram.network_errors")
+                logger.warning(f"Failed to send to chat {chat_id} (attempt {attempt}): {e}")
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+    async def send_text(self, chat_id: int, text: str, send: Callable[[str], Awaitable[Any]]) -> List[Any]:
+        """Отправить текст (при необходимости несколькими сообщениями) через send, например reply_text."""
+        parts = split_message(text)
+        if len(parts) > 1:
+            logger.info(f"✂️ Long answer for chat {chat_id} split into {len(parts)} messages")
+        return [await self.send(chat_id, lambda part=part: send(part)) for part in parts]
+
+
+class _TypingChat:
+    """Состояние индикатора одного чата."""
+
+    __slots__ = ('count', 'send_action', 'last_sent', 'paused', 'disabled')
+
+    def __init__(self, send_action: Callable[[], Awaitable[Any]]):
+        self.count = 0
+        self.send_action = send_action
+        self.last_sent = 0.0
+        self.paused = 0
+        self.disabled = False
+
+
+class TypingTicker:
+    """
+    Один таймер на все чаты: пока в чате есть незавершенные сообщения,
+    раз в interval отправляется одно "печатает..." на чат, сколько бы сообщений
+    в нем ни ждало ответа.
+
+    Метрики: telegram.typing_sent - отправлено, telegram.typing_saved - сколько
+    вызовов сделала бы отдельная задача keep_typing на каждое сообщение сверх этого.
+    """
+
+    def __init__(self, interval: float = TYPING_INTERVAL):
+        self.interval = interval
+        self._chats: Dict[int, _TypingChat] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    @asynccontextmanager
+    async def track(self, chat_id: int, send_action: Callable[[], Awaitable[Any]]):
+        """
+        Показывать индикатор в чате на время блока. Первый отправляется сразу
+        (в фоне, не задерживая работу), если чат еще не отслеживается.
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _TypingChat(send_action)
+            self._spawn(self._send(chat_id, chat))
+        else:
+            metrics.inc("telegram.typing_saved")
+        chat.count += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            yield
+        finally:
+            chat.count -= 1
+            if chat.count <= 0:
+                self._chats.pop(chat_id, None)
+
+    @asynccontextmanager
+    async def paused(self, chat_id: int):
+        """Не обновлять индикатор на время блока (например, пока отправляется ответ)."""
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            chat.paused += 1
+        try:
+            yield
+        finally:
+            if chat is not None:
+                chat.paused -= 1
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _send(self, chat_id: int, chat: _TypingChat) -> None:
+        chat.last_sent = time.monotonic()
+        try:
+            await chat.send_action()
+            metrics.inc("telegram.typing_sent")
+        except Forbidden as e:
+            # Бот заблокирован в чате - до конца работы индикатор больше не нужен
+            chat.disabled = True
+            logger.info(f"Typing indicator disabled for chat {chat_id}: {e}")
+        except Exception as e:
+            logger.warning(f"Failed to send typing indicator to chat {chat_id}: {e}")
+
+    def _due(self, now: float) -> List[int]:
+        """Чаты, которым пора обновить индикатор."""
+        due = []
+        for chat_id, chat in self._chats.items():
+            if chat.disabled or chat.paused:
+                continue
+            # Индикатор, отправленный меньше полуинтервала назад, еще виден до следующего тика
+            if now - chat.last_sent < self.interval / 2:
+                metrics.inc("telegram.typing_saved", chat.count)
+                continue
+            metrics.inc("telegram.typing_saved", chat.count - 1)
+            due.append(chat_id)
+        return due
+
+    async def _run(self) -> None:
+        while self._chats:
+            await asyncio.sleep(self.interval)
+            due = self._due(time.monotonic())
+            if due:
+                await asyncio.gather(*(self._send(chat_id, self._chats[chat_id]) for chat_id in due))
+
+    async def stop(self) -> None:
+        """Остановить таймер (при завершении работы)."""
+        self._chats.clear()
+        tasks = [task for task in (self._task, *self._pending) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+outbound = OutboundSender()
+typing_ticker = TypingTicker()
@@ -0,0 +1,282 @@
+"""
+Аналитика портфеля (/portfolio).
+
+Истории цен всех позиций и бенчмарка загружаются одним запросом и
+выравниваются по датам в одну матрицу; доходности, волатильность,
+корреляции, беты и просадки считаются векторно NumPy по всей матрице сразу.
+Все, что не зависит от весов, кешируется по набору инструментов, поэтому
+повторный расчет с другими весами - это несколько матричных умножений.
+"""
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import PORTFOLIO_PERIOD, PORTFOLIO_BENCHMARK, PORTFOLIO_MAX_POSITIONS, PORTFOLIO_CACHE_TTL
+from modules.finance_data import finance_client, yahoo_symbol
+from modules.instruments import instrument_index
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    np = None
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS = 252
+# Минимум общих торговых дней для осмысленной статистики
+MIN_HISTORY_DAYS = 20
+# Сколько наборов инструментов держать в кеше
+MATRIX_CACHE_SIZE = 64
+
+# Позиции разделяются запятой (не между цифрами: "0,5" - число), точкой с запятой или переводом строки
+SEGMENT_SPLIT_RE = re.compile(r'(?<!\d),|,(?!\d)|[;\n]')
+# Вес до или после названия: "1000 AAPL", "SBER:20%", "BTC 0,5"
+LEADING_AMOUNT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%?\s*')
+TRAILING_AMOUNT_RE = re.compile(r'\s*[:=]?\s*(\d+(?:[.,]\d+)?)\s*%?')
+TOKEN_RE = re.compile(r'[A-Za-zА-Яа-яЁё^][\w.=^\-]*')
+SPACE_RE = re.compile(r'\s*')
+
+
+def _parse_segment(segment: str) -> Optional[List[Tuple[str, float]]]:
+    """
+    Позиции одного фрагмента ("газпром нефть 20", "S&P 500 50", "SBER.ME GAZP.ME").
+    Название ищется самым длинным синонимом индекса (символ Yahoo Finance, если он длиннее),
+    затем как ключ, символ или опечатка;
+    неизвестное слово принимается как тикер, только если написано заглавными (PLTR).
+    None - во фрагменте есть нераспознанное название.
+    """
+    positions = []
+    position = SPACE_RE.match(segment).end()
+    while position < len(segment):
+        amount = None
+        leading = LEADING_AMOUNT_RE.match(segment, position)
+        if leading:
+            amount = leading.group(1)
+            position = leading.end()
+
+        token = TOKEN_RE.match(segment, position)
+        match = instrument_index.match_prefix(segment, position)
+        # Символ с суффиксом биржи (SBER.ME) длиннее синонима sber
+        if token and match and token.end() > match[1] and instrument_index.by_symbol(token.group()):
+            match = None
+        if match:
+            symbol, position = match[0].symbol, match[1]
+        else:
+            if not token:
+                return None
+            instrument = instrument_index.resolve(token.group())
+            if instrument:
+                symbol = instrument.symbol
+            elif re.fullmatch(r'[A-Z^][A-Z0-9.=^\-]*', token.group()):
+                symbol = yahoo_symbol(token.group())
+            else:
+                return None
+            position = token.end()
+
+        if amount is None:
+            trailing = TRAILING_AMOUNT_RE.match(segment, position)
+            if trailing:
+                amount = trailing.group(1)
+                position = trailing.end()
+        positions.append((symbol, float(amount.replace(',', '.')) if amount else 1.0))
+        position = SPACE_RE.match(segment, position).end()
+    return positions
+
+
+def parse_holdings(text: str, rejected: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+    """
+    Позиции портфеля из текста: (символ Yahoo Finance, вес).
+    Веса - любые положительные числа (доли, проценты, суммы); без чисел - поровну.
+    Нераспознанные фрагменты пропускаются и добавляются в rejected, если он передан.
+    """
+    weights: Dict[str, float] = {}
+    for segment in SEGMENT_SPLIT_RE.split(text):
+        segment = segment.strip()
+        if not segment:
+            continue
+        positions = _parse_segment(segment)
+        if positions is None:
+            logger.info(f"Portfolio position not recognized: {segment[:60]}")
+            if rejected is not None:
+                rejected.append(segment)
+            continue
+        for symbol, weight in positions:
+            if weight > 0:
+                weights[symbol] = weights.get(symbol, 0.0) + weight
+    return list(weights.items())
+
+
+def max_drawdown(returns: "np.ndarray") -> "np.ndarray":
+    """Максимальная просадка по столбцам матрицы доходностей (или по вектору)."""
+    wealth = np.cumprod(1 + returns, axis=0)
+    peaks = np.maximum.accumulate(np.maximum(wealth, 1.0), axis=0)
+    return (wealth / peaks - 1).min(axis=0)
+
+
+def align_prices(dates: Sequence[str], closes: Dict[str, Sequence[float]],
+                 symbols: Sequence[str]) -> Tuple[List[str], "np.ndarray"]:
+    """
+    Матрица цен (даты x инструменты): пропуски заполняются последней известной ценой
+    (разные биржевые календари), даты до появления данных по всем инструментам отбрасываются.
+    """
+    prices = np.array([closes[symbol] for symbol in symbols], dtype=float).T
+    mask = np.isnan(prices)
+    # Индекс последней известной строки для каждой ячейки - forward fill без цикла
+    rows = np.where(mask, 0, np.arange(prices.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    prices = prices[rows, np.arange(prices.shape[1])]
+    complete = ~np.isnan(prices).any(axis=1)
+    start = int(np.argmax(complete)) if complete.any() else len(dates)
+    return list(dates[start:]), prices[start:]
+
+
+class PriceMatrix:
+    """Выровненные цены набора инструментов и производные, не зависящие от весов."""
+
+    __slots__ = (
+        'symbols', 'dates', 'prices', 'returns', 'benchmark_returns', 'total_return',
+        'volatility', 'covariance', 'correlation', 'beta', 'max_drawdown',
+    )
+
+    def __init__(self, symbols: List[str], dates: List[str], prices: "np.ndarray", benchmark: Optional["np.ndarray"]):
+        self.symbols = symbols
+        self.dates = dates
+        self.prices = prices
+        self.returns = prices[1:] / prices[:-1] - 1
+        self.total_return = prices[-1] / prices[0] - 1
+        self.covariance = np.atleast_2d(np.cov(self.returns, rowvar=False))
+        self.volatility = np.sqrt(np.diag(self.covariance) * TRADING_DAYS)
+        std = np.sqrt(np.diag(self.covariance))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.correlation = np.nan_to_num(self.covariance / np.outer(std, std))
+        self.max_drawdown = max_drawdown(self.returns)
+        self.benchmark_returns = None
+        self.beta = None
+        if benchmark is not None:
+            self.benchmark_returns = benchmark[1:] / benchmark[:-1] - 1
+            centered = self.benchmark_returns - self.benchmark_returns.mean()
+            variance = centered @ centered
+            if variance > 0:
+                self.beta = (self.returns - self.returns.mean(axis=0)).T @ centered / variance
+
+
+class PortfolioAnalyzer:
+    """Расчет метрик портфеля с кешем матриц по набору инструментов."""
+
+    def __init__(self, period: str = PORTFOLIO_PERIOD, benchmark: str = PORTFOLIO_BENCHMARK,
+                 cache_ttl: float = PORTFOLIO_CACHE_TTL, client=finance_client):
+        self.period = period
+        self.benchmark = benchmark
+        self.cache_ttl = cache_ttl
+        self.client = client
+        self._cache: "OrderedDict[Tuple[str, ...], Tuple[float, PriceMatrix, List[str]]]" = OrderedDict()
+
+    async def _matrix(self, symbols: List[str]) -> Tuple[Optional[PriceMatrix], List[str]]:
+        """Матрица для набора инструментов (из кеша или одним запросом истории) и символы без данных."""
+        key = tuple(sorted(symbols))
+        cached = self._cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            return cached[1], cached[2]
+
+        requested = list(key) + ([self.benchmark] if self.benchmark and self.benchmark not in key else [])
+        history = await self.client.get_price_history(requested, self.period)
+        if not history:
+            return None, list(key)
+        closes = history['closes']
+        found = [symbol for symbol in key if symbol in closes]
+        missing = [symbol for symbol in key if symbol not in closes]
+        if not found:
+            return None, missing
+
+        with_benchmark = found + ([self.benchmark] if self.benchmark in closes else [])
+        dates, prices = align_prices(history['dates'], closes, with_benchmark)
+        if len(dates) < MIN_HISTORY_DAYS:
+            return None, list(key)
+        benchmark = prices[:, -1] if self.benchmark in closes else None
+        matrix = PriceMatrix(found, dates, prices[:, :len(found)], benchmark)
+
+        self._cache[key] = (time.monotonic() + self.cache_ttl, matrix, missing)
+        while len(self._cache) > MATRIX_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return matrix, missing
+
+    async def analyze(self, holdings: List[Tuple[str, float]]) -> Optional[Dict]:
+        """Метрики портфеля; None, если данных недостаточно."""
+        if not NUMPY_AVAILABLE or not holdings:
+            return None
+        holdings = holdings[:PORTFOLIO_MAX_POSITIONS]
+        matrix, missing = await self._matrix([symbol for symbol, _ in holdings])
+        if matrix is None:
+            return {'missing': missing} if missing else None
+        return compute_portfolio(matrix, dict(holdings), missing)
+
+
+def compute_portfolio(matrix: PriceMatrix, weights_by_symbol: Dict[str, float], missing: List[str]) -> Dict:
+    """Метрики портфеля по кешированной матрице: только операции, зависящие от весов."""
+    weights = np.array([weights_by_symbol[symbol] for symbol in matrix.symbols], dtype=float)
+    weights /= weights.sum()
+    portfolio_returns = matrix.returns @ weights
+
+    # Самые коррелированные пары - из верхнего треугольника матрицы
+    n = len(matrix.symbols)
+    pairs = []
+    if n > 1:
+        upper_i, upper_j = np.triu_indices(n, k=1)
+        values = matrix.correlation[upper_i, upper_j]
+        for index in np.argsort(values)[::-1][:3]:
+            pairs.append((matrix.symbols[upper_i[index]], matrix.symbols[upper_j[index]], float(values[index])))
+
+    return {
+        'symbols': matrix.symbols,
+        'weights': weights.tolist(),
+        'days': len(matrix.dates),
+        'start': matrix.dates[0],
+        'end': matrix.dates[-1],
+        'total_return': matrix.total_return.tolist(),
+        'volatility': matrix.volatility.tolist(),
+        'beta': matrix.beta.tolist() if matrix.beta is not None else None,
+        'max_drawdown': matrix.max_drawdown.tolist(),
+        'portfolio': {
+            'total_return': float(np.prod(1 + portfolio_returns) - 1),
+            'volatility': float(np.sqrt(weights @ matrix.covariance @ weights * TRADING_DAYS)),
+            'beta': float(matrix.beta @ weights) if matrix.beta is not None else None,
+            'max_drawdown': float(max_drawdown(portfolio_returns)),
+        },
+        'top_correlations': pairs,
+        'missing': missing,
+    }
+
+
+def format_portfolio_summary(result: Dict, benchmark: str = PORTFOLIO_BENCHMARK) -> str:
+    """Сводка расчетов для пользователя и LLM."""
+    if not result.get('symbols'):
+        return "❌ Не удалось получить историю цен: " + ", ".join(result.get('missing', []))
+
+    portfolio = result['portfolio']
+    beta = f", бета {portfolio['beta']:.2f} к {benchmark}" if portfolio['beta'] is not None else ""
+    lines = [
+        f"Портфель из {len(result['symbols'])} позиций, {result['start']} - {result['end']} ({result['days']} торговых дней)",
+        f"Итого: доходность {portfolio['total_return']:+.1%}, волатильность {portfolio['volatility']:.1%}"
+        f"{beta}, макс. просадка {portfolio['max_drawdown']:.1%}",
+        "Позиции:",
+    ]
+    betas = result['beta'] or [None] * len(result['symbols'])
+    for symbol, weight, ret, vol, b, dd in zip(
+        result['symbols'], result['weights'], result['total_return'],
+        result['volatility'], betas, result['max_drawdown']
+    ):
+        beta_text = f", бета {b:.2f}" if b is not None else ""
+        lines.append(f"• {symbol} {weight:.0%}: доходность {ret:+.1%}, волатильность {vol:.1%}{beta_text}, просадка {dd:.1%}")
+    if result['top_correlations']:
+        pairs = ", ".join(f"{a}/{b} {value:.2f}" for a, b, value in result['top_correlations'])
+        lines.append(f"Наиболее коррелированные пары: {pairs}")
+    if result['missing']:
+        lines.append("Нет данных: " + ", ".join(result['missing']))
+    return "\n".join(lines)
+
+
+portfolio_analyzer = PortfolioAnalyzer()
@@ -0,0 +1,389 @@
+"""
+Потоковые котировки по WebSocket.
+
+Самые популярные инструменты (BTC, ETH, золото, USD/RUB) не запрашиваются
+на каждое сообщение: цены приходят push-потоком и складываются в компактную
+таблицу на массивах, откуда FinanceDataClient читает их без сетевых запросов.
+
+- клиент WebSocket (RFC 6455) на asyncio streams, без внешних библиотек
+- heartbeat: ping раз в PRICE_FEED_PING_INTERVAL, без данных дольше
+  PRICE_FEED_STALE_AFTER соединение считается зависшим
+- переподключение с экспоненциальной паузой и джиттером
+
+Поддерживаемые форматы сообщений:
+- Binance miniTicker: {"stream": "...", "data": {"s": "BTCUSDT", "c": "67250.1", "o": "66100.0"}}
+- простой JSON: {"symbol": "XAUUSD", "price": 2150.3, "open": 2141.0} или список таких объектов
+"""
+import logging
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import ssl
+import struct
+import time
+from array import array
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from config import (
+    PRICE_FEED_URL, PRICE_FEED_SYMBOLS, PRICE_FEED_PING_INTERVAL, PRICE_FEED_STALE_AFTER, PRICE_FEED_BACKOFF_MAX,
+)
+from modules.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Инструменты таблицы: ключ -> (символ котировки, название, валюта)
+FEED_INSTRUMENTS: Dict[str, Tuple[str, str, str]] = {
+    'BTC': ('BTC-USD', 'Bitcoin', 'USD'),
+    'ETH': ('ETH-USD', 'Ethereum', 'USD'),
+    'GOLD': ('GC=F', 'Gold', 'USD'),
+    'USD': ('USD/RUB', 'Доллар США', 'RUB'),
+}
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+# Максимальный размер одного сообщения фида
+MAX_MESSAGE_SIZE = 1 << 20
+CONNECT_TIMEOUT = 10
+
+
+class WebSocketError(Exception):
+    """Ошибка протокола или закрытие соединения WebSocket."""
+
+
+def parse_feed_symbols(spec: str) -> Dict[str, str]:
+    """'BTCUSDT:BTC,XAUUSD:GOLD' -> {'BTCUSDT': 'BTC', 'XAUUSD': 'GOLD'}"""
+    symbols = {}
+    for item in spec.split(','):
+        feed_symbol, _, key = item.strip().partition(':')
+        if feed_symbol and key:
+            symbols[feed_symbol.upper()] = key.upper()
+    return symbols
+
+
+def _mask(data: bytes, key: bytes) -> bytes:
+    """Маска клиентского фрейма (XOR целиком, без цикла по байтам)."""
+    if not data:
+        return data
+    repeated = (key * (len(data) // 4 + 1))[:len(data)]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(len(data), 'big')
+
+
+class WebSocketConnection:
+    """Минимальный клиент WebSocket: текстовые сообщения, ping/pong, close."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, url: str) -> "WebSocketConnection":
+        parsed = urlparse(url)
+        if parsed.scheme not in ('ws', 'wss'):
+            raise WebSocketError(f"Unsupported URL scheme: {parsed.scheme}")
+        secure = parsed.scheme == 'wss'
+        host = parsed.hostname
+        port = parsed.port or (443 if secure else 80)
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=ssl.create_default_context() if secure else None
+        )
+
+        path = parsed.path or '/'
+        if parsed.query:
+            path += f"?{parsed.query}"
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parsed.netloc}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        await writer.drain()
+
+        head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1')
+        status_line, *header_lines = head.split("\r\n")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        expected = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        if " 101 " not in f"{status_line} " or headers.get('sec-websocket-accept') != expected:
+            writer.close()
+            raise WebSocketError(f"Handshake failed: {status_line}")
+        return cls(reader, writer)
+
+    async def _send_frame(self, opcode: int, payload: bytes = b"") -> None:
+        length = len(payload)
+        header = bytes([0x80 | opcode])
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('!Q', length)
+        key = os.urandom(4)
+        self._writer.write(header + key + _mask(payload, key))
+        await self._writer.drain()
+
+    async def _read_frame(self) -> Tuple[bool, int, bytes]:
+        first, second = await self._reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await self._reader.readexactly(8))[0]
+        if length > MAX_MESSAGE_SIZE:
+            raise WebSocketError(f"Frame too large: {length} bytes")
+        key = await self._reader.readexactly(4) if second & 0x80 else None
+        payload = await self._reader.readexactly(length)
+        if key:
+            payload = _mask(payload, key)
+        return bool(first & 0x80), first & 0x0F, payload
+
+    async def recv(self) -> Tuple[int, bytes]:
+        """Следующее сообщение (OP_TEXT/OP_BINARY/OP_PONG); на ping отвечает сам."""
+        message_opcode, parts = None, []
+        while True:
+            fin, opcode, payload = await self._read_frame()
+            if opcode == OP_PING:
+                await self._send_frame(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                return opcode, payload
+            if opcode == OP_CLOSE:
+                code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else None
+                raise WebSocketError(f"Closed by server (code {code})")
+            if opcode != OP_CONTINUATION:
+                message_opcode, parts = opcode, []
+            parts.append(payload)
+            if fin:
+                return message_opcode, b"".join(parts)
+
+    async def ping(self) -> None:
+        await self._send_frame(OP_PING)
+
+    async def close(self) -> None:
+        try:
+            if not self._writer.is_closing():
+                await self._send_frame(OP_CLOSE, struct.pack('!H', 1000))
+        except (OSError, RuntimeError):
+            pass
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception:
+            pass
+
+
+class QuoteTable:
+    """
+    Котировки фиксированного набора инструментов в массивах array('d'):
+    цена, цена открытия (для изменения за период) и время обновления.
+    Обновление и чтение - O(1) без аллокаций словарей на каждый тик.
+    """
+
+    def __init__(self, instruments: Dict[str, Tuple[str, str, str]] = FEED_INSTRUMENTS, source: str = ''):
+        self.instruments = instruments
+        self.source = source
+        self._index = {key: i for i, key in enumerate(instruments)}
+        size = len(instruments)
+        self._price = array('d', [math.nan]) * size
+        self._open = array('d', [math.nan]) * size
+        self._updated = array('d', [0.0]) * size  # time.time() последнего тика
+        # Подписчики на тики: callback(ключ инструмента, цена)
+        self.listeners: List[Callable[[str, float], None]] = []
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def update(self, key: str, price: float, open_price: Optional[float] = None,
+               timestamp: Optional[float] = None) -> bool:
+        i = self._index.get(key)
+        if i is None:
+            return False
+        self._price[i] = price
+        if open_price is not None:
+            self._open[i] = open_price
+        self._updated[i] = timestamp or time.time()
+        for listener in self.listeners:
+            try:
+                listener(key, price)
+            except Exception as e:
+                logger.warning(f"Quote listener failed for {key}: {e}")
+        return True
+
+    def age(self, key: str) -> Optional[float]:
+        """Сколько секунд назад обновлялась котировка (None - данных нет)."""
+        i = self._index.get(key)
+        if i is None or not self._updated[i]:
+            return None
+        return max(0.0, time.time() - self._updated[i])
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        """Котировка в формате FinanceDataClient; None, если данных нет или они старше max_age."""
+        age = self.age(key)
+        if age is None or (max_age is not None and age > max_age):
+            return None
+        i = self._index[key]
+        price, open_price = self._price[i], self._open[i]
+        change = price - open_price if open_price == open_price else 0.0  # NaN != NaN
+        symbol, name, currency = self.instruments[key]
+        return {
+            'symbol': symbol,
+            'price': round(price, 4) if currency == 'RUB' else round(price, 2),
+            'change': round(change, 4) if currency == 'RUB' else round(change, 2),
+            'change_percent': round(change / open_price * 100, 2) if change and open_price else 0.0,
+            'currency': currency,
+            'name': name,
+            'source': self.source,
+            'timestamp': datetime.fromtimestamp(self._updated[i]).isoformat(),
+            'age': round(age, 1),
+        }
+
+    def snapshot(self, since: float = 0.0) -> List[Tuple[str, float, float, float]]:
+        """Котировки, обновленные позже since: (ключ, цена, открытие, время) - для передачи в другой процесс."""
+        return [
+            (key, self._price[i], self._open[i], self._updated[i])
+            for key, i in self._index.items() if self._updated[i] > since
+        ]
+
+    def load(self, rows: List[Tuple[str, float, float, float]]) -> None:
+        """Применить снимок другого процесса (см. snapshot)."""
+        for key, price, open_price, updated in rows:
+            self.update(key, price, open_price if open_price == open_price else None, updated)
+
+
+def parse_feed_message(data: bytes) -> Iterator[Tuple[str, float, Optional[float]]]:
+    """(символ фида, цена, цена открытия) для каждой котировки в сообщении."""
+    try:
+        message = json.loads(data)
+    except ValueError:
+        return
+    if isinstance(message, dict) and isinstance(message.get('data'), (dict, list)):
+        message = message['data']
+    for item in message if isinstance(message, list) else [message]:
+        if not isinstance(item, dict):
+            continue
+        symbol = item.get('s', item.get('symbol'))
+        price = item.get('c', item.get('price'))
+        if symbol is None or price is None:
+            continue
+        open_price = item.get('o', item.get('open'))
+        try:
+            yield str(symbol).upper(), float(price), float(open_price) if open_price is not None else None
+        except (TypeError, ValueError):
+            continue
+
+
+def _source_name(url: str) -> str:
+    """stream.binance.com -> Binance"""
+    host = urlparse(url).hostname or url
+    parts = host.split('.')
+    return parts[-2].capitalize() if len(parts) >= 2 and not host.replace('.', '').isdigit() else host
+
+
+class PriceFeed:
+    """Потребитель WebSocket-фида с переподключением, обновляющий QuoteTable."""
+
+    def __init__(self, url: str = PRICE_FEED_URL, symbols: Optional[Dict[str, str]] = None,
+                 table: Optional[QuoteTable] = None, ping_interval: float = PRICE_FEED_PING_INTERVAL,
+                 stale_after: float = PRICE_FEED_STALE_AFTER, backoff: float = 1.0,
+                 backoff_max: float = PRICE_FEED_BACKOFF_MAX):
+        self.url = url
+        self.symbols = symbols if symbols is not None else parse_feed_symbols(PRICE_FEED_SYMBOLS)
+        self.table = table if table is not None else QuoteTable()
+        self.table.source = self.table.source or _source_name(url)
+        self.ping_interval = ping_interval
+        self.stale_after = stale_after
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Запустить потребителя фида (идемпотентно)."""
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"📡 Price feed started: {self.url}")
+
+    async def _run(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                if await self._consume():
+                    attempt = 0
+            except asyncio.CancelledError:
+                raise
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, WebSocketError) as e:
+                logger.warning(f"⚠️ Price feed connection failed: {e or type(e).__name__}")
+            except Exception as e:
+                # Испорченный кадр или сообщение не должны навсегда останавливать фид
+                logger.error(f"❌ Price feed error, reconnecting: {type(e).__name__}: {e}")
+            finally:
+                self.connected = False
+            metrics.inc("price_feed.reconnects")
+            # Пауза растет только пока соединения не приносят данных
+            delay = min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _consume(self) -> bool:
+        """Читать фид до разрыва соединения; True, если были получены котировки."""
+        # asyncio.timeout, а не wait_for: wait_for теряет отмену, если соединение установилось одновременно с ней
+        async with asyncio.timeout(CONNECT_TIMEOUT):
+            ws = await WebSocketConnection.connect(self.url)
+        self.connected = True
+        logger.info(f"📡 Price feed connected: {self.url}")
+        heartbeat = asyncio.create_task(self._heartbeat(ws))
+        received = False
+        try:
+            while True:
+                # Нет ни данных, ни pong дольше stale_after - соединение зависло
+                async with asyncio.timeout(self.stale_after):
+                    opcode, data = await ws.recv()
+                if opcode != OP_TEXT:
+                    continue
+                for feed_symbol, price, open_price in parse_feed_message(data):
+                    key = self.symbols.get(feed_symbol)
+                    if key and self.table.update(key, price, open_price):
+                        received = True
+                        metrics.inc("price_feed.ticks")
+        except asyncio.TimeoutError:
+            error = f"no data for {self.stale_after}s"
+        except (OSError, asyncio.IncompleteReadError, WebSocketError) as e:
+            error = str(e) or type(e).__name__
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            await ws.close()
+        if not received:
+            raise WebSocketError(error)
+        logger.warning(f"⚠️ Price feed disconnected: {error}")
+        return True
+
+    async def _heartbeat(self, ws: WebSocketConnection) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await ws.ping()
+
+    async def stop(self) -> None:
+        """Остановить потребителя фида."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Price feed stopped")
+
+
+quote_table = QuoteTable(source=_source_name(PRICE_FEED_URL))
+price_feed = PriceFeed(table=quote_table)
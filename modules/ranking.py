@@ -0,0 +1,183 @@
+"""
+Объединение результатов разных поисковых источников.
+
+- дубликаты по каноническому URL (без www, якорей, utm-меток, завершающего /)
+- почти одинаковые сниппеты по сходству шинглов (MinHash)
+- оценка по надежности источника и свежести, в ответ попадают top-k
+"""
+import logging
+import math
+import re
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from config import SEARCH_TOP_K, SEARCH_DUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Надежность источников по домену (поддомены наследуют оценку)
+DOMAIN_RELIABILITY: Dict[str, float] = {
+    'cbr.ru': 1.0,
+    'moex.com': 0.95,
+    'finance.yahoo.com': 0.9,
+    'investing.com': 0.8,
+    'interfax.ru': 0.75,
+    'rbc.ru': 0.7,
+    'finam.ru': 0.7,
+    'kommersant.ru': 0.7,
+    'vedomosti.ru': 0.7,
+    'reuters.com': 0.75,
+    'bloomberg.com': 0.75,
+}
+DEFAULT_RELIABILITY = 0.5
+# Заглушки search_simple_web и mock-данные
+PLACEHOLDER_RELIABILITY = 0.1
+PLACEHOLDER_SOURCES = ('Web Search',)
+
+RELIABILITY_WEIGHT = 0.7
+FRESHNESS_WEIGHT = 0.3
+# За сколько часов свежесть падает в e раз
+FRESHNESS_DECAY_HOURS = 24.0
+DEFAULT_FRESHNESS = 0.5
+
+# Параметры запроса, не влияющие на содержимое страницы: точные имена и префикс utm_
+TRACKING_PARAMS = frozenset(('yclid', 'gclid', 'fbclid', 'from', 'ref'))
+TRACKING_PREFIX = 'utm_'
+
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 32
+_MERSENNE_PRIME = (1 << 61) - 1
+# Фиксированные коэффициенты перестановок (a * x + b) mod p, одинаковые во всех процессах
+_PERMUTATIONS: List[Tuple[int, int]] = [
+    ((i * 0x9E3779B97F4A7C15 + 1) % _MERSENNE_PRIME or 1, (i * 0xC2B2AE3D27D4EB4F + 7) % _MERSENNE_PRIME)
+    for i in range(1, MINHASH_PERMUTATIONS + 1)
+]
+_WORD_RE = re.compile(r"\w+")
+
+
+def canonical_url(url: str) -> str:
+    """Канонический вид URL для сравнения результатов."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIX)
+    ))
+    path = parts.path.rstrip('/') or ''
+    return urlunsplit(('https', host, path, query, ''))
+
+
+def minhash_signature(text: str) -> Tuple[int, ...]:
+    """MinHash-подпись множества словесных шинглов текста."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = {' '.join(words)}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def signature_similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Оценка сходства Жаккара по двум подписям."""
+    return sum(1 for a, b in zip(first, second) if a == b) / MINHASH_PERMUTATIONS
+
+
+def source_reliability(result: Dict) -> float:
+    """Надежность источника результата."""
+    if result.get('quote'):
+        # Структурированная котировка из API - самые достоверные данные
+        return 1.0
+    if result.get('mock') or result.get('source') in PLACEHOLDER_SOURCES:
+        return PLACEHOLDER_RELIABILITY
+    host = urlsplit(result.get('url', '')).netloc.lower()
+    while host:
+        if host in DOMAIN_RELIABILITY:
+            return DOMAIN_RELIABILITY[host]
+        _, _, host = host.partition('.')
+    return DEFAULT_RELIABILITY
+
+
+def freshness(result: Dict, now: Optional[datetime] = None) -> float:
+    """Свежесть результата от 0 до 1 по времени котировки или публикации."""
+    timestamp = result.get('published') or (result.get('quote') or {}).get('timestamp')
+    if not timestamp:
+        return DEFAULT_FRESHNESS
+    try:
+        moment = datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return DEFAULT_FRESHNESS
+    if moment.tzinfo is not None:
+        moment = moment.replace(tzinfo=None)
+    age_hours = max(((now or datetime.now()) - moment).total_seconds() / 3600, 0.0)
+    return math.exp(-age_hours / FRESHNESS_DECAY_HOURS)
+
+
+def score_result(result: Dict, now: Optional[datetime] = None) -> float:
+    """Итоговая оценка результата."""
+    return RELIABILITY_WEIGHT * source_reliability(result) + FRESHNESS_WEIGHT * freshness(result, now)
+
+
+def rank_results(
+    results: List[Dict],
+    top_k: int = SEARCH_TOP_K,
+    threshold: float = SEARCH_DUP_THRESHOLD,
+    now: Optional[datetime] = None,
+) -> List[Dict]:
+    """
+    Убрать дубликаты и вернуть top_k лучших результатов.
+
+    Из группы дубликатов остается результат с наибольшей оценкой;
+    при равных оценках сохраняется исходный порядок. Котировки в top_k
+    не считаются: каждый запрошенный инструмент остается в ответе
+    (повторы убираются по символу), а места текстовых результатов они не занимают.
+    """
+    scored = sorted(
+        ((score_result(result, now), index, result) for index, result in enumerate(results)),
+        key=lambda item: (-item[0], item[1]),
+    )
+
+    kept: List[Dict] = []
+    texts = 0
+    seen_urls = set()
+    seen_symbols = set()
+    signatures: List[Tuple[int, ...]] = []
+    for _, _, result in scored:
+        quote = result.get('quote')
+        if quote:
+            symbol = quote.get('symbol')
+            if symbol in seen_symbols:
+                continue
+            seen_symbols.add(symbol)
+            kept.append(result)
+            continue
+        if texts >= top_k:
+            continue
+
+        url = canonical_url(result.get('url', ''))
+        if url:
+            if url in seen_urls:
+                continue
+            seen_urls.add(url)
+
+        text = result.get('snippet') or result.get('title') or ''
+        if text:
+            signature = minhash_signature(text)
+            if any(signature_similarity(signature, other) >= threshold for other in signatures):
+                continue
+            signatures.append(signature)
+
+        kept.append(result)
+        texts += 1
+
+    if len(kept) < len(results):
+        logger.info(f"🧹 Search results merged: {len(results)} -> {len(kept)}")
+    return kept
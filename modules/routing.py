@@ -0,0 +1,116 @@
+"""
+Маршрутизация запросов по уровням моделей.
+
+- quote    - простой вопрос о цене: дешевая быстрая модель, короткий ответ
+- followup - короткое уточнение в продолжение диалога
+- analysis - полноценный анализ: основная (premium) модель
+- deep     - развернутый анализ нескольких активов: выполняется в фоне (modules/jobs)
+"""
+import logging
+import re
+from typing import Dict
+from config import (
+    ROUTING_ENABLED,
+    LLM_MODEL_QUOTE, LLM_MODEL_FOLLOWUP, LLM_MODEL_ANALYSIS,
+    LLM_MAX_TOKENS_QUOTE, LLM_MAX_TOKENS_FOLLOWUP, LLM_MAX_TOKENS_ANALYSIS,
+    LLM_TEMPERATURE_QUOTE, LLM_TEMPERATURE_FOLLOWUP, LLM_TEMPERATURE_ANALYSIS,
+    LLM_MODEL_SUMMARY, LLM_MAX_TOKENS_SUMMARY, LLM_MODEL_DEEP, LLM_MAX_TOKENS_DEEP,
+)
+
+logger = logging.getLogger(__name__)
+
+TIER_QUOTE = "quote"
+TIER_FOLLOWUP = "followup"
+TIER_ANALYSIS = "analysis"
+TIER_DEEP = "deep"
+# Служебный уровень для сводки диалога (classify_request его не возвращает)
+TIER_SUMMARY = "summary"
+
+# Параметры запроса для каждого уровня
+MODEL_TIERS: Dict[str, Dict] = {
+    TIER_QUOTE: {
+        'model': LLM_MODEL_QUOTE,
+        'max_tokens': LLM_MAX_TOKENS_QUOTE,
+        'temperature': LLM_TEMPERATURE_QUOTE,
+    },
+    TIER_FOLLOWUP: {
+        'model': LLM_MODEL_FOLLOWUP,
+        'max_tokens': LLM_MAX_TOKENS_FOLLOWUP,
+        'temperature': LLM_TEMPERATURE_FOLLOWUP,
+    },
+    TIER_ANALYSIS: {
+        'model': LLM_MODEL_ANALYSIS,
+        'max_tokens': LLM_MAX_TOKENS_ANALYSIS,
+        'temperature': LLM_TEMPERATURE_ANALYSIS,
+    },
+    TIER_DEEP: {
+        'model': LLM_MODEL_DEEP,
+        'max_tokens': LLM_MAX_TOKENS_DEEP,
+        'temperature': LLM_TEMPERATURE_ANALYSIS,
+    },
+    TIER_SUMMARY: {
+        'model': LLM_MODEL_SUMMARY,
+        'max_tokens': LLM_MAX_TOKENS_SUMMARY,
+        'temperature': 0.2,
+    },
+}
+
+# Слова, которые означают запрос на анализ, а не просто цену
+ANALYSIS_MARKERS = (
+    'анализ', 'проанализ', 'прогноз', 'сравни', 'стоит ли', 'перспектив', 'рекоменд',
+    'стратег', 'портфел', 'инвестир', 'купить', 'продать', 'покупать', 'продавать',
+    'риск', 'оцени', 'разбор', 'долгосроч', 'дивиденд', 'отчетност',
+)
+
+# Слова, которые означают вопрос о текущей цене (целые слова: "почем", но не "почему")
+QUOTE_MARKERS_RE = re.compile(r"\b(?:курс\w*|цен[аыеу]|стоит|стоимост\w*|котировк\w*|почем|почём|сколько)\b")
+
+_WORD_RE = re.compile(r"\w+")
+
+# Признаки вопроса, которому не хватит LLM_REQUEST_TIMEOUT: сравнение, портфель,
+# длинный горизонт, несколько активов ("5 ETF", "3 акции")
+DEEP_MARKERS_RE = re.compile(
+    r"\b(?:сравни\w*|сопостав\w*|портфел\w*|горизонт\w*)\b"
+    r"|\b\d+\s*(?:etf|акци\w*|актив\w*|бумаг\w*|компани\w*|фонд\w*|инструмент\w*)\b"
+)
+
+QUOTE_MAX_WORDS = 8
+FOLLOWUP_MAX_WORDS = 12
+# Столько признаков (или столько слов) - развернутый анализ
+DEEP_MIN_MARKERS = 2
+DEEP_MIN_WORDS = 60
+
+
+def classify_request(message: str, has_history: bool = False) -> str:
+    """Определить уровень запроса по тексту сообщения."""
+    if not ROUTING_ENABLED:
+        return TIER_ANALYSIS
+
+    text = message.lower()
+    words = _WORD_RE.findall(text)
+
+    if any(marker in text for marker in ANALYSIS_MARKERS):
+        return TIER_ANALYSIS
+
+    if len(words) <= QUOTE_MAX_WORDS and QUOTE_MARKERS_RE.search(text):
+        return TIER_QUOTE
+
+    if has_history and len(words) <= FOLLOWUP_MAX_WORDS:
+        return TIER_FOLLOWUP
+
+    return TIER_ANALYSIS
+
+
+def is_long_analysis(message: str) -> bool:
+    """Вопрос на развернутый анализ, который лучше выполнить в фоне."""
+    if classify_request(message) != TIER_ANALYSIS:
+        return False
+    text = message.lower()
+    if len(DEEP_MARKERS_RE.findall(text)) >= DEEP_MIN_MARKERS:
+        return True
+    return len(_WORD_RE.findall(text)) >= DEEP_MIN_WORDS
+
+
+def get_tier_params(tier: str) -> Dict:
+    """Модель, max_tokens и temperature для уровня."""
+    return MODEL_TIERS.get(tier, MODEL_TIERS[TIER_ANALYSIS])
@@ -0,0 +1,342 @@
+"""
+Общее состояние бота: история чатов, кеш котировок и лимиты запросов.
+
+Бэкенды:
+- memory - всё в памяти процесса (по умолчанию, один экземпляр бота)
+- redis  - общее хранилище для нескольких экземпляров (протокол RESP, без внешних библиотек)
+"""
+import logging
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from config import STATE_BACKEND, REDIS_URL, STATE_KEY_PREFIX, HISTORY_TTL
+
+logger = logging.getLogger(__name__)
+
+COUNTER_PURGE_INTERVAL = 60.0
+
+
+class StateBackendError(Exception):
+    """Ошибка общего хранилища состояния."""
+
+
+class MemoryStateBackend:
+    """Состояние в памяти процесса."""
+
+    # История хранится локально в modules.llm, синхронизация не нужна
+    shared = False
+
+    def __init__(self):
+        self._histories: Dict[int, List[Dict[str, str]]] = {}
+        self._summaries: Dict[int, str] = {}
+        self._quotes: Dict[str, Tuple[float, Dict]] = {}
+        # ключ -> (конец окна, число запросов); прошедшие окна удаляются раз в COUNTER_PURGE_INTERVAL
+        self._counters: Dict[str, Tuple[float, int]] = {}
+        self._next_purge = 0.0
+
+    async def get_history(self, chat_id: int) -> List[Dict[str, str]]:
+        return list(self._histories.get(chat_id, []))
+
+    async def append_history(self, chat_id: int, messages: Sequence[Dict[str, str]], max_messages: int) -> None:
+        history = self._histories.setdefault(chat_id, [])
+        history.extend(messages)
+        del history[:-max_messages]
+
+    async def clear_history(self, chat_id: int) -> None:
+        self._histories.pop(chat_id, None)
+        self._summaries.pop(chat_id, None)
+
+    async def load_chat(self, chat_id: int) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """История и сводка ранних реплик чата."""
+        return await self.get_history(chat_id), self._summaries.get(chat_id)
+
+    async def set_summary(self, chat_id: int, summary: str) -> None:
+        self._summaries[chat_id] = summary
+
+    async def get_quote(self, key: str) -> Optional[Dict]:
+        entry = self._quotes.get(key)
+        if not entry:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._quotes[key]
+            return None
+        return value
+
+    async def set_quote(self, key: str, value: Dict, ttl: float) -> None:
+        self._quotes[key] = (time.monotonic() + ttl, value)
+
+    async def hit_rate_limit(self, key: str, limit: int, window: float) -> bool:
+        """Учесть запрос в окне; True, если лимит превышен."""
+        now = time.monotonic()
+        if now >= self._next_purge:
+            self._counters = {k: entry for k, entry in self._counters.items() if entry[0] > now}
+            self._next_purge = now + COUNTER_PURGE_INTERVAL
+        window_end, count = self._counters.get(key, (0.0, 0))
+        if window_end <= now:
+            window_end, count = now + window, 0
+        count += 1
+        self._counters[key] = (window_end, count)
+        return count > limit
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisStateBackend:
+    """
+    Состояние в Redis (или любом сервере с протоколом RESP).
+
+    Все операции одного сообщения отправляются одним пакетом (pipelining),
+    поэтому хранилище добавляет один сетевой round trip на операцию.
+    """
+
+    shared = True
+
+    def __init__(self, url: str, key_prefix: str = "finbot:", history_ttl: int = 0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.key_prefix = key_prefix
+        self.history_ttl = history_ttl
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        # Одно соединение: запросы и ответы должны идти строго по порядку
+        self._lock = asyncio.Lock()
+
+    # --- Протокол RESP ---
+
+    @staticmethod
+    def _encode(args: Sequence[Any]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            return StateBackendError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise StateBackendError(f"Unexpected reply: {line!r}")
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            try:
+                await self._send(setup)
+            except BaseException:
+                # Без AUTH/SELECT соединение использовать нельзя
+                self._reset_connection()
+                raise
+        logger.info(f"🗄️ Connected to state backend redis://{self.host}:{self.port}/{self.db}")
+
+    async def _send(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        self._writer.write(b"".join(self._encode(cmd) for cmd in commands))
+        await self._writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StateBackendError):
+                raise reply
+        return replies
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Выполнить пачку команд за один round trip."""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None or self._writer.is_closing():
+                        await self._connect()
+                    return await self._send(commands)
+                except (OSError, asyncio.IncompleteReadError) as e:
+                    await self._drop_connection()
+                    if attempt == 1:
+                        raise StateBackendError(f"State backend unavailable: {e}") from e
+                    logger.warning(f"State backend connection lost, reconnecting: {e}")
+                except StateBackendError:
+                    # Ошибка команды: все ответы пачки прочитаны, соединение исправно
+                    raise
+                except BaseException:
+                    # Отмена или таймаут посреди обмена: непрочитанные ответы остались бы
+                    # в сокете и достались следующему запросу, поэтому соединение закрываем
+                    self._reset_connection()
+                    raise
+
+    async def execute(self, *args: Any) -> Any:
+        """Выполнить одну команду."""
+        return (await self.pipeline([args]))[0]
+
+    def _reset_connection(self) -> None:
+        """Закрыть соединение без ожидания (можно вызывать при отмене)."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _drop_connection(self) -> None:
+        writer = self._writer
+        self._reset_connection()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    # --- История чатов ---
+
+    def _history_key(self, chat_id: int) -> str:
+        return f"{self.key_prefix}history:{chat_id}"
+
+    async def get_history(self, chat_id: int) -> List[Dict[str, str]]:
+        items = await self.execute("LRANGE", self._history_key(chat_id), 0, -1)
+        return [json.loads(item) for item in items or []]
+
+    async def append_history(self, chat_id: int, messages: Sequence[Dict[str, str]], max_messages: int) -> None:
+        key = self._history_key(chat_id)
+        commands = [
+            ("RPUSH", key, *[json.dumps(message, ensure_ascii=False) for message in messages]),
+            ("LTRIM", key, -max_messages, -1),
+        ]
+        if self.history_ttl:
+            commands.append(("EXPIRE", key, self.history_ttl))
+        await self.pipeline(commands)
+
+    async def clear_history(self, chat_id: int) -> None:
+        await self.pipeline([("DEL", self._history_key(chat_id)), ("DEL", self._summary_key(chat_id))])
+
+    def _summary_key(self, chat_id: int) -> str:
+        return f"{self.key_prefix}summary:{chat_id}"
+
+    async def load_chat(self, chat_id: int) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """История и сводка ранних реплик за один round trip."""
+        items, summary = await self.pipeline([
+            ("LRANGE", self._history_key(chat_id), 0, -1),
+            ("GET", self._summary_key(chat_id)),
+        ])
+        history = [json.loads(item) for item in items or []]
+        return history, summary.decode() if summary else None
+
+    async def set_summary(self, chat_id: int, summary: str) -> None:
+        command = ["SET", self._summary_key(chat_id), summary]
+        if self.history_ttl:
+            command += ["EX", self.history_ttl]
+        await self.execute(*command)
+
+    # --- Кеш котировок ---
+
+    async def get_quote(self, key: str) -> Optional[Dict]:
+        value = await self.execute("GET", f"{self.key_prefix}quote:{key}")
+        return json.loads(value) if value else None
+
+    async def set_quote(self, key: str, value: Dict, ttl: float) -> None:
+        await self.execute(
+            "SET", f"{self.key_prefix}quote:{key}",
+            json.dumps(value, ensure_ascii=False, default=str),
+            "PX", max(1, int(ttl * 1000))
+        )
+
+    # --- Лимиты запросов ---
+
+    async def hit_rate_limit(self, key: str, limit: int, window: float) -> bool:
+        """Счетчик фиксированного окна: INCR и PEXPIRE одним пакетом."""
+        window_ms = max(1, int(window * 1000))
+        bucket = int(time.time() * 1000) // window_ms
+        counter_key = f"{self.key_prefix}rl:{key}:{bucket}"
+        count, _ = await self.pipeline([("INCR", counter_key), ("PEXPIRE", counter_key, window_ms)])
+        return count > limit
+
+    async def close(self) -> None:
+        await self._drop_connection()
+        logger.info("State backend connection closed")
+
+
+def chat_shard(chat_id: int, shards: int) -> int:
+    """Номер обработчика для чата: все сообщения чата попадают в один и тот же."""
+    return chat_id % shards if shards > 1 else 0
+
+
+class ChatLocks:
+    """Блокировки по чатам: сообщения одного чата обрабатываются строго по очереди."""
+
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = {}
+
+    def __call__(self, chat_id: int) -> "_ChatLockContext":
+        return _ChatLockContext(self, chat_id)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    async def _acquire(self, chat_id: int) -> None:
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._waiters[chat_id] = self._waiters.get(chat_id, 0) + 1
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_waiter(chat_id)
+            raise
+
+    def _release(self, chat_id: int) -> None:
+        self._locks[chat_id].release()
+        self._release_waiter(chat_id)
+
+    def _release_waiter(self, chat_id: int) -> None:
+        # Удаляем блокировку, когда ее никто не ждет, чтобы не копить память
+        self._waiters[chat_id] -= 1
+        if not self._waiters[chat_id]:
+            del self._waiters[chat_id]
+            del self._locks[chat_id]
+
+
+class _ChatLockContext:
+    def __init__(self, locks: ChatLocks, chat_id: int):
+        self._locks = locks
+        self._chat_id = chat_id
+
+    async def __aenter__(self):
+        await self._locks._acquire(self._chat_id)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._locks._release(self._chat_id)
+
+
+def create_state_backend(backend: str = STATE_BACKEND):
+    """Создать бэкенд состояния по конфигурации."""
+    if backend == "redis":
+        logger.info(f"🗄️ Using shared Redis state backend: {REDIS_URL}")
+        return RedisStateBackend(REDIS_URL, key_prefix=STATE_KEY_PREFIX, history_ttl=HISTORY_TTL)
+    if backend != "memory":
+        logger.warning(f"Unknown STATE_BACKEND '{backend}', falling back to memory")
+    return MemoryStateBackend()
+
+
+# Глобальные экземпляры
+state_backend = create_state_backend()
+chat_locks = ChatLocks()
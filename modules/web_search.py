@@ -1,12 +1,346 @@
 import logging
 import asyncio
+import codecs
+import functools
+import json
+import os
+import re
+import time
 import requests
-from typing import List, Dict, Optional
-from urllib.parse import quote_plus
-from config import LLM_REQUEST_TIMEOUT
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Set, Tuple
+from urllib.parse import quote_plus, urlsplit, parse_qs
+from config import (
+    LLM_REQUEST_TIMEOUT, ENRICHMENT_MAX_TOKENS,
+    SEARCH_CACHE_ENABLED, SEARCH_CACHE_SIZE, SEARCH_CACHE_STALE, SEARCH_CACHE_FILE,
+    SEARCH_CACHE_TTL_WEB, SEARCH_CACHE_TTL_NEWS,
+)
+from modules.ranking import rank_results
+from modules.metrics import metrics
+from modules.instruments import instrument_index, Instrument, CURRENCY, CRYPTO, STOCK
+from modules.governor import governor
+
+# Максимум токенов на один сниппет в блоке для LLM
+SNIPPET_MAX_TOKENS = 60
+
+# Размер порции при потоковом чтении страниц
+STREAM_CHUNK_SIZE = 8192
+# Ссылки на финансовые сайты в выдаче DuckDuckGo Lite
+FINANCE_LINK_RE = re.compile(r"investing|marketwatch|yahoo|finance", re.IGNORECASE)
+# Упоминание рубля на странице простого веб-поиска (в нижнем регистре)
+RUB_MARKERS = ('руб', 'rub')
+MIN_TITLE_LENGTH = 10
 
 logger = logging.getLogger(__name__)
 
+# Сколько упомянутых инструментов котировать в одном запросе
+MAX_QUOTED_INSTRUMENTS = 3
+
+def detect_real_data_assets(query: str) -> List[str]:
+    """Ключи инструментов из индекса, упомянутых в запросе (по ним есть реальные котировки)."""
+    return [instrument.key for instrument in instrument_index.find(query)]
+
+class DuckDuckGoLiteParser(HTMLParser):
+    """
+    Потоковый разбор выдачи DuckDuckGo Lite.
+
+    Страница подается порциями через feed(); как только собрано max_results
+    ссылок на финансовые сайты (вместе со сниппетом последней), done = True
+    и дальше страницу можно не читать.
+    """
+
+    def __init__(self, max_results: int = 3, link_filter: re.Pattern = FINANCE_LINK_RE):
+        super().__init__(convert_charrefs=True)
+        self.max_results = max_results
+        self.link_filter = link_filter
+        self.results: List[Dict[str, str]] = []
+        self.done = False
+        self._link_url: Optional[str] = None
+        self._link_text: List[str] = []
+        self._in_snippet = False
+        self._snippet_text: List[str] = []
+        # Сниппет относится только к ссылке, принятой непосредственно перед ним
+        self._awaiting_snippet = False
+        # До <body> только стили и скрипты: этот текст в HTMLParser не передается
+        self._in_body = False
+        self._head_tail = ''
+
+    def feed(self, data: str) -> None:
+        if not self._in_body:
+            data = self._head_tail + data
+            start = data.find('<body')
+            if start < 0:
+                self._head_tail = data[-5:]
+                return
+            self._in_body = True
+            data = data[start:]
+        super().feed(data)
+
+    @staticmethod
+    def resolve_url(href: str) -> str:
+        """Адрес результата: DuckDuckGo заворачивает ссылки в редирект /l/?uddg=..."""
+        if 'uddg=' in href:
+            target = parse_qs(urlsplit(href).query).get('uddg')
+            if target:
+                return target[0]
+        if href.startswith('//'):
+            return 'https:' + href
+        return href
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self.done:
+            return
+        if tag == 'a':
+            href = dict(attrs).get('href') or ''
+            url = self.resolve_url(href)
+            self._awaiting_snippet = False
+            if self.link_filter.search(url):
+                self._finish_result()
+                self._link_url = url
+                self._link_text = []
+        elif tag == 'td' and self._awaiting_snippet and 'result-snippet' in (dict(attrs).get('class') or ''):
+            self._in_snippet = True
+            self._snippet_text = []
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'a' and self._link_url is not None:
+            title = ' '.join(''.join(self._link_text).split())
+            if len(title) > MIN_TITLE_LENGTH and len(self.results) < self.max_results:
+                domain = self._link_url.split('/')[2] if self._link_url.count('/') >= 2 else 'финансового сайта'
+                self.results.append({
+                    'title': title,
+                    'snippet': f"Информация с {domain}",
+                    'url': self._link_url,
+                    'source': 'DuckDuckGo'
+                })
+                self._awaiting_snippet = True
+            self._link_url = None
+        elif tag == 'td' and self._in_snippet:
+            snippet = ' '.join(''.join(self._snippet_text).split())
+            if snippet:
+                self.results[-1]['snippet'] = snippet
+            self._in_snippet = False
+            self._awaiting_snippet = False
+            self._finish_result()
+
+    def handle_data(self, data: str) -> None:
+        if self._link_url is not None:
+            self._link_text.append(data)
+        elif self._in_snippet:
+            self._snippet_text.append(data)
+
+    def _finish_result(self) -> None:
+        """Результат завершен: при достаточном числе результатов разбор останавливается."""
+        if len(self.results) >= self.max_results:
+            self.done = True
+
+
+def stream_text(response, on_text: Callable[[str], bool], chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """
+    Читать тело ответа порциями, декодируя на лету.
+
+    on_text получает очередной кусок текста и возвращает True, когда читать
+    дальше не нужно. Возвращает число прочитанных байт; соединение закрывается.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    received = 0
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            received += len(chunk)
+            if on_text(decoder.decode(chunk)):
+                break
+        else:
+            on_text(decoder.decode(b'', final=True))
+    finally:
+        response.close()
+    return received
+
+
+# Сколько секунд результаты каждого поставщика считаются свежими
+SEARCH_CACHE_TTLS: Dict[str, float] = {
+    'duckduckgo': SEARCH_CACHE_TTL_WEB,
+    'duckduckgo_html': SEARCH_CACHE_TTL_WEB,
+    'simple_web': SEARCH_CACHE_TTL_WEB,
+    'news': SEARCH_CACHE_TTL_NEWS,
+}
+
+_QUERY_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_query(query: str) -> str:
+    """Нормализованный запрос: регистр, ё/е, пунктуация и лишние пробелы не важны, порядок слов сохраняется."""
+    words = _QUERY_WORD_RE.findall(query.lower().replace('ё', 'е'))
+    return ' '.join(words)
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    """Исключение получат ожидающие; если их нет, не оставляем его "неполученным"."""
+    if not task.cancelled():
+        task.exception()
+
+
+class SearchCache:
+    """
+    Кэш результатов поиска по (поставщик, нормализованный запрос).
+
+    - свежая запись отдается сразу
+    - устаревшая (не старше ttl + stale) отдается сразу, а в фоне запрашивается заново
+    - одинаковые одновременные запросы к поставщику объединяются в один
+    - размер ограничен, вытесняются давно не использованные записи (LRU)
+    - необязательный файл на диске, чтобы кэш переживал перезапуск (flush при остановке)
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE, stale: float = SEARCH_CACHE_STALE,
+                 ttls: Optional[Dict[str, float]] = None, path: str = SEARCH_CACHE_FILE):
+        self.max_entries = max_entries
+        self.stale = stale
+        self.ttls = ttls if ttls is not None else SEARCH_CACHE_TTLS
+        self.path = path
+        # ключ -> (время сохранения по часам системы, результаты)
+        self._entries: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._refreshing: Set[asyncio.Task] = set()
+        self._dirty = False
+        if self.path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(provider: str, query: str) -> str:
+        return f"{provider}:{normalize_query(query)}"
+
+    async def get(self, provider: str, query: str, fetch: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        """Результаты из кэша или от поставщика."""
+        key = self.make_key(provider, query)
+        ttl = self.ttls.get(provider, SEARCH_CACHE_TTL_WEB)
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age <= ttl:
+                self._entries.move_to_end(key)
+                metrics.inc("search_cache.hit")
+                return entry[1]
+            if age <= ttl + self.stale:
+                self._entries.move_to_end(key)
+                metrics.inc("search_cache.stale")
+                self._refresh(key, fetch)
+                return entry[1]
+        metrics.inc("search_cache.miss")
+        return await self._fetch(key, fetch)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        """
+        Запрос к поставщику; параллельные вызовы с тем же ключом ждут один результат.
+        Запрос идет в отдельной задаче: отмена одного из ожидающих не прерывает его для остальных.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_and_store(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(_retrieve_exception)
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: str, fetch: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        try:
+            results = await fetch()
+            # Пустой ответ обычно означает ошибку поставщика - его не кэшируем
+            if results:
+                self.put(key, results)
+            return results
+        finally:
+            self._inflight.pop(key, None)
+
+    def _refresh(self, key: str, fetch: Callable[[], Awaitable[List[Dict]]]) -> None:
+        """Фоновое обновление устаревшей записи."""
+        if key in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch(key, fetch)
+            except Exception as e:
+                logger.warning(f"⚠️ Background search refresh failed for {key}: {e}")
+
+        task = asyncio.create_task(refresh())
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    def put(self, key: str, results: List[Dict], stored_at: Optional[float] = None) -> None:
+        """Сохранить результаты, вытеснив самые старые записи сверх лимита."""
+        self._entries[key] = (stored_at if stored_at is not None else time.time(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._dirty = True
+
+    def load(self) -> None:
+        """Загрузить записи с диска, пропуская уже непригодные даже как устаревшие."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Search cache file {self.path} is unreadable: {e}")
+            return
+
+        now = time.time()
+        loaded = 0
+        for key, stored_at, results in data.get('entries', []):
+            provider = key.split(':', 1)[0]
+            if now - stored_at <= self.ttls.get(provider, SEARCH_CACHE_TTL_WEB) + self.stale:
+                self.put(key, results, stored_at)
+                loaded += 1
+        self._dirty = False
+        logger.info(f"💾 Search cache loaded: {loaded} entries from {self.path}")
+
+    def flush(self) -> None:
+        """Записать кэш на диск (атомарно, через временный файл)."""
+        if not self.path or not self._dirty:
+            return
+        data = {'entries': [[key, stored_at, results] for key, (stored_at, results) in self._entries.items()]}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            logger.info(f"💾 Search cache saved: {len(self._entries)} entries to {self.path}")
+        except OSError as e:
+            logger.error(f"Failed to save search cache to {self.path}: {e}")
+
+
+search_cache = SearchCache()
+
+
+async def _no_results() -> List[Dict[str, str]]:
+    return []
+
+
+def cached_search(provider: str):
+    """Декоратор метода поиска (self, query, ...): результаты берутся из search_cache."""
+    def decorator(method):
+        @functools.wraps(method)
+        async def wrapper(self, query: str, *args, **kwargs):
+            if not SEARCH_CACHE_ENABLED:
+                return await method(self, query, *args, **kwargs)
+            # Параметры вызова (max_results) входят в ключ вместе с запросом
+            suffix = ' '.join(str(value) for value in (*args, *kwargs.values()))
+            return await search_cache.get(
+                provider, f"{query} {suffix}" if suffix else query,
+                lambda: method(self, query, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
+
+
 class WebSearchClient:
     """Клиент для поиска актуальной информации в интернете."""
     
@@ -18,6 +352,7 @@ class WebSearchClient:
         })
         logger.info("Web search client initialized")
     
+    @cached_search('duckduckgo_html')
     async def search_duckduckgo_html(self, query: str, max_results: int = 3) -> List[Dict[str, str]]:
         """
         Поиск через DuckDuckGo HTML (более надежный для финансовых данных).
@@ -29,42 +364,23 @@ class WebSearchClient:
             
             logger.debug(f"Searching DuckDuckGo HTML for: {query}")
             
-            response = await asyncio.to_thread(
-                self.session.get, url, timeout=LLM_REQUEST_TIMEOUT
+            status, results, received = await asyncio.to_thread(
+                self._fetch_lite_results, url, max_results
             )
             
-            if response.status_code == 200:
-                # Простой парсинг HTML для получения ссылок и заголовков
-                content = response.text
-                results = []
-                
-                # Ищем паттерны ссылок и заголовков (упрощенно)
-                import re
-                
-                # Поиск ссылок на финансовые сайты
-                pattern = r'<a[^>]*href="([^"]*(?:investing|marketwatch|yahoo|finance)[^"]*)"[^>]*>([^<]+)</a>'
-                matches = re.findall(pattern, content, re.IGNORECASE)
-                
-                for url_match, title in matches[:max_results]:
-                    if len(title.strip()) > 10:  # Фильтруем слишком короткие заголовки
-                        results.append({
-                            'title': title.strip(),
-                            'snippet': f"Информация с {url_match.split('/')[2] if '/' in url_match else 'финансового сайта'}",
-                            'url': url_match,
-                            'source': 'DuckDuckGo'
-                        })
-                
-                logger.info(f"Found {len(results)} HTML results for query: {query}")
+            if status == 200:
+                logger.info(f"Found {len(results)} HTML results for query: {query} ({received} bytes read)")
                 return results
                 
             else:
-                logger.warning(f"DuckDuckGo HTML search failed with status: {response.status_code}")
+                logger.warning(f"DuckDuckGo HTML search failed with status: {status}")
                 return []
                 
         except Exception as e:
             logger.error(f"Error in DuckDuckGo HTML search: {e}")
             return []
 
+    @cached_search('duckduckgo')
     async def search_duckduckgo(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
         """
         Поиск через DuckDuckGo Instant Answer API.
@@ -123,6 +439,7 @@ class WebSearchClient:
             logger.error(f"Error in DuckDuckGo search: {e}")
             return []
     
+    @cached_search('news')
     async def search_financial_news(self, query: str) -> List[Dict[str, str]]:
         """
         Поиск финансовых новостей.
@@ -134,26 +451,27 @@ class WebSearchClient:
         logger.debug(f"Searching financial news for: {financial_query}")
         return await self.search_duckduckgo(financial_query, max_results=3)
     
+    @cached_search('simple_web')
     async def search_simple_web(self, query: str) -> List[Dict[str, str]]:
         """
         Простой веб-поиск через поисковые системы.
         """
+        # Единственный результат этого поиска - про доллар, остальное запрашивать незачем
+        if 'доллар' not in query.lower():
+            return []
+        
         try:
             # Пробуем Google через простой HTTP запрос
             search_url = f"https://www.google.com/search?q={quote_plus(query + ' site:investing.com OR site:marketwatch.com')}"
             
             logger.info(f"🌐 Trying simple web search for: {query}")
             
-            response = await asyncio.to_thread(
-                self.session.get, search_url, timeout=10
-            )
+            status, found = await asyncio.to_thread(self._page_mentions_rub, search_url)
             
-            if response.status_code == 200:
-                # Простейший парсинг - ищем упоминания цифр и валют
-                content = response.text.lower()
+            if status == 200:
                 results = []
                 
-                if 'доллар' in query.lower() and ('руб' in content or 'rub' in content):
+                if found:
                     results.append({
                         'title': 'Поиск курса доллара',
                         'snippet': 'Найдена информация о курсе USD/RUB на финансовых сайтах',
@@ -169,107 +487,69 @@ class WebSearchClient:
         
         return []
 
-    async def get_real_financial_data(self, query: str) -> List[Dict[str, str]]:
+    def _fetch_lite_results(self, url: str, max_results: int) -> Tuple[int, List[Dict[str, str]], int]:
+        """Скачать выдачу DuckDuckGo Lite потоком, разбирая ее по мере получения (в потоке)."""
+        response = self.session.get(url, timeout=LLM_REQUEST_TIMEOUT, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return response.status_code, [], 0
+        
+        parser = DuckDuckGoLiteParser(max_results)
+        
+        def feed(text: str) -> bool:
+            parser.feed(text)
+            return parser.done
+        
+        received = stream_text(response, feed)
+        parser.close()
+        return response.status_code, parser.results, received
+
+    def _page_mentions_rub(self, url: str) -> Tuple[int, bool]:
+        """Есть ли на странице упоминание рубля; чтение прекращается на первом совпадении (в потоке)."""
+        response = self.session.get(url, timeout=10, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return response.status_code, False
+        
+        tail = ''
+        found = False
+        
+        def check(text: str) -> bool:
+            # Хвост предыдущей порции сохраняется, чтобы не пропустить слово на границе
+            nonlocal tail, found
+            window = (tail + text).lower()
+            found = any(marker in window for marker in RUB_MARKERS)
+            tail = window[-8:]
+            return found
+        
+        stream_text(response, check)
+        return response.status_code, found
+
+    async def get_real_financial_data(self, query: str,
+                                      max_instruments: int = MAX_QUOTED_INSTRUMENTS) -> List[Dict[str, str]]:
         """
-        Получить реальные финансовые данные через API.
+        Получить реальные финансовые данные через API по всем инструментам
+        из индекса, упомянутым в запросе (параллельно).
         """
         logger.info(f"💰 Getting REAL financial data for: {query}")
         
         try:
             from modules.finance_data import finance_client
             
-            query_lower = query.lower()
+            instruments = instrument_index.find(query)[:max_instruments]
+            if not instruments:
+                return []
+            logger.info(f"🔍 Detected instruments: {', '.join(i.key for i in instruments)}")
+            quotes = await asyncio.gather(
+                *(finance_client.get_instrument_quote(instrument.key) for instrument in instruments),
+                return_exceptions=True
+            )
             results = []
-            
-            # Обработка валютных запросов
-            if any(word in query_lower for word in ['доллар', 'usd', 'курс доллара']):
-                logger.info("🔍 Detected USD rate query")
-                usd_data = await finance_client.get_currency_rate("USD", "RUB")
-                if usd_data:
-                    snippet = f"Курс доллара: {usd_data['price']} руб. "
-                    if usd_data['change'] > 0:
-                        snippet += f"↗️ +{usd_data['change']} (+{usd_data['change_percent']}%)"
-                    else:
-                        snippet += f"↘️ {usd_data['change']} ({usd_data['change_percent']}%)"
-                    
-                    results.append({
-                        'title': f"Курс {usd_data['symbol']} - РЕАЛЬНЫЕ ДАННЫЕ",
-                        'snippet': snippet,
-                        'url': 'https://cbr.ru',
-                        'source': usd_data.get('source', 'ЦБ РФ')
-                    })
-            
-            # Обработка запросов по евро
-            elif any(word in query_lower for word in ['евро', 'eur', 'курс евро']):
-                logger.info("🔍 Detected EUR rate query")
-                eur_data = await finance_client.get_currency_rate("EUR", "RUB")
-                if eur_data:
-                    snippet = f"Курс евро: {eur_data['price']} руб. "
-                    if eur_data['change'] > 0:
-                        snippet += f"↗️ +{eur_data['change']} (+{eur_data['change_percent']}%)"
-                    else:
-                        snippet += f"↘️ {eur_data['change']} ({eur_data['change_percent']}%)"
-                    
-                    results.append({
-                        'title': f"Курс {eur_data['symbol']} - РЕАЛЬНЫЕ ДАННЫЕ",
-                        'snippet': snippet,
-                        'url': 'https://cbr.ru',
-                        'source': eur_data.get('source', 'ЦБ РФ')
-                    })
-            
-            # Обработка запросов по акциям
-            elif any(word in query_lower for word in ['сбербанк', 'sber']):
-                logger.info("🔍 Detected SBER stock query")
-                sber_data = await finance_client.get_stock_quote("SBER.ME")
-                if sber_data:
-                    snippet = f"Акции {sber_data['name']}: {sber_data['price']} {sber_data['currency']}. "
-                    if sber_data['change'] > 0:
-                        snippet += f"↗️ +{sber_data['change']} (+{sber_data['change_percent']}%)"
-                    else:
-                        snippet += f"↘️ {sber_data['change']} ({sber_data['change_percent']}%)"
-                    
-                    results.append({
-                        'title': f"{sber_data['symbol']} - РЕАЛЬНЫЕ КОТИРОВКИ",
-                        'snippet': snippet,
-                        'url': 'https://finance.yahoo.com',
-                        'source': 'Yahoo Finance'
-                    })
-            
-            # Обработка запросов по золоту
-            elif any(word in query_lower for word in ['золото', 'gold']):
-                logger.info("🔍 Detected GOLD price query")
-                gold_data = await finance_client.get_stock_quote("GC=F")  # Gold futures
-                if gold_data:
-                    snippet = f"Цена золота: ${gold_data['price']} за унцию. "
-                    if gold_data['change'] > 0:
-                        snippet += f"↗️ +${gold_data['change']} (+{gold_data['change_percent']}%)"
-                    else:
-                        snippet += f"↘️ ${gold_data['change']} ({gold_data['change_percent']}%)"
-                    
-                    results.append({
-                        'title': "Цена золота - РЕАЛЬНЫЕ ДАННЫЕ",
-                        'snippet': snippet,
-                        'url': 'https://finance.yahoo.com',
-                        'source': 'Yahoo Finance'
-                    })
-            
-            # Обработка криптовалют
-            elif any(word in query_lower for word in ['биткойн', 'bitcoin', 'btc']):
-                logger.info("🔍 Detected BTC price query")
-                btc_data = await finance_client.get_crypto_price("BTC")
-                if btc_data:
-                    snippet = f"Bitcoin: ${btc_data['price']}. "
-                    if btc_data['change'] > 0:
-                        snippet += f"↗️ +${btc_data['change']} (+{btc_data['change_percent']}%)"
-                    else:
-                        snippet += f"↘️ ${btc_data['change']} ({btc_data['change_percent']}%)"
-                    
-                    results.append({
-                        'title': "Bitcoin - РЕАЛЬНАЯ ЦЕНА",
-                        'snippet': snippet,
-                        'url': 'https://finance.yahoo.com',
-                        'source': 'Yahoo Finance'
-                    })
+            for instrument, quote in zip(instruments, quotes):
+                if isinstance(quote, Exception):
+                    logger.warning(f"Quote for {instrument.key} failed: {quote}")
+                elif quote:
+                    results.append(self._quote_result(instrument, quote))
             
             logger.info(f"💰 Real finance data: found {len(results)} results")
             return results
@@ -278,6 +558,39 @@ class WebSearchClient:
             logger.error(f"Error getting real financial data: {e}")
             return []
 
+    @staticmethod
+    def _quote_result(instrument: Instrument, quote: Dict) -> Dict[str, str]:
+        """Результат поиска с котировкой инструмента."""
+        if quote['change'] > 0:
+            change = f"↗️ +{quote['change']} (+{quote['change_percent']}%)"
+        else:
+            change = f"↘️ {quote['change']} ({quote['change_percent']}%)"
+        source = quote.get('source', 'Yahoo Finance')
+        
+        if instrument.kind == CURRENCY:
+            title = f"Курс {quote['symbol']} - РЕАЛЬНЫЕ ДАННЫЕ"
+            snippet = f"Курс {instrument.name}: {quote['price']} руб. {change}"
+            url = 'https://cbr.ru' if source == 'ЦБ РФ' else 'https://finance.yahoo.com'
+        elif instrument.kind == CRYPTO:
+            name = quote.get('name') or instrument.name
+            title = f"{name} - РЕАЛЬНАЯ ЦЕНА"
+            snippet = f"{name}: ${quote['price']}. {change}"
+            url = 'https://www.coingecko.com' if source == 'CoinGecko' else 'https://finance.yahoo.com'
+        else:
+            currency = quote.get('currency', '')
+            prefix = "Акции " if instrument.kind == STOCK else ""
+            title = f"{quote['symbol']} - РЕАЛЬНЫЕ КОТИРОВКИ"
+            snippet = f"{prefix}{instrument.name}: {quote['price']} {currency}. {change}"
+            url = 'https://finance.yahoo.com'
+        
+        return {
+            'title': title,
+            'snippet': snippet,
+            'url': url,
+            'source': source,
+            'quote': quote
+        }
+
     async def get_mock_financial_data(self, query: str) -> List[Dict[str, str]]:
         """
         Заглушка с актуальной финансовой информацией когда API недоступны.
@@ -321,38 +634,44 @@ class WebSearchClient:
                 }
             ]
         
-        return mock_results
+        return [dict(result, mock=True) for result in mock_results]
 
-    async def search_asset_info(self, asset_name: str) -> Dict[str, any]:
+    async def search_asset_info(self, asset_name: str,
+                                real_results: Optional[Awaitable[List[Dict[str, str]]]] = None) -> Dict[str, any]:
         """
         Поиск информации об активе (акции, валюте, товаре).
+        real_results - уже запущенный запрос котировок (см. Enrichment), чтобы не запрашивать их дважды.
         """
         try:
             # Пробуем несколько стратегий поиска
             all_results = []
             
-            # 1. Поиск через API
+            # 1. Поиск через API, 3. новости и 4. реальные финансовые данные - параллельно
             api_query = f"{asset_name} котировки цена"
-            api_results = await self.search_duckduckgo(api_query, max_results=2)
+            news_query = f"{asset_name} новости финансы сегодня"
+            logger.info(f"💰 ALWAYS trying real finance APIs for: {asset_name}")
+            if real_results is None:
+                real_results = self.get_real_financial_data(asset_name)
+            # При перегрузке новости и разбор HTML пропускаются (см. modules.governor)
+            skip_scraping = governor.skip_scraping
+            api_results, news_results, real_results = await asyncio.gather(
+                self.search_duckduckgo(api_query, max_results=2),
+                self.search_financial_news(news_query) if not skip_scraping else _no_results(),
+                # shield: отмена поиска не должна отменять общий запрос котировок
+                asyncio.shield(real_results),
+            )
             all_results.extend(api_results)
             
             # 2. Поиск через HTML (если API не дал результатов)
-            if len(api_results) < 2:
+            if len(api_results) < 2 and not skip_scraping:
                 html_query = f"{asset_name} курс цена котировки"
                 html_results = await self.search_duckduckgo_html(html_query, max_results=3)
                 all_results.extend(html_results)
             
-            # 3. Поиск новостей
-            news_query = f"{asset_name} новости финансы сегодня"
-            news_results = await self.search_financial_news(news_query)
-            
-            # 4. ВСЕГДА пробуем получить реальные финансовые данные
-            logger.info(f"💰 ALWAYS trying real finance APIs for: {asset_name}")
-            real_results = await self.get_real_financial_data(asset_name)
             all_results.extend(real_results)
             
             # 5. Если реальных данных нет, пробуем простой веб-поиск
-            if not real_results:
+            if not real_results and not skip_scraping:
                 logger.warning(f"⚠️ No real finance data, trying simple web search for: {asset_name}")
                 simple_results = await self.search_simple_web(asset_name)
                 all_results.extend(simple_results)
@@ -364,12 +683,16 @@ class WebSearchClient:
                 all_results.extend(mock_results)
                 logger.info(f"📝 Mock data added: {len(mock_results)} results")
             
+            # Дубликаты убираются, в ответ попадают лучшие по надежности и свежести
+            general_info = rank_results(all_results)
+            recent_news = rank_results(news_results, top_k=3)
+            
             return {
                 'asset_name': asset_name,
-                'general_info': all_results[:5],  # Ограничиваем результаты
-                'recent_news': news_results[:3],
+                'general_info': general_info,
+                'recent_news': recent_news,
                 'search_timestamp': asyncio.get_event_loop().time(),
-                'total_results': len(all_results) + len(news_results)
+                'total_results': len(general_info) + len(recent_news)
             }
             
         except Exception as e:
@@ -402,6 +725,10 @@ class WebSearchClient:
                 logger.debug(f"Detected financial query with keyword: {keyword}")
                 return user_message  # Возвращаем весь запрос для поиска
         
+        # Упоминание любого инструмента из индекса ("что с Лукойлом?")
+        if instrument_index.find(user_message):
+            return user_message
+        
         return None
     
     async def close(self):
@@ -413,47 +740,184 @@ class WebSearchClient:
 # Глобальный экземпляр клиента
 web_search_client = WebSearchClient()
 
+
+class Enrichment:
+    """
+    Данные для ответа, запрашиваемые заранее - сразу при получении сообщения,
+    параллельно с индикатором "печатает..." и загрузкой истории чата.
+
+    quotes - котировки get_real_financial_data, search - полный search_asset_info
+    (использует тот же запрос котировок). Поиск можно запустить позже через start_search.
+    """
+
+    def __init__(self, user_message: str, client: Optional[WebSearchClient] = None):
+        self.client = client or web_search_client
+        self.user_message = user_message
+        self.query = self.client.detect_financial_query(user_message)
+        self.quotes: Optional[asyncio.Task] = None
+        self.search: Optional[asyncio.Task] = None
+        if detect_real_data_assets(user_message):
+            self.quotes = asyncio.create_task(self.client.get_real_financial_data(user_message))
+
+    def start_search(self) -> None:
+        """Запустить полный поиск (если запрос финансовый и поиск еще не идет)."""
+        if self.search is None and self.query:
+            self.search = asyncio.create_task(
+                self.client.search_asset_info(self.query, real_results=self.quotes)
+            )
+
+    async def get_quotes(self) -> List[Dict[str, str]]:
+        """Результаты с котировками (пустой список, если активов с котировками нет)."""
+        if self.quotes is None:
+            return []
+        try:
+            return await asyncio.shield(self.quotes)
+        except Exception as e:
+            logger.error(f"❌ QUOTES ERROR: {e}")
+            return []
+
+    async def get_search(self) -> Optional[Dict[str, any]]:
+        """Результаты полного поиска или None, если поиск не нужен."""
+        self.start_search()
+        if self.search is None:
+            return None
+        return await asyncio.shield(self.search)
+
+    def quotes_only(self, quote_results: List[Dict[str, str]]) -> Dict[str, any]:
+        """Результаты в формате search_asset_info только с котировками."""
+        return {
+            'asset_name': self.query or self.user_message,
+            'general_info': quote_results,
+            'recent_news': [],
+            'total_results': len(quote_results)
+        }
+
+    def cancel(self, keep_search: bool = False) -> None:
+        """
+        Отменить незавершенные запросы, если ответ уже не зависит от них.
+        keep_search - дать поиску завершиться в фоне (результаты попадут в кэш).
+        """
+        if self.search is not None and not keep_search:
+            self.search.cancel()
+        if self.quotes is not None and (self.search is None or not keep_search):
+            self.quotes.cancel()
+
 async def search_for_query(query: str) -> Optional[Dict[str, any]]:
     """
     Удобная функция для поиска информации по запросу.
     """
     return await web_search_client.search_asset_info(query)
 
-def format_search_results(search_data: Dict[str, any]) -> str:
+def estimate_tokens(text: str) -> int:
     """
-    Форматирование результатов поиска для передачи в LLM.
+    Грубая оценка числа токенов без токенизатора:
+    кириллица ~2.5 символа на токен, латиница и цифры ~4.
+    Кириллица занимает 2 байта в UTF-8, поэтому ее доля считается по длине в байтах.
+    """
+    cyrillic = len(text.encode('utf-8')) - len(text)
+    return int(cyrillic / 2.5 + (len(text) - cyrillic) / 4) + 1
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """Обрезать текст по границе слова до max_tokens."""
+    text = ' '.join(text.split())
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Средняя длина токена в этом тексте -> допустимое число символов
+    max_chars = int(len(text) * max_tokens / tokens)
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + '…'
+
+def _domain(url: str) -> str:
+    """Домен ссылки без www."""
+    host = urlsplit(url).netloc.lower() if url else ''
+    return host[4:] if host.startswith('www.') else host
+
+def _format_change(value) -> str:
+    return f"+{value}" if isinstance(value, (int, float)) and value > 0 else str(value)
+
+def format_search_results(search_data: Dict[str, any], max_tokens: int = ENRICHMENT_MAX_TOKENS) -> str:
+    """
+    Компактное представление результатов поиска для LLM.
+
+    Котировки - маленькой таблицей, сведения и новости - по одной строке,
+    источники - один раз в конце. Блоки добавляются по приоритету, пока
+    не исчерпан лимит токенов; строка собирается одним join.
     """
     if not search_data or 'error' in search_data:
         return ""
     
-    total_results = search_data.get('total_results', 0)
-    if total_results == 0:
+    if not search_data.get('total_results', 0):
         return ""
     
-    formatted = f"\n=== АКТУАЛЬНАЯ ИНФОРМАЦИЯ ИЗ ИНТЕРНЕТА ПО '{search_data['asset_name']}' ===\n"
-    formatted += f"Найдено {total_results} источников информации:\n\n"
+    general = search_data.get('general_info') or []
+    news = search_data.get('recent_news') or []
+    
+    quote_rows: List[str] = []
+    info_lines: List[str] = []
+    news_lines: List[str] = []
+    sources: List[str] = []
+    seen_text = set()
     
-    # Общая информация
-    if search_data.get('general_info'):
-        formatted += "📊 ДАННЫЕ О КОТИРОВКАХ И ЦЕНАХ:\n"
-        for i, result in enumerate(search_data['general_info'], 1):
-            snippet = result['snippet'][:300] if result['snippet'] else result['title']
-            formatted += f"{i}. {snippet}\n"
-            if result.get('url') and 'investing.com' in result['url'] or 'yahoo.com' in result['url']:
-                formatted += f"   📈 Источник: {result['url']}\n"
-        formatted += "\n"
+    def add_source(result: Dict) -> None:
+        domain = _domain(result.get('url', '')) or result.get('source', '')
+        if domain and domain not in sources:
+            sources.append(domain)
     
-    # Новости
-    if search_data.get('recent_news'):
-        formatted += "📰 АКТУАЛЬНЫЕ НОВОСТИ И АНАЛИТИКА:\n"
-        for i, result in enumerate(search_data['recent_news'], 1):
-            snippet = result['snippet'][:300] if result['snippet'] else result['title']
-            formatted += f"{i}. {snippet}\n"
-            if result.get('url'):
-                formatted += f"   🔗 Источник: {result['url']}\n"
-        formatted += "\n"
+    for result in general:
+        quote = result.get('quote')
+        if quote:
+            quote_rows.append(
+                f"{quote['symbol']}|{quote['price']} {quote.get('currency', '')}"
+                f"{' (цена закрытия)' if quote.get('market_closed') else ''}|"
+                f"{_format_change(quote.get('change'))}|{_format_change(quote.get('change_percent'))}%|"
+                f"{quote.get('source', result.get('source', ''))}|{str(quote.get('timestamp', ''))[:16]}"
+            )
+            add_source(result)
+            continue
+        text = _truncate_tokens(result.get('snippet') or result.get('title', ''), SNIPPET_MAX_TOKENS)
+        if text and text.lower() not in seen_text:
+            seen_text.add(text.lower())
+            info_lines.append(f"- {text}")
+            add_source(result)
+    
+    for result in news:
+        text = _truncate_tokens(result.get('title') or result.get('snippet', ''), SNIPPET_MAX_TOKENS)
+        if text and text.lower() not in seen_text:
+            seen_text.add(text.lower())
+            news_lines.append(f"- {text}")
+            add_source(result)
     
-    formatted += "⚠️ ВАЖНО: Используй эту информацию как дополнение к анализу, проверяй актуальность данных.\n"
-    formatted += "=== КОНЕЦ ПОИСКОВЫХ ДАННЫХ ===\n"
+    # Блоки в порядке приоритета: котировки важнее сведений, сведения важнее новостей
+    sections = [
+        ("Котировки (инструмент|цена|изм.|изм.%|источник|время):", quote_rows),
+        ("Сведения:", info_lines),
+        ("Новости:", news_lines),
+    ]
+    lines: List[str] = [f"Запрос: {search_data['asset_name']}"]
+    budget = max_tokens - estimate_tokens(lines[0])
+    for header, items in sections:
+        if not items:
+            continue
+        header_cost = estimate_tokens(header)
+        if header_cost >= budget:
+            break
+        section = [header]
+        budget -= header_cost
+        for item in items:
+            cost = estimate_tokens(item)
+            if cost > budget:
+                break
+            section.append(item)
+            budget -= cost
+        if len(section) > 1:
+            lines.extend(section)
     
-    return formatted
+    if sources:
+        source_line = "Источники: " + ", ".join(sources)
+        if estimate_tokens(source_line) <= budget:
+            lines.append(source_line)
+    
+    if len(lines) == 1:
+        return ""
+    return "\n".join(lines)
@@ -0,0 +1,300 @@
+"""
+Многопроцессный режим: фронт-процесс получает обновления Telegram
+и раздает их N рабочим процессам по хешу chat_id.
+
+Каждый рабочий процесс - полноценный бот без Updater со своим event loop,
+поэтому обработка сообщений масштабируется по ядрам, а все сообщения
+одного чата попадают в один процесс и обрабатываются по порядку.
+
+- потоковые котировки и цены CoinGecko получает только фронт-процесс и рассылает
+  рабочим процессам: число соединений и запросов к источникам не растет с числом процессов
+- файлы оповещений и заданий хранятся по файлу на процесс (path.N); при старте фронт
+  перераскладывает записи по chat_shard, поэтому смена WORKER_PROCESSES ничего не теряет
+"""
+import logging
+import sys
+import asyncio
+import glob
+import json
+import os
+import re
+import signal
+import time
+import multiprocessing
+from typing import Dict, List, Optional
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from config import SHUTDOWN_TIMEOUT, PRICE_FEED_ENABLED, COINGECKO_ENABLED, DIAG_PORT
+from modules.lifecycle import shutdown_manager
+from modules.metrics import metrics
+from modules.state import chat_shard
+
+logger = logging.getLogger(__name__)
+
+# spawn одинаково ведет себя на Linux и Windows и не копирует состояние event loop
+_mp_context = multiprocessing.get_context("spawn")
+
+# Сообщение очереди рабочего процесса с ценами: (PRICES_MESSAGE, котировки фида, таблица CoinGecko)
+PRICES_MESSAGE = "prices"
+# Как часто фронт рассылает рабочим процессам обновившиеся цены (сек)
+PRICE_BROADCAST_INTERVAL = 1.0
+
+
+def shard_path(path: str, index: int, shards: int) -> str:
+    """Файл процесса index из shards; в однопроцессном режиме - сам path."""
+    return path if shards <= 1 else f"{path}.{index}"
+
+
+def reshard_file(path: str, shards: int) -> None:
+    """
+    Разложить записи файла (JSON-список объектов с chat_id) и его копий path.N
+    по chat_shard для shards процессов. Вызывается до запуска рабочих процессов:
+    после смены WORKER_PROCESSES записи попадают в процесс, который теперь
+    обслуживает их чат. Совпадающие номера оповещений из разных файлов перенумеровываются.
+    """
+    if not path:
+        return
+    pattern = re.compile(re.escape(os.path.basename(path)) + r'(\.\d+)?$')
+    sources = sorted(
+        name for name in glob.glob(f"{glob.escape(path)}*")
+        if pattern.fullmatch(os.path.basename(name))
+    )
+    targets = [shard_path(path, index, shards) for index in range(shards)]
+    if set(sources) <= set(targets) and _already_sharded(sources, shards):
+        return
+
+    entries: List[Dict] = []
+    for name in sources:
+        try:
+            with open(name, 'r', encoding='utf-8') as f:
+                entries.extend(item for item in json.load(f) if item not in entries)
+        except (OSError, ValueError) as e:
+            # Нечитаемый файл не трогаем, чтобы не потерять его записи
+            logger.warning(f"⚠️ Cannot reshard {name}: {e}")
+            return
+
+    grouped: List[List[Dict]] = [[] for _ in range(shards)]
+    ids = set()
+    next_id = max((item['id'] for item in entries if isinstance(item.get('id'), int)), default=0) + 1
+    for item in entries:
+        if isinstance(item.get('id'), int):
+            if item['id'] in ids:
+                item = dict(item, id=next_id)
+                next_id += 1
+            ids.add(item['id'])
+        grouped[chat_shard(item['chat_id'], shards)].append(item)
+
+    try:
+        for target, items in zip(targets, grouped):
+            tmp_path = f"{target}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(tmp_path, target)
+        # Старые файлы удаляются последними: после сбоя записи совпадут и схлопнутся при следующем старте
+        for name in sources:
+            if name not in targets:
+                os.remove(name)
+    except OSError as e:
+        logger.error(f"Failed to reshard {path}: {e}")
+        return
+    logger.info(f"🗂️ {path}: {len(entries)} records from {len(sources)} files resharded for {shards} processes")
+
+
+def _already_sharded(sources: List[str], shards: int) -> bool:
+    """Все записи уже лежат в файлах своих процессов."""
+    for name in sources:
+        index = int(name.rsplit('.', 1)[1]) if shards > 1 else 0
+        try:
+            with open(name, 'r', encoding='utf-8') as f:
+                if any(chat_shard(item['chat_id'], shards) != index for item in json.load(f)):
+                    return False
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+    return True
+
+
+def worker_main(index: int, token: str, queue, shards: int) -> None:
+    """Точка входа рабочего процесса."""
+    logging.basicConfig(
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        stream=sys.stdout
+    )
+    # Остановкой управляет фронт-процесс через очередь, сигналы игнорируем
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, token, queue, shards))
+
+
+async def _run_worker(index: int, token: str, queue, shards: int) -> None:
+    """Получать обновления из очереди и обрабатывать их обычными хендлерами бота."""
+    from modules.bot import setup_bot, start_analysis_queue, start_alert_engine
+    from modules.jobs import analysis_queue
+    from modules.alerts import alert_engine
+    from modules.state import state_backend
+    from modules.coingecko import crypto_prices
+    from modules.price_feed import quote_table
+    from modules.diagnostics import diag_server
+    from modules.governor import governor
+    try:
+        from modules.web_search import web_search_client
+        shutdown_manager.register("web_search_session", web_search_client.close, phase="close")
+    except ImportError:
+        pass
+    shutdown_manager.register("metrics", metrics.log_summary)
+    shutdown_manager.register("state_backend", state_backend.close, phase="close")
+    shutdown_manager.register("crypto_prices", crypto_prices.close, phase="close")
+    shutdown_manager.register("analysis_queue", analysis_queue.stop)
+    shutdown_manager.register("alerts", alert_engine.stop)
+    shutdown_manager.register("diag_server", diag_server.stop, phase="close")
+    shutdown_manager.register("governor", governor.stop, phase="close")
+    # Чат всегда попадает в один и тот же процесс, поэтому у каждого процесса свой файл
+    # (записи уже разложены по chat_shard фронтом, см. reshard_file)
+    if analysis_queue.path:
+        analysis_queue.path = shard_path(analysis_queue.path, index, shards)
+    if alert_engine.path:
+        alert_engine.path = shard_path(alert_engine.path, index, shards)
+    # Цены присылает фронт-процесс; лимиты регулятора нагрузки делятся между процессами
+    crypto_prices.remote = True
+    governor.share(shards)
+    # Фронт-процесс слушает DIAG_PORT, рабочие процессы - следующие порты
+    if DIAG_PORT:
+        diag_server.port = DIAG_PORT + 1 + index
+
+    application = setup_bot(token, with_updater=False)
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        await application.start()
+        await start_analysis_queue(application)
+        await start_alert_engine(application)
+        governor.start()
+        await diag_server.start()
+        logger.info(f"👷 Worker {index} started")
+
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            if isinstance(data, tuple) and data[0] == PRICES_MESSAGE:
+                _, quotes, crypto = data
+                quote_table.load(quotes)
+                if crypto is not None:
+                    crypto_prices.load(*crypto)
+                continue
+            update = Update.de_json(data, application.bot)
+            await application.update_queue.put(update)
+
+        logger.info(f"Worker {index} received stop signal")
+        shutdown_manager.accepting = False
+        await shutdown_manager.drain(SHUTDOWN_TIMEOUT)
+        await application.stop()
+        await shutdown_manager.run_callbacks()
+
+    logger.info(f"Worker {index} stopped")
+
+
+def start_process(target, args: tuple, name: str) -> multiprocessing.Process:
+    """
+    Запустить рабочий процесс.
+    Не daemon: daemon-процессам нельзя создавать дочерние, а рабочий процесс
+    создает пул процессов finance_data (FINANCE_PROCESS_WORKERS). Поэтому
+    процессы обязательно останавливаются в WorkerPool.stop / terminate.
+    """
+    process = _mp_context.Process(target=target, args=args, name=name, daemon=False)
+    process.start()
+    return process
+
+
+class WorkerPool:
+    """Пул рабочих процессов с маршрутизацией обновлений по чату."""
+
+    def __init__(self, token: str, size: int):
+        self.token = token
+        self.size = size
+        self.queues = [_mp_context.Queue() for _ in range(size)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * size
+        self._broadcast: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> None:
+        process = start_process(
+            worker_main, (index, self.token, self.queues[index], self.size), f"bot-worker-{index}"
+        )
+        self.processes[index] = process
+        logger.info(f"👷 Spawned worker {index} (pid {process.pid})")
+
+    def start(self) -> None:
+        for index in range(self.size):
+            self._spawn(index)
+
+    def start_feeds(self) -> None:
+        """Запустить источники цен во фронт-процессе и рассылку цен рабочим процессам (в event loop)."""
+        from modules.coingecko import crypto_prices
+        from modules.price_feed import price_feed
+        if PRICE_FEED_ENABLED:
+            price_feed.start()
+        if COINGECKO_ENABLED:
+            crypto_prices.start()
+        self._broadcast = asyncio.create_task(self._broadcast_prices())
+
+    async def _broadcast_prices(self) -> None:
+        from modules.coingecko import crypto_prices
+        from modules.price_feed import quote_table
+        sent_until = 0.0
+        crypto_sent = 0.0
+        while True:
+            await asyncio.sleep(PRICE_BROADCAST_INTERVAL)
+            now = time.time()
+            quotes = quote_table.snapshot(sent_until)
+            sent_until = now
+            crypto = None
+            if crypto_prices.updated_at != crypto_sent:
+                crypto = crypto_prices.snapshot()
+                crypto_sent = crypto_prices.updated_at
+            if quotes or crypto:
+                for queue in self.queues:
+                    queue.put((PRICES_MESSAGE, quotes, crypto))
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Передать обновление рабочему процессу, отвечающему за этот чат."""
+        chat_id = update.effective_chat.id if update.effective_chat else 0
+        index = chat_shard(chat_id, self.size)
+        process = self.processes[index]
+        if process is None or not process.is_alive():
+            logger.error(f"Worker {index} is not running, restarting it")
+            self._spawn(index)
+        self.queues[index].put(update.to_dict())
+        logger.debug(f"Update {update.update_id} for chat {chat_id} -> worker {index}")
+
+    async def stop(self) -> None:
+        """Попросить процессы завершиться и дождаться их (с запасом к SHUTDOWN_TIMEOUT)."""
+        if self._broadcast is not None:
+            self._broadcast.cancel()
+            await asyncio.gather(self._broadcast, return_exceptions=True)
+            self._broadcast = None
+        for queue in self.queues:
+            queue.put(None)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, SHUTDOWN_TIMEOUT + 5)
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time, terminating")
+                process.terminate()
+                await asyncio.to_thread(process.join, 5)
+        logger.info("Worker pool stopped")
+
+    def terminate(self) -> None:
+        """Аварийная остановка: иначе интерпретатор ждет не-daemon процессы при выходе."""
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+                process.join(5)
+
+
+def setup_front(token: str, pool: WorkerPool) -> Application:
+    """Фронт-приложение: только получает обновления и раздает их рабочим процессам."""
+    application = Application.builder().token(token).build()
+    application.add_handler(TypeHandler(Update, pool.dispatch))
+    logger.info(f"Front dispatcher configured for {pool.size} workers")
+    return application
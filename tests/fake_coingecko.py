@@ -0,0 +1,63 @@
+"""
+Minimal in-process HTTP server standing in for the CoinGecko API in tests.
+
+Serves /simple/price from a fixture, filtered by the requested ids.
+"""
+import asyncio
+import json
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE = Path(__file__).parent / "fixtures" / "coingecko_simple_price.json"
+
+
+class FakeCoinGeckoServer:
+    """Tiny HTTP/1.1 server answering /simple/price requests."""
+
+    def __init__(self):
+        self.prices = json.loads(FIXTURE.read_text(encoding="utf-8"))
+        self.requests = []  # Query parameters of every request received
+        self._server = None
+        self._writers = set()
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                target = head.split(b" ", 2)[1].decode()
+                parts = urlsplit(target)
+                params = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                self.requests.append(params)
+                if parts.path == "/simple/price":
+                    ids = params.get("ids", "").split(",")
+                    status, body = "200 OK", json.dumps({i: self.prices[i] for i in ids if i in self.prices})
+                else:
+                    status, body = "404 Not Found", "{}"
+                payload = body.encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
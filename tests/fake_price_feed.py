@@ -0,0 +1,102 @@
+"""
+Minimal in-process WebSocket server standing in for a price feed in tests.
+
+Each connection gets the handshake, then every message passed to publish().
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class FakePriceFeedServer:
+    """Tiny WebSocket server broadcasting JSON messages to connected clients."""
+
+    def __init__(self, answer_pings=True):
+        self.answer_pings = answer_pings
+        self.connections = 0
+        self.pings = 0
+        self._clients = set()
+        self._connected = asyncio.Event()
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        self.drop()
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/stream"
+
+    async def wait_connected(self, count=1):
+        while self.connections < count or not self._clients:
+            self._connected.clear()
+            await self._connected.wait()
+
+    async def publish(self, message):
+        payload = json.dumps(message).encode()
+        for writer in list(self._clients):
+            writer.write(self._frame(0x1, payload))
+            await writer.drain()
+
+    def drop(self):
+        """Close every client connection without a close frame."""
+        for writer in list(self._clients):
+            writer.close()
+        self._clients.clear()
+
+    @staticmethod
+    def _frame(opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        else:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        return header + payload
+
+    async def _handle(self, reader, writer):
+        try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode()
+            key = next(
+                line.split(":", 1)[1].strip() for line in head.split("\r\n")
+                if line.lower().startswith("sec-websocket-key")
+            )
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+            writer.write(
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode()
+            )
+            await writer.drain()
+            self.connections += 1
+            self._clients.add(writer)
+            self._connected.set()
+            while True:
+                first, second = await reader.readexactly(2)
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                mask = await reader.readexactly(4)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(length)))
+                opcode = first & 0x0F
+                if opcode == 0x9:
+                    self.pings += 1
+                    if self.answer_pings:
+                        writer.write(self._frame(0xA, payload))
+                        await writer.drain()
+                elif opcode == 0x8:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, StopIteration):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
@@ -0,0 +1,140 @@
+"""
+Minimal in-process RESP server standing in for Redis in tests.
+
+Supports only the commands used by RedisStateBackend.
+"""
+import asyncio
+import time
+
+
+class FakeRedisServer:
+    """Tiny single-database Redis stand-in running on the test event loop."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.batches = []  # Number of commands received per network read
+        self.delay = 0.0  # Seconds to wait before replying (simulates a slow server)
+        self._server = None
+        self.port = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    async def _handle(self, reader, writer):
+        buffer = b""
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                commands, buffer = self._parse(buffer)
+                if commands:
+                    self.batches.append(len(commands))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(b"".join(self._execute(cmd) for cmd in commands))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse(buffer):
+        commands = []
+        while buffer.startswith(b"*"):
+            try:
+                pos = buffer.index(b"\r\n")
+                count = int(buffer[1:pos])
+                pos += 2
+                args = []
+                for _ in range(count):
+                    end = buffer.index(b"\r\n", pos)
+                    length = int(buffer[pos + 1:end])
+                    start = end + 2
+                    if len(buffer) < start + length + 2:
+                        raise ValueError("incomplete")
+                    args.append(buffer[start:start + length])
+                    pos = start + length + 2
+            except ValueError:
+                break
+            commands.append(args)
+            buffer = buffer[pos:]
+        return commands, buffer
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at < time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _execute(self, args):
+        name = args[0].decode().upper()
+        key = args[1] if len(args) > 1 else None
+        if key is not None:
+            self._alive(key)
+
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "GET":
+            return self._bulk(self.data.get(key))
+        if name == "SET":
+            self.data[key] = args[2]
+            self.expires.pop(key, None)
+            if len(args) > 4 and args[3].upper() in (b"PX", b"EX"):
+                scale = 1000 if args[3].upper() == b"PX" else 1
+                self.expires[key] = time.monotonic() + int(args[4]) / scale
+            return b"+OK\r\n"
+        if name == "DEL":
+            existed = self.data.pop(key, None) is not None
+            self.expires.pop(key, None)
+            return b":%d\r\n" % existed
+        if name == "INCR":
+            value = int(self.data.get(key, b"0")) + 1
+            self.data[key] = str(value).encode()
+            return b":%d\r\n" % value
+        if name in ("PEXPIRE", "EXPIRE"):
+            scale = 1000 if name == "PEXPIRE" else 1
+            if key not in self.data:
+                return b":0\r\n"
+            self.expires[key] = time.monotonic() + int(args[2]) / scale
+            return b":1\r\n"
+        if name == "RPUSH":
+            items = self.data.setdefault(key, [])
+            items.extend(args[2:])
+            return b":%d\r\n" % len(items)
+        if name == "LRANGE":
+            items = self.data.get(key, [])
+            return self._array(self._slice(items, int(args[2]), int(args[3])))
+        if name == "LTRIM":
+            if key in self.data:
+                self.data[key] = self._slice(self.data[key], int(args[2]), int(args[3]))
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    @staticmethod
+    def _slice(items, start, stop):
+        size = len(items)
+        start = max(size + start, 0) if start < 0 else start
+        stop = size + stop if stop < 0 else stop
+        return items[start:stop + 1]
+
+    @staticmethod
+    def _bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _array(self, items):
+        return b"*%d\r\n" % len(items) + b"".join(self._bulk(item) for item in items)
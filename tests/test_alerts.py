@@ -0,0 +1,81 @@
+"""
+Tests for price alerts
+"""
+import asyncio
+import random
+import pytest
+from modules.alerts import AlertEngine, parse_alert_request, ABOVE, BELOW
+from modules.finance_data import FinanceDataClient
+
+
+def test_parse_alert_request():
+    """Test asset aliases, tickers and number formats"""
+    assert parse_alert_request("доллар 100") == ("USD", 100.0)
+    assert parse_alert_request("когда евро будет 98,5") == ("EUR", 98.5)
+    assert parse_alert_request("BTC 70 000") == ("BTC", 70000.0)
+    assert parse_alert_request("aapl 250.5") == ("AAPL", 250.5)
+    assert parse_alert_request("доллар") is None
+    assert parse_alert_request("100") is None
+
+
+def test_only_crossed_thresholds_trigger():
+    """Test above/below books against a brute-force check on many alerts"""
+    engine = AlertEngine(path="", max_per_chat=100)
+    rng = random.Random(42)
+    for i in range(2000):
+        engine.add(chat_id=i % 50, symbol="USD", threshold=round(rng.uniform(80, 110), 2), current_price=95.0)
+    alerts = {alert.id: alert for chat in range(50) for alert in engine.for_chat(chat)}
+
+    expected = {a.id for a in alerts.values()
+                if (a.direction == ABOVE and a.threshold <= 101.3) or (a.direction == BELOW and a.threshold >= 101.3)}
+    assert engine.on_quote("USD", 101.3) == len(expected)
+    triggered = {alert.id for items in engine._pending.values() for alert, _ in items}
+    assert triggered == expected
+    assert len(engine) == 2000 - len(expected)
+    # Повторная котировка по той же цене ничего не делает
+    assert engine.on_quote("USD", 101.3) == 0
+    assert engine.on_quote("EUR", 1.0) == 0
+
+    below = next(a for a in alerts.values() if a.direction == BELOW)
+    assert engine.remove(below.chat_id, below.id)
+    assert not engine.remove(below.chat_id, below.id)
+
+
+@pytest.mark.asyncio
+async def test_alerts_fire_from_finance_client_and_persist(tmp_path):
+    """Test quote listener delivery, batching per chat and restore after restart"""
+    path = str(tmp_path / "alerts.json")
+    delivered = []
+
+    async def deliver(chat_id, text):
+        delivered.append((chat_id, text))
+
+    async def fetch_quote(symbol):
+        return None
+
+    client = FinanceDataClient()
+    engine = AlertEngine(path=path, batch_interval=0.01, check_interval=60)
+    client.add_quote_listener(engine.on_quote)
+    await engine.start(deliver, fetch_quote)
+    try:
+        engine.add(1, "USD", 100.0, current_price=92.0)
+        engine.add(1, "USD", 99.0, current_price=92.0)
+        engine.add(2, "BTC", 60000.0, current_price=67000.0)
+        assert engine.for_chat(2)[0].direction == BELOW
+
+        client._publish({"symbol": "USD/RUB", "price": 100.2})
+        await asyncio.sleep(0.1)
+        assert len(delivered) == 1
+        chat_id, text = delivered[0]
+        assert chat_id == 1 and "USD ≥ 100" in text and "USD ≥ 99" in text
+    finally:
+        await engine.stop()
+        client._quote_listeners.clear()
+
+    restored = AlertEngine(path=path, check_interval=60)
+    await restored.start(deliver, fetch_quote)
+    try:
+        assert [a.describe() for a in restored.for_chat(2)] == ["BTC ≤ 60000"]
+        assert restored.add(2, "ETH", 4000.0, current_price=3500.0).id > restored.for_chat(2)[0].id
+    finally:
+        await restored.stop()
@@ -0,0 +1,27 @@
+"""
+Tests for the micro-benchmark runner
+"""
+from benchmarks import runner
+from benchmarks.suite import BENCHMARKS
+
+
+def test_every_benchmark_runs_offline():
+    """Test that each registered benchmark runs on recorded data and is in the baseline"""
+    results = runner.run(repeat=1, number=1)
+    assert set(results) == set(BENCHMARKS)
+    assert all(result['us'] > 0 for result in results.values())
+    assert set(BENCHMARKS) <= set(runner.load_baseline())
+
+
+def test_compare_reports_regressions(tmp_path):
+    """Test verdicts against a stored baseline and baseline merging"""
+    path = tmp_path / "baseline.json"
+    runner.save_baseline({'a': {'us': 10.0}, 'b': {'us': 10.0}, 'c': {'us': 10.0}}, path)
+    runner.save_baseline({'c': {'us': 12.0}}, path)
+    baseline = runner.load_baseline(path)
+    assert baseline['a']['us'] == 10.0 and baseline['c']['us'] == 12.0
+
+    results = {'a': {'us': 13.0}, 'b': {'us': 7.0}, 'c': {'us': 12.5}, 'd': {'us': 1.0}}
+    verdicts = {row['name']: row['verdict'] for row in runner.compare(results, baseline)}
+    assert verdicts == {'a': 'slower', 'b': 'faster', 'c': 'same', 'd': 'new'}
+    assert runner.main(["-k", "instruments", "--baseline", str(path), "--check"]) == 0
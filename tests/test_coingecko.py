@@ -0,0 +1,70 @@
+"""
+Tests for the CoinGecko bulk price table
+"""
+import time
+import pytest
+from unittest.mock import patch
+from modules.coingecko import CoinGeckoPrices
+from modules.finance_data import FinanceDataClient
+from tests.fake_coingecko import FakeCoinGeckoServer
+
+
+@pytest.mark.asyncio
+async def test_one_bulk_request_serves_all_coins():
+    """Test that a single request fills prices for every tracked coin"""
+    server = await FakeCoinGeckoServer().start()
+    prices = CoinGeckoPrices(base_url=server.url, refresh_interval=60)
+    try:
+        btc = await prices.get_price("btc")
+        eth = await prices.get_price("ETH")
+        doge = await prices.get_price("DOGE")
+
+        assert len(server.requests) == 1
+        assert "bitcoin" in server.requests[0]["ids"] and "dogecoin" in server.requests[0]["ids"]
+        assert btc["symbol"] == "BTC-USD" and btc["price"] == 67250.12 and btc["source"] == "CoinGecko"
+        assert eth["change_percent"] == -1.12 and eth["change"] < 0
+        assert doge["price"] == 0.171234
+        # Монеты нет в ответе API
+        assert await prices.get_price("XRP") is None
+        assert await prices.get_price("UNKNOWN") is None
+    finally:
+        await prices.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_lookup_is_served_from_memory():
+    """Test that lookups after the first load do not touch the network"""
+    server = await FakeCoinGeckoServer().start()
+    prices = CoinGeckoPrices(base_url=server.url, refresh_interval=60)
+    try:
+        await prices.get_price("BTC")
+        started = time.perf_counter()
+        for _ in range(1000):
+            assert prices.lookup("SOL")["price"] == 182.77
+        assert (time.perf_counter() - started) / 1000 < 0.001
+        assert len(server.requests) == 1
+
+        # Устаревшая таблица не используется
+        prices.updated_at -= prices.refresh_interval * 10
+        assert prices.lookup("SOL") is None
+    finally:
+        await prices.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_get_crypto_price_prefers_coingecko():
+    """Test that FinanceDataClient reads crypto prices from the table"""
+    server = await FakeCoinGeckoServer().start()
+    prices = CoinGeckoPrices(base_url=server.url, refresh_interval=60)
+    client = FinanceDataClient()
+    client.supported_apis['coinGecko'] = True
+    try:
+        with patch("modules.finance_data.crypto_prices", prices), \
+                patch.object(client, "get_stock_quote", side_effect=AssertionError("yfinance called")):
+            quote = await client.get_crypto_price("TON")
+        assert quote["price"] == 4.12 and quote["name"] == "Toncoin"
+    finally:
+        await prices.close()
+        await server.stop()
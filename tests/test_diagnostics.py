@@ -0,0 +1,103 @@
+"""
+Tests for on-demand runtime diagnostics
+"""
+import asyncio
+import json
+import time
+import tracemalloc
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from modules.bot import diag_command
+from modules.diagnostics import Diagnostics, DiagServer, format_report, parse_admin_ids
+from modules.lifecycle import shutdown_manager
+
+
+def busy_loop_for_profile(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_diag_command_is_admin_only():
+    """Test that /diag answers only configured admins and reports in-flight stages"""
+    assert parse_admin_ids("123, -45;abc") == {123, -45}
+    reply = AsyncMock()
+    update = lambda user_id: SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, username="op"),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(reply_text=reply),
+    )
+    context = SimpleNamespace(args=[])
+    from modules import bot
+    original = bot.diagnostics
+    bot.diagnostics = Diagnostics(admin_ids="42")
+    try:
+        await diag_command(update(7), context)
+        assert reply.await_count == 0
+
+        async with shutdown_manager.track("portfolio"):
+            await diag_command(update(42), context)
+    finally:
+        bot.diagnostics = original
+    text = reply.await_args.args[0]
+    assert "задержка loop" in text
+    assert "portfolio 1" in text
+    assert "chat_histories" in text
+
+
+@pytest.mark.asyncio
+async def test_profile_and_memory_are_time_boxed():
+    """Test that the sampler sees code blocking the loop and tracing stops afterwards"""
+    diagnostics = Diagnostics(max_seconds=0.5, sample_interval=0.002)
+    assert diagnostics.clamp_seconds("100") == 0.5
+
+    async def block_loop():
+        await asyncio.sleep(0.05)
+        busy_loop_for_profile(0.2)
+
+    blocker = asyncio.create_task(block_loop())
+    report = await diagnostics.run("profile", "0.4")
+    await blocker
+    assert report['samples'] > 20
+    assert report['loop_busy'] > 0.2
+    assert any("busy_loop_for_profile" in item['function'] for item in report['total'])
+    assert "Профиль" in format_report(report)
+
+    assert not tracemalloc.is_tracing()
+    report = await diagnostics.run("memory", "0.1")
+    assert not tracemalloc.is_tracing()
+    assert report['window_seconds'] == 0.1
+    assert "Память" in format_report(report)
+
+
+@pytest.mark.asyncio
+async def test_local_endpoint_serves_json():
+    """Test the HTTP endpoint routes and that it is off when no port is configured"""
+    server = DiagServer(Diagnostics(), host="127.0.0.1", port=0)
+    await server.start()
+    assert server._server is None
+
+    server._server = await asyncio.start_server(server._handle, "127.0.0.1", 0)
+    port = server._server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b"\r\n\r\n", 1)
+        return head.split(b"\r\n")[0].decode(), json.loads(body)
+
+    try:
+        status, body = await get("/diag")
+        assert status == "HTTP/1.1 200 OK"
+        assert {'loop_lag', 'in_flight', 'executors', 'caches'} <= set(body)
+        status, body = await get("/diag/profile?seconds=0.1")
+        assert body['seconds'] == 0.1
+        status, _ = await get("/metrics")
+        assert status == "HTTP/1.1 404 Not Found"
+    finally:
+        await server.stop()
@@ -0,0 +1,51 @@
+"""
+Tests for fast path (template answers without LLM)
+"""
+import pytest
+from unittest.mock import AsyncMock, patch
+from modules.fast_path import render_quote_answer, pick_quote
+from modules.llm import llm_client, clear_chat_history, get_chat_context
+
+USD_QUOTE = {
+    'symbol': 'USD/RUB',
+    'price': 95.4512,
+    'change': 0.7612,
+    'change_percent': 0.8,
+    'currency': 'RUB',
+    'name': 'Доллар США',
+    'source': 'ЦБ РФ',
+    'timestamp': '2025-01-09T11:30:00+03:00'
+}
+
+
+def test_render_quote_answer():
+    """Test the emoji template built from a structured quote"""
+    answer = render_quote_answer(USD_QUOTE)
+    assert "💱" in answer
+    assert "95.45 ₽" in answer
+    assert "↗️ +0.7612 (+0.8%)" in answer
+    assert "ЦБ РФ, 09.01.2025 11:30" in answer
+
+
+def test_pick_quote_requires_single_quote():
+    """Test that ambiguous results are left to the LLM"""
+    assert pick_quote([{'title': 'news'}]) is None
+    assert pick_quote([{'quote': USD_QUOTE}]) is USD_QUOTE
+    assert pick_quote([{'quote': USD_QUOTE}, {'quote': USD_QUOTE}]) is None
+
+
+@pytest.mark.asyncio
+async def test_generate_response_uses_fast_path_without_llm():
+    """Test that a pure price question is answered from the quote"""
+    chat_id = 22001
+    clear_chat_history(chat_id)
+    real_data = [{'title': 'Курс USD/RUB', 'snippet': '...', 'quote': USD_QUOTE}]
+
+    with patch("modules.llm.web_search_client.get_real_financial_data", AsyncMock(return_value=real_data)), \
+            patch.object(llm_client, "_complete", AsyncMock()) as complete:
+        answer = await llm_client.generate_response("курс доллара?", chat_id)
+
+    complete.assert_not_called()
+    assert "USD/RUB" in answer
+    assert [m["role"] for m in get_chat_context(chat_id)[1:]] == ["user", "assistant"]
+    clear_chat_history(chat_id)
@@ -0,0 +1,148 @@
+"""
+Tests for the load governor and graceful degradation
+"""
+import asyncio
+import logging
+import pytest
+from unittest.mock import AsyncMock, patch
+from modules.governor import (
+    LoadGovernor, governor, LEVEL_NORMAL, LEVEL_NO_SCRAPING, LEVEL_QUOTES_ONLY, LEVEL_SHORT_HISTORY,
+    LEVEL_CHEAP_MODEL, LEVEL_SHED
+)
+from modules.llm import llm_client, build_prompt, add_to_history, clear_chat_history
+from modules.routing import get_tier_params, TIER_ANALYSIS
+from modules.web_search import WebSearchClient
+
+
+def test_levels_step_with_hysteresis_and_recover(caplog):
+    """Test one step per interval under pressure, holding between thresholds and logged recovery"""
+    gov = LoadGovernor(lag_target=0.1, max_llm_in_flight=10, error_rate=0.5, step_up_after=2,
+                       recover_ratio=0.5, recover_after=10, max_level=LEVEL_SHED)
+    with caplog.at_level(logging.INFO, logger="modules.governor"):
+        assert gov.update(lag=0.3, now=100) == 1
+        assert gov.update(lag=0.3, now=101) == 1
+        assert gov.update(lag=0.3, now=102) == 2
+        # Между порогом восстановления и порогом перегрузки уровень держится
+        assert gov.update(lag=0.08, now=200) == 2
+        assert gov.update(lag=0.01, now=205) == 2
+        assert gov.update(lag=0.01, now=214) == 2
+        assert gov.update(lag=0.01, now=215) == 1
+        assert gov.update(lag=0.01, now=224) == 1
+        assert gov.update(lag=0.01, now=225) == LEVEL_NORMAL
+
+    changes = [r.getMessage() for r in caplog.records if "Load level" in r.getMessage()]
+    assert len(changes) == 4
+    assert "0 (normal) -> 1 (no_scraping)" in changes[0]
+    assert "1 (no_scraping) -> 0 (normal)" in changes[-1]
+
+    gov.llm_in_flight = 11
+    assert gov.update(lag=0.0, now=300) == 1
+    gov.llm_in_flight = 0
+    for t in range(10):
+        gov._outcomes.append((300 + t * 0.1, t % 2 == 0))
+    assert gov.error_rate(now=301) == 0.5
+    assert gov.pressure(now=301) == 1.0
+    assert gov.error_rate(now=400) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_degradation_levels_trim_the_pipeline():
+    """Test scraping skipped, quotes-only enrichment, short history, smaller max_tokens and cheaper model"""
+    client = WebSearchClient()
+    news = AsyncMock(return_value=[{"title": "news", "snippet": "", "url": "https://a"}])
+    html = AsyncMock(return_value=[])
+    client.search_duckduckgo = AsyncMock(return_value=[])
+    client.search_duckduckgo_html = html
+    client.search_financial_news = news
+    client.search_simple_web = AsyncMock(return_value=[])
+    client.get_real_financial_data = AsyncMock(return_value=[])
+
+    chat_id = 12360
+    clear_chat_history(chat_id)
+    for i in range(10):
+        add_to_history(chat_id, "user" if i % 2 == 0 else "assistant", f"msg {i}")
+    real_data = [{"title": "Курс USD/RUB", "snippet": "...", "quote": {"symbol": "USD/RUB", "price": 92.45}}]
+    search = AsyncMock()
+
+    try:
+        governor.level = LEVEL_NO_SCRAPING
+        await client.search_asset_info("доллар")
+        news.assert_not_awaited()
+        html.assert_not_awaited()
+
+        governor.level = LEVEL_QUOTES_ONLY
+        with patch("modules.llm.web_search_client.get_real_financial_data", AsyncMock(return_value=real_data)), \
+                patch("modules.llm.web_search_client.search_asset_info", search):
+            enrichment = llm_client.start_enrichment("Проанализируй курс доллара")
+            results = await llm_client._wait_enrichment(enrichment)
+        search.assert_not_called()
+        assert results["general_info"] == real_data
+        assert len(build_prompt(chat_id)) == 11
+
+        governor.level = LEVEL_SHORT_HISTORY
+        history = build_prompt(chat_id)[1:]
+        assert len(history) <= 6 and history[0]["role"] == "user"
+        assert governor.adjust_params(get_tier_params(TIER_ANALYSIS)) == get_tier_params(TIER_ANALYSIS)
+
+        governor.level = LEVEL_CHEAP_MODEL
+        params = governor.adjust_params(get_tier_params(TIER_ANALYSIS))
+        assert params['max_tokens'] == get_tier_params(TIER_ANALYSIS)['max_tokens'] // 2
+        assert params['model'] == "openai/gpt-4o-mini"
+    finally:
+        governor.level = LEVEL_NORMAL
+        clear_chat_history(chat_id)
+        client.session.close()
+
+
+@pytest.mark.asyncio
+async def test_shed_level_queues_then_rejects():
+    """Test that at the last level messages wait for a free slot or are rejected after a timeout"""
+    gov = LoadGovernor(max_llm_in_flight=1)
+    gov.level = LEVEL_SHED
+    assert await gov.admit(timeout=0.1)
+    assert gov.admitted == 1
+    assert not await gov.admit(timeout=0.05)
+
+    waiting = asyncio.create_task(gov.admit(timeout=1))
+    await asyncio.sleep(0.01)
+    assert gov.queued == 1
+    gov.release()
+    assert await waiting
+    assert gov.queued == 0 and gov.admitted == 1
+    gov.release()
+    assert gov.admitted == 0
+
+
+@pytest.mark.asyncio
+async def test_shed_level_bounds_concurrent_admissions():
+    """Test that a burst at the shed level is let through at most max_llm_in_flight at a time"""
+    gov = LoadGovernor(max_llm_in_flight=3)
+    gov.level = LEVEL_SHED
+    active = 0
+    peak = 0
+
+    async def handle_message():
+        nonlocal active, peak
+        if not await gov.admit(timeout=2):
+            return False
+        try:
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return True
+        finally:
+            gov.release()
+
+    gov.max_queued = 50
+    results = await asyncio.gather(*(handle_message() for _ in range(20)))
+    assert all(results)
+    assert peak == 3
+    assert gov.admitted == 0 and gov.queued == 0
+
+    # Waiter timing out is rejected without leaking a slot
+    assert await gov.admit(timeout=0.1)
+    assert await gov.admit(timeout=0.1)
+    assert await gov.admit(timeout=0.1)
+    assert not await gov.admit(timeout=0.02)
+    assert gov.admitted == 3 and gov.queued == 0
@@ -0,0 +1,134 @@
+"""
+Tests for hedged LLM requests
+"""
+import asyncio
+import pytest
+from modules.hedging import HedgeBudget, hedge_delay, run_hedged
+from modules.metrics import metrics
+
+
+def make_call(first_token_after, total, result, log):
+    async def call(started):
+        log.append(result)
+        try:
+            await asyncio.sleep(first_token_after)
+            started.set()
+            await asyncio.sleep(total - first_token_after)
+            return result
+        except asyncio.CancelledError:
+            log.append(f"{result} cancelled")
+            raise
+    return call
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_primary_is_slow():
+    """Test the hedge is sent after the delay, wins and the primary is cancelled"""
+    metrics.reset()
+    log = []
+    result = await run_hedged(
+        make_call(5, 6, "primary", log), make_call(0.01, 0.02, "hedge", log),
+        delay=0.05, budget=HedgeBudget(0.05), metric_prefix="llm.test"
+    )
+    assert result == "hedge"
+    assert log == ["primary", "hedge", "primary cancelled"]
+    assert metrics.counters["llm.test.hedges"] == 1
+    assert metrics.counters["llm.test.hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_first_token_is_fast_or_budget_is_spent():
+    """Test fast primaries are not hedged and the budget caps hedges"""
+    metrics.reset()
+    log = []
+    fast = await run_hedged(
+        make_call(0.01, 0.03, "primary", log), make_call(0, 0, "hedge", log),
+        delay=0.05, budget=HedgeBudget(0.05), metric_prefix="llm.test"
+    )
+    assert fast == "primary" and log == ["primary"]
+
+    budget = HedgeBudget(0.0, burst=1)
+    results = [
+        await run_hedged(make_call(0.05, 0.06, "primary", []), make_call(0, 0.01, "hedge", []),
+                         delay=0.01, budget=budget, metric_prefix="llm.test")
+        for _ in range(3)
+    ]
+    assert results == ["hedge", "primary", "primary"]
+    assert metrics.counters["llm.test.hedge_budget_exhausted"] == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_hedge_falls_back_to_primary():
+    """Test that an error in one request does not fail the hedged call"""
+    async def failing(started):
+        raise RuntimeError("upstream error")
+
+    result = await run_hedged(
+        make_call(0.05, 0.06, "primary", []), failing,
+        delay=0.01, budget=HedgeBudget(1.0), metric_prefix="llm.test"
+    )
+    assert result == "primary"
+
+
+def test_hedge_delay_tracks_ttft_percentile():
+    """Test the default delay until enough samples, then the rolling p90"""
+    metrics.reset()
+    assert hedge_delay("llm.test.ttft", 90, 4.0, 0.5, 10) == 4.0
+    for value in [0.1] * 5 + [1.0] * 4 + [3.0]:
+        metrics.observe("llm.test.ttft", value)
+    assert hedge_delay("llm.test.ttft", 90, 4.0, 0.5, 10) == 1.0
+    assert hedge_delay("llm.test.ttft", 50, 4.0, 0.5, 10) == 0.5
+
+
+class FakeStream:
+    """Async iterator of chat completion chunks with a delay before the first token"""
+
+    def __init__(self, text, delay, closed):
+        self.text = text
+        self.delay = delay
+        self.closed = closed
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        from types import SimpleNamespace as NS
+        await asyncio.sleep(self.delay)
+        for word in self.text.split(" "):
+            yield NS(usage=None, choices=[NS(delta=NS(content=word + " "))])
+        yield NS(usage=NS(prompt_tokens=10, completion_tokens=3, prompt_tokens_details=None), choices=[])
+
+    async def close(self):
+        self.closed.append(self.text)
+
+
+@pytest.mark.asyncio
+async def test_complete_streams_and_hedges(monkeypatch):
+    """Test the LLM client hedges a slow stream and closes the losing one"""
+    from unittest.mock import MagicMock
+    from modules.llm import llm_client
+    from modules.routing import TIER_QUOTE
+
+    metrics.reset()
+    closed = []
+    delays = iter([5.0, 0.01])
+
+    async def create(**kwargs):
+        assert kwargs["stream"] is True
+        return FakeStream(f"answer from {kwargs['model']}", next(delays), closed)
+
+    fake_client = MagicMock()
+    fake_client.chat.completions.create = create
+    monkeypatch.setattr(llm_client, "async_client", fake_client)
+    monkeypatch.setattr(llm_client, "_hedge_budgets", {})
+    monkeypatch.setattr("modules.llm.LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr("modules.llm.LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr("modules.llm.LLM_HEDGE_MODEL", "hedge/model")
+
+    response = await llm_client._complete([{"role": "user", "content": "курс доллара?"}], TIER_QUOTE, timeout=3)
+
+    assert response.choices[0].message.content.strip() == "answer from hedge/model"
+    assert metrics.counters["llm.quote.hedge_wins"] == 1
+    assert metrics.counters["llm.quote.completion_tokens"] == 3
+    assert metrics.percentile("llm.quote.ttft", 50) is not None
+    assert len(closed) == 2
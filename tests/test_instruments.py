@@ -0,0 +1,95 @@
+"""
+Tests for the instrument index
+"""
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+from modules.instruments import InstrumentIndex, instrument_index
+from modules.web_search import WebSearchClient, detect_real_data_assets
+from modules.alerts import parse_alert_request
+from modules.portfolio import parse_holdings
+
+
+def test_find_mentions_in_free_text():
+    """Test inflected Russian names, longest match and whole-word tickers"""
+    keys = lambda text: [i.key for i in instrument_index.find(text)]
+
+    assert keys("Что с акциями Газпрома и Яндекса?") == ["GAZP", "YDEX"]
+    assert keys("дивиденды Газпром нефти") == ["SIBN"]
+    assert keys("Сравни SBER и Т-Банк, а еще apple") == ["SBER", "TCSG", "AAPL"]
+    assert keys("курс доллара и доллар снова") == ["USD"]
+    assert keys("мои сбережения") == []
+    assert keys("it is all on") == []
+    # Everyday words are not instrument aliases
+    assert keys("эфир на радио, озон над городом, магнит на холодильнике и ртс-слоты") == []
+    assert detect_real_data_assets("Стоит ли покупать золото?") == ["GOLD"]
+
+
+def test_resolve_explicit_names():
+    """Test keys, Yahoo symbols, aliases and typos"""
+    assert instrument_index.resolve("gazp").symbol == "GAZP.ME"
+    assert instrument_index.resolve("SBER.ME").key == "SBER"
+    assert instrument_index.resolve("^GSPC").key == "SPX"
+    assert instrument_index.resolve("Яндэкс").key == "YDEX"
+    assert instrument_index.resolve("лукойла").key == "LKOH"
+    assert instrument_index.resolve("qwerty") is None
+
+    assert parse_alert_request("газпром 150") == ("GAZP", 150.0)
+    assert parse_holdings("лукойл 50, NVDA 50") == [("LKOH.ME", 50.0), ("NVDA", 50.0)]
+
+
+def test_index_loads_and_matches_fast():
+    """Test that the bundled file loads in milliseconds and lookups take microseconds"""
+    index = InstrumentIndex(path="", fuzzy_cutoff=0.8)
+    started = time.perf_counter()
+    assert len(index) > 100
+    assert time.perf_counter() - started < 0.2
+
+    message = "Проанализируй Сбербанк, Лукойл и Норникель на фоне курса юаня и нефти " * 3
+    started = time.perf_counter()
+    for _ in range(100):
+        found = index.find(message)
+    assert (time.perf_counter() - started) / 100 < 0.002
+    assert [i.key for i in found] == ["SBER", "LKOH", "GMKN", "CNY", "BRENT"]
+
+
+@pytest.mark.asyncio
+async def test_any_listed_instrument_is_quoted():
+    """Test that real data is fetched for every mentioned instrument, not only hardcoded ones"""
+    async def quote(key):
+        symbol = {"LKOH": "LKOH.ME", "USD": "USD/RUB"}[key]
+        return {"symbol": symbol, "price": 100.0, "change": 1.0, "change_percent": 1.0,
+                "currency": "RUB", "source": "ЦБ РФ" if key == "USD" else "Yahoo Finance"}
+
+    client = WebSearchClient()
+    with patch("modules.finance_data.finance_client.get_instrument_quote", AsyncMock(side_effect=quote)) as mock:
+        results = await client.get_real_financial_data("Лукойл и доллар")
+    assert [call.args[0] for call in mock.call_args_list] == ["LKOH", "USD"]
+    assert results[0]["snippet"].startswith("Акции Лукойл: 100.0 RUB")
+    assert results[1]["url"] == "https://cbr.ru"
+    assert client.detect_financial_query("Что думаешь про Северсталь?")
+
+
+@pytest.mark.asyncio
+async def test_deep_search_keeps_every_quoted_instrument():
+    """Test that more than SEARCH_TOP_K quotes survive ranking and do not push out text results"""
+    from modules.llm import llm_client
+
+    async def quote(key):
+        return {"symbol": f"{key}/RUB", "price": 10.0, "change": 0.1, "change_percent": 1.0,
+                "currency": "RUB", "source": "ЦБ РФ"}
+
+    client = WebSearchClient()
+    info = [{"title": f"Обзор {i}", "snippet": f"Отдельный аналитический обзор номер {i} про валютный рынок {i * 7}",
+             "url": f"https://rbc.ru/review/{i}", "source": "RBC"} for i in range(2)]
+    client.search_duckduckgo = AsyncMock(return_value=info)
+    client.search_financial_news = AsyncMock(return_value=[])
+    question = "Сравни доллар, евро, юань, фунт, франк, иену, лиру и тенге"
+    with patch("modules.finance_data.finance_client.get_instrument_quote", AsyncMock(side_effect=quote)), \
+            patch("modules.llm.web_search_client", client):
+        results = await llm_client._multi_asset_search(question)
+    client.session.close()
+
+    symbols = [r["quote"]["symbol"] for r in results["general_info"] if r.get("quote")]
+    assert symbols == [f"{key}/RUB" for key in ("USD", "EUR", "CNY", "GBP", "CHF", "JPY", "TRY", "KZT")]
+    assert [r["title"] for r in results["general_info"] if not r.get("quote")] == ["Обзор 0", "Обзор 1"]
@@ -0,0 +1,149 @@
+"""
+Tests for the background analysis queue
+"""
+import asyncio
+import json
+import pytest
+from modules.jobs import AnalysisQueue, JOB_TIMEOUT_MESSAGE, JOB_ABANDONED_MESSAGE
+from modules.lifecycle import shutdown_manager
+
+
+def make_queue(**kwargs):
+    params = dict(workers=1, max_pending=10, max_per_chat=5, timeout=5, path="", interactive_limit=100)
+    params.update(kwargs)
+    return AnalysisQueue(**params)
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_by_priority_and_are_delivered():
+    """Test priority order with a single worker and result delivery"""
+    queue = make_queue()
+    delivered = []
+
+    async def handle(job):
+        await asyncio.sleep(0.01)
+        return f"answer: {job.question}"
+
+    async def deliver(chat_id, text):
+        delivered.append((chat_id, text))
+
+    await queue.start(handle, deliver)
+    for question, priority in (("long", 30), ("short", 5), ("medium", 10)):
+        queue.submit(1, question, priority=priority)
+    assert queue.submit(1, "over the per-chat limit", priority=1) is not None
+    assert make_queue(max_per_chat=0).submit(1, "x") is None  # Not started
+
+    while len(queue):
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+    assert [text for _, text in delivered] == [
+        "answer: over the per-chat limit", "answer: short", "answer: medium", "answer: long"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_jobs_wait_for_interactive_load():
+    """Test that jobs are deferred while interactive messages are in flight"""
+    queue = make_queue(interactive_limit=1)
+    started = asyncio.Event()
+    release = asyncio.Event()
+    delivered = []
+
+    async def interactive():
+        async with shutdown_manager.track("message"):
+            await release.wait()
+
+    async def handle(job):
+        started.set()
+        return "done"
+
+    async def deliver(chat_id, text):
+        delivered.append(text)
+
+    busy = asyncio.create_task(interactive())
+    await asyncio.sleep(0)
+    await queue.start(handle, deliver)
+    queue.submit(1, "сравни 5 ETF")
+    await asyncio.sleep(0.1)
+    assert not started.is_set()
+
+    release.set()
+    await busy
+    await asyncio.wait_for(started.wait(), timeout=2)
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_pending_jobs_survive_restart(tmp_path):
+    """Test persistence of interrupted jobs and the timeout answer"""
+    path = str(tmp_path / "jobs.json")
+    queue = make_queue(path=path)
+    never = asyncio.Event()
+
+    async def hang(job):
+        await never.wait()
+
+    async def deliver(chat_id, text):
+        pass
+
+    await queue.start(hang, deliver)
+    queue.submit(42, "сравни 5 ETF на горизонте 10 лет")
+    await asyncio.sleep(0.01)
+    await queue.stop()
+    with open(path, encoding="utf-8") as f:
+        assert [job["chat_id"] for job in json.load(f)] == [42]
+
+    restored = make_queue(path=path, timeout=0.05)
+    delivered = []
+
+    async def deliver_restored(chat_id, text):
+        delivered.append((chat_id, text))
+
+    await restored.start(hang, deliver_restored)
+    while len(restored):
+        await asyncio.sleep(0.01)
+    await restored.stop()
+
+    assert delivered == [(42, JOB_TIMEOUT_MESSAGE)]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == []
+
+
+@pytest.mark.asyncio
+async def test_restored_job_is_abandoned_after_max_attempts(tmp_path):
+    """Test that a job interrupted on every run is dropped and reported once attempts run out"""
+    path = str(tmp_path / "jobs.json")
+    never = asyncio.Event()
+    calls = []
+    delivered = []
+
+    async def hang(job):
+        calls.append(job.attempts)
+        await never.wait()
+
+    async def deliver(chat_id, text):
+        delivered.append((chat_id, text))
+
+    for run in range(2):
+        queue = make_queue(path=path, max_attempts=2)
+        await queue.start(hang, deliver)
+        if run == 0:
+            queue.submit(7, "сравни 5 ETF")
+        while len(calls) <= run:
+            await asyncio.sleep(0.01)
+        # Попытка сохранена до запуска, как если бы процесс упал посреди анализа
+        with open(path, encoding="utf-8") as f:
+            assert json.load(f)[0]["attempts"] == run + 1
+        await queue.stop()
+
+    queue = make_queue(path=path, max_attempts=2)
+    await queue.start(hang, deliver)
+    while len(queue):
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+    assert calls == [1, 2]
+    assert delivered == [(7, JOB_ABANDONED_MESSAGE)]
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == []
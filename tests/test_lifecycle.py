@@ -0,0 +1,98 @@
+"""
+Tests for lifecycle (graceful shutdown) module
+"""
+import asyncio
+import pytest
+from modules.lifecycle import ShutdownManager
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_in_flight_requests():
+    """Test that drain lets tracked requests finish"""
+    manager = ShutdownManager()
+    finished = []
+
+    async def handler():
+        async with manager.track("message"):
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+    task = asyncio.create_task(handler())
+    await asyncio.sleep(0)
+    assert manager.in_flight_count == 1
+
+    assert await manager.drain(timeout=1) is True
+    assert finished == [True]
+    assert task.done()
+
+
+@pytest.mark.asyncio
+async def test_drain_cancels_requests_after_deadline():
+    """Test that requests exceeding the deadline are cancelled"""
+    manager = ShutdownManager()
+
+    async def handler():
+        async with manager.track("message"):
+            await asyncio.sleep(10)
+
+    task = asyncio.create_task(handler())
+    await asyncio.sleep(0)
+
+    assert await manager.drain(timeout=0.05) is False
+    assert task.cancelled()
+    assert manager.in_flight_count == 0
+
+
+@pytest.mark.asyncio
+async def test_drain_tracks_requests_not_long_lived_tasks():
+    """Test drain when handlers run inside one long-lived task that swallows cancellation"""
+    manager = ShutdownManager()
+    requests = asyncio.Queue()
+    handled = []
+    stopping = False
+
+    async def fetcher():
+        # Like PTB's _update_fetcher without concurrent_updates
+        while True:
+            try:
+                delay = await requests.get()
+                async with manager.track("message"):
+                    await asyncio.sleep(delay)
+                handled.append(delay)
+            except asyncio.CancelledError:
+                if stopping:
+                    raise
+
+    task = asyncio.create_task(fetcher())
+    await requests.put(0.05)
+    await asyncio.sleep(0)
+    assert await asyncio.wait_for(manager.drain(timeout=1), timeout=2) is True
+    assert handled == [0.05] and not task.done()
+
+    await requests.put(10)
+    await asyncio.sleep(0)
+    assert await asyncio.wait_for(manager.drain(timeout=0.05), timeout=2) is False
+    assert manager.in_flight_count == 0
+    stopping = True
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_callbacks_run_by_phase_and_survive_errors():
+    """Test that flush runs before close and failures don't stop shutdown"""
+    manager = ShutdownManager()
+    calls = []
+
+    async def close_session():
+        calls.append("close")
+
+    def broken_flush():
+        raise RuntimeError("boom")
+
+    manager.register("session", close_session, phase="close")
+    manager.register("broken", broken_flush)
+    manager.register("history", lambda: calls.append("flush"))
+
+    await manager.run_callbacks()
+    assert calls == ["flush", "close"]
@@ -1,8 +1,14 @@
 """
 Tests for LLM module
 """
+import asyncio
 import pytest
-from modules.llm import add_to_history, get_chat_context, clear_chat_history
+from unittest.mock import AsyncMock, MagicMock, patch
+from config import MAX_HISTORY_MESSAGES
+from modules.llm import (
+    add_to_history, get_chat_context, clear_chat_history, build_prompt, apply_cache_hints,
+    llm_client, pending_evictions, chat_histories
+)
 
 
 def test_add_to_history():
@@ -44,3 +50,112 @@ def test_clear_chat_history():
     assert len(context) <= 1
 
 
+def test_build_prompt_puts_enrichment_at_the_tail():
+    """Test that search data goes into the last user turn, not into history"""
+    chat_id = 12348
+    clear_chat_history(chat_id)
+    add_to_history(chat_id, "user", "Курс доллара?")
+
+    messages = build_prompt(chat_id, "USD/RUB 95.45")
+
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert "USD/RUB 95.45" in messages[-1]["content"]
+    assert messages[-1]["content"].endswith("Курс доллара?")
+    # History itself stays clean so the cached prefix doesn't change
+    assert get_chat_context(chat_id)[-1]["content"] == "Курс доллара?"
+    clear_chat_history(chat_id)
+
+
+def test_apply_cache_hints_marks_stable_prefix():
+    """Test cache_control breakpoints on system prompt and last history turn"""
+    messages = [
+        {"role": "system", "content": "prompt"},
+        {"role": "user", "content": "q1"},
+        {"role": "assistant", "content": "a1"},
+        {"role": "user", "content": "q2"},
+    ]
+
+    hinted = apply_cache_hints(messages, "anthropic/claude-sonnet-4")
+    assert hinted[0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+    assert hinted[2]["content"][0]["text"] == "a1"
+    assert hinted[3]["content"] == "q2"
+    assert messages[0]["content"] == "prompt"  # Original list is not modified
+
+    assert apply_cache_hints(messages, "openai/gpt-4o-mini") is messages
+
+
+@pytest.mark.asyncio
+async def test_evicted_turns_are_folded_into_summary():
+    """Test rolling summary of turns evicted from history"""
+    chat_id = 12349
+    clear_chat_history(chat_id)
+    for i in range(MAX_HISTORY_MESSAGES + 1):
+        add_to_history(chat_id, "user" if i % 2 == 0 else "assistant", f"msg {i}")
+
+    evicted = pending_evictions[chat_id]
+    assert evicted[0]["content"] == "msg 0"
+    assert len(chat_histories[chat_id]) + len(evicted) == MAX_HISTORY_MESSAGES + 1
+
+    response = MagicMock()
+    response.choices[0].message.content = "Пользователь интересуется курсом доллара."
+    with patch.object(llm_client, "_complete", AsyncMock(return_value=response)) as complete:
+        llm_client.schedule_summary(chat_id)
+        await asyncio.gather(*llm_client._background_tasks)
+
+    assert "msg 0" in complete.call_args[0][0][1]["content"]
+    context = get_chat_context(chat_id)
+    assert context[1]["role"] == "system"
+    assert "курсом доллара" in context[1]["content"]
+    assert chat_id not in pending_evictions
+
+    clear_chat_history(chat_id)
+    assert len(get_chat_context(chat_id)) == 1
+
+
+@pytest.mark.asyncio
+async def test_enrichment_starts_early_and_shares_quotes():
+    """Test that the search reuses the quotes request started with the enrichment"""
+    real_data = [{"title": "Курс USD/RUB", "snippet": "...", "url": "https://cbr.ru",
+                  "quote": {"symbol": "USD/RUB", "price": 92.45}}]
+    quotes = AsyncMock(return_value=real_data)
+    with patch("modules.llm.web_search_client.get_real_financial_data", quotes), \
+            patch("modules.llm.web_search_client.search_duckduckgo", AsyncMock(return_value=[])), \
+            patch("modules.llm.web_search_client.search_duckduckgo_html", AsyncMock(return_value=[])), \
+            patch("modules.llm.web_search_client.search_financial_news", AsyncMock(return_value=[])):
+        # A pure price question only prefetches quotes for the fast path
+        fast = llm_client.start_enrichment("курс доллара?")
+        assert fast.quotes is not None and fast.search is None
+
+        enrichment = llm_client.start_enrichment("Проанализируй курс доллара на этой неделе")
+        assert enrichment.search is not None
+        results = await enrichment.get_search()
+
+    quotes.assert_awaited()
+    assert quotes.await_count == 2  # One per enrichment, not one per consumer
+    assert results["general_info"][0]["quote"]["symbol"] == "USD/RUB"
+    await fast.get_quotes()
+
+
+@pytest.mark.asyncio
+async def test_quotes_first_does_not_wait_for_news():
+    """Test that the first LLM request goes out with quotes while news is loading"""
+    real_data = [{"title": "Курс USD/RUB", "snippet": "...", "quote": {"symbol": "USD/RUB", "price": 92.45}}]
+    news_started = asyncio.Event()
+
+    async def slow_news(*args, **kwargs):
+        news_started.set()
+        await asyncio.sleep(10)
+        return []
+
+    with patch("modules.llm.web_search_client.get_real_financial_data", AsyncMock(return_value=real_data)), \
+            patch("modules.llm.web_search_client.search_duckduckgo", AsyncMock(return_value=[])), \
+            patch("modules.llm.web_search_client.search_financial_news", slow_news), \
+            patch("modules.llm.ENRICHMENT_QUOTES_FIRST", True):
+        enrichment = llm_client.start_enrichment("Проанализируй курс доллара")
+        results = await asyncio.wait_for(llm_client._wait_enrichment(enrichment), timeout=1)
+        assert news_started.is_set()
+        enrichment.cancel()
+        await asyncio.gather(enrichment.search, return_exceptions=True)
+
+    assert results["general_info"] == real_data
+    assert results["recent_news"] == []
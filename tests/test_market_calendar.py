@@ -0,0 +1,108 @@
+"""
+Tests for the market calendar and off-hours quote caching
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from unittest.mock import patch
+from modules.market_calendar import MarketCalendar, MarketState, MARKETS, Market, load_holidays, weekdays
+from modules.finance_data import FinanceDataClient
+from modules.fast_path import render_quote_answer
+from modules.state import state_backend
+
+MSK = ZoneInfo("Europe/Moscow")
+NY = ZoneInfo("America/New_York")
+
+
+def test_trading_sessions_and_holidays():
+    """Test weekends, holidays, overnight sessions, DST and 24/7 markets"""
+    calendar = MarketCalendar(extra_holidays="MOEX:2026-10-20")
+    at = lambda *args, tz=MSK: datetime(*args, tzinfo=tz)
+
+    assert calendar.state("AAPL", at(2026, 10, 19, 17, 0)).is_open
+    saturday = calendar.state("AAPL", at(2026, 10, 17, 12, 0))
+    assert not saturday.is_open
+    assert saturday.last_close == datetime(2026, 10, 16, 16, 0, tzinfo=NY)
+    assert saturday.next_open == datetime(2026, 10, 19, 9, 30, tzinfo=NY)
+    # День благодарения и переход на зимнее время: открытие по местному времени
+    assert not calendar.state("MSFT", at(2026, 11, 26, 12, 0, tz=NY)).is_open
+    assert calendar.state("MSFT", at(2026, 10, 30, 14, 15, tz=timezone.utc)).is_open
+    assert not calendar.state("MSFT", at(2026, 11, 2, 14, 15, tz=timezone.utc)).is_open
+    assert calendar.state("MSFT", at(2026, 11, 2, 14, 45, tz=timezone.utc)).is_open
+
+    assert not calendar.state("SBER.ME", at(2026, 11, 4, 12, 0)).is_open
+    assert not calendar.state("GAZP.ME", at(2026, 10, 20, 12, 0)).is_open
+    assert calendar.state("GAZP.ME", at(2026, 10, 21, 12, 0)).is_open
+
+    # Фьючерсы: часовой перерыв и открытие вечером воскресенья
+    assert not calendar.state("GC=F", at(2026, 10, 19, 16, 30, tz=ZoneInfo("America/Chicago"))).is_open
+    assert calendar.state("GC=F", at(2026, 10, 18, 17, 30, tz=ZoneInfo("America/Chicago"))).is_open
+    assert calendar.state("EURUSD=X", at(2026, 10, 18, 20, 0, tz=NY)).is_open
+    assert not calendar.state("EURUSD=X", at(2026, 10, 17, 12, 0, tz=NY)).is_open
+    assert calendar.state("BTC-USD", at(2026, 10, 17, 12, 0)) is None
+    assert date(2026, 10, 20) not in MARKETS["MOEX"].holidays
+
+
+def test_holidays_file_and_uncovered_year_warning(tmp_path, caplog):
+    """Test the holidays data file and the one-time warning for a year missing from it"""
+    path = tmp_path / "holidays.tsv"
+    path.write_text("# comment\nMOEX\t2026-11-04\nmoex\t2026-12-31\nbroken line\nUS\t2026-13-01\n", encoding="utf-8")
+    holidays = load_holidays(str(path))
+    assert holidays == {"MOEX": ["2026-11-04", "2026-12-31"]}
+    assert len(caplog.records) == 2  # Malformed lines are reported and skipped
+    caplog.clear()
+    assert date(2027, 1, 1) in MARKETS["US"].holidays
+
+    market = Market("MOEX", "Московская биржа", "Europe/Moscow", weekdays("06:50", "23:50"), holidays["MOEX"])
+    calendar = MarketCalendar(markets={**MARKETS, "MOEX": market}, extra_holidays="MOEX:2027-01-04")
+    with caplog.at_level(logging.WARNING, logger="modules.market_calendar"):
+        assert not calendar.state("SBER.ME", datetime(2026, 11, 4, 12, 0, tzinfo=MSK)).is_open
+        assert not caplog.records
+        for hour in (10, 11, 12):
+            calendar.state("SBER.ME", datetime(2027, 1, 5, hour, 0, tzinfo=MSK))
+        calendar.next_cbr_publication(datetime(2027, 1, 5, 16, 0, tzinfo=MSK))
+    warnings = [r.getMessage() for r in caplog.records]
+    assert len(warnings) == 1 and "No MOEX holidays for 2027" in warnings[0]
+
+
+def test_cbr_rate_lifetime():
+    """Test that the CBR rate is kept until the next publication unless the mirror lags"""
+    calendar = MarketCalendar()
+    monday_morning = datetime(2026, 10, 19, 10, 0, tzinfo=MSK)
+    # Курс, опубликованный в пятницу, действует с субботы до публикации в понедельник
+    assert calendar.cbr_rate_ttl(date(2026, 10, 17), monday_morning) == 5.5 * 3600
+    assert calendar.cbr_rate_ttl(date(2026, 10, 16), monday_morning) is None
+    after_publication = datetime(2026, 10, 19, 15, 40, tzinfo=MSK)
+    assert calendar.cbr_rate_ttl(date(2026, 10, 17), after_publication) is None
+    assert calendar.next_cbr_publication(datetime(2026, 11, 3, 16, 0, tzinfo=MSK)) == \
+        datetime(2026, 11, 5, 15, 30, tzinfo=MSK)
+
+
+@pytest.mark.asyncio
+async def test_closed_market_quote_served_from_cache():
+    """Test that off-hours quotes are fetched once, cached until open and labeled"""
+    now = datetime.now(timezone.utc)
+    closed = MarketState(MARKETS["US"], False, now - timedelta(hours=2), now + timedelta(hours=10))
+    calls = []
+
+    async def fake_run(func, symbol):
+        calls.append(symbol)
+        return {"symbol": symbol, "price": 230.5, "change": 1.5, "change_percent": 0.65,
+                "currency": "USD", "name": "Apple Inc.", "timestamp": now.isoformat()}
+
+    client = FinanceDataClient()
+    with patch("modules.finance_data.run_cpu_bound", fake_run), \
+         patch("modules.finance_data.YFINANCE_AVAILABLE", True), \
+         patch("modules.finance_data.market_calendar.state", lambda symbol, at=None: closed):
+        first = await client.get_stock_quote("CALTEST")
+        second = await client.get_stock_quote("CALTEST")
+
+    assert calls == ["CALTEST"]
+    assert second["market_closed"]
+    assert second["timestamp"] == closed.last_close.isoformat()
+    assert "(цена закрытия)" in render_quote_answer(second)
+    expires_at, _ = state_backend._quotes["stock:CALTEST"]
+    assert expires_at - time.monotonic() > 9 * 3600
+    del state_backend._quotes["stock:CALTEST"]
@@ -0,0 +1,124 @@
+"""
+Tests for the outbound Telegram message pipeline
+"""
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock
+from telegram.error import BadRequest, Forbidden, RetryAfter, TimedOut
+from modules.metrics import metrics
+from modules.outbound import split_message, telegram_length, TokenBucket, OutboundSender, TypingTicker
+
+
+def test_split_message_on_paragraphs():
+    """Test that long answers are split at paragraph boundaries within the limit"""
+    paragraphs = [f"Абзац {i}. " + " ".join(["слово"] * 150) for i in range(10)]
+    text = "\n\n".join(paragraphs)
+
+    parts = split_message(text, limit=2000)
+
+    assert all(len(part) <= 2000 for part in parts)
+    assert all(part.startswith("Абзац") for part in parts)
+    assert "\n\n".join(parts) == text.strip()
+    assert split_message("короткий ответ") == ["короткий ответ"]
+    # No separators at all: hard cut
+    assert [len(p) for p in split_message("x" * 5000, limit=4096)] == [4096, 904]
+
+
+def test_split_message_counts_utf16_units():
+    """Test that astral-plane emoji count as two units, as Telegram counts them"""
+    assert telegram_length("📈") == 2 and telegram_length("рост") == 4
+    # 3000 code points, 6000 UTF-16 units: fits by len() but not by Telegram's limit
+    text = "📈" * 3000
+    parts = split_message(text, limit=4096)
+    assert [telegram_length(p) for p in parts] == [4096, 1904]
+    assert "".join(parts) == text
+
+    # Right at the boundary: one more emoji tips it over
+    assert split_message("a" * 4094 + "📈") == ["a" * 4094 + "📈"]
+    assert split_message("a" * 4095 + "📈") == ["a" * 4095, "📈"]
+    words = " ".join(["рост📈"] * 700)
+    parts = split_message(words)
+    assert len(parts) == 2 and all(telegram_length(p) <= 4096 for p in parts)
+    assert " ".join(parts) == words
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    """Test that tokens beyond the burst are spaced by the rate"""
+    bucket = TokenBucket(rate=50, capacity=2)
+    started = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    assert time.monotonic() - started >= 0.035
+
+
+@pytest.mark.asyncio
+async def test_sender_honors_retry_after_and_splits():
+    """Test RetryAfter retries, no retries on BadRequest, and multi-part sending"""
+    sender = OutboundSender(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=3, backoff=0.01)
+    send = AsyncMock(side_effect=[RetryAfter(0), TimedOut(), "ok-1", "ok-2"])
+
+    results = await sender.send_text(1, "a" * 3000 + "\n\n" + "b" * 3000, send)
+
+    assert results == ["ok-1", "ok-2"]
+    assert send.await_count == 4
+
+    bad = AsyncMock(side_effect=BadRequest("Message is too long"))
+    with pytest.raises(BadRequest):
+        await sender.send_text(1, "text", bad)
+    assert bad.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_typing_ticker_uses_one_timer():
+    """Test that all active chats are refreshed from a single ticker"""
+    ticker = TypingTicker(interval=0.02)
+    first, second = AsyncMock(), AsyncMock()
+
+    async with ticker.track(1, first), ticker.track(2, second):
+        timer = ticker._task
+        await asyncio.sleep(0.05)
+        assert ticker._task is timer
+
+    sent = first.await_count
+    assert sent >= 2 and second.await_count >= 2
+    await asyncio.sleep(0.05)
+    assert first.await_count == sent  # Stopped once work is done
+    await ticker.stop()
+
+
+@pytest.mark.asyncio
+async def test_typing_ticker_coalesces_pending_messages():
+    """Test one refresh per chat for several pending messages and the saved-calls metric"""
+    ticker = TypingTicker(interval=0.03)
+    action = AsyncMock()
+    saved_before = metrics.counters.get("telegram.typing_saved", 0)
+
+    async with ticker.track(7, action):
+        async with ticker.track(7, action), ticker.track(7, action):
+            assert len(ticker) == 1
+            await asyncio.sleep(0.08)
+        async with ticker.paused(7):
+            paused_count = action.await_count
+            await asyncio.sleep(0.07)
+            assert action.await_count == paused_count
+    assert len(ticker) == 0
+
+    # Initial send plus ~2 ticks instead of 3 messages x (1 + 2 ticks)
+    assert 2 <= action.await_count <= 4
+    assert metrics.counters["telegram.typing_saved"] - saved_before >= 4
+    await ticker.stop()
+
+
+@pytest.mark.asyncio
+async def test_typing_ticker_stops_on_blocked_chat():
+    """Test that Forbidden disables refreshes for the chat"""
+    ticker = TypingTicker(interval=0.01)
+    action = AsyncMock(side_effect=Forbidden("bot was blocked by the user"))
+
+    async with ticker.track(8, action):
+        await asyncio.sleep(0.05)
+
+    assert action.await_count == 1
+    await ticker.stop()
@@ -0,0 +1,117 @@
+"""
+Tests for portfolio analytics
+"""
+import time
+import pytest
+import numpy as np
+from modules.portfolio import PortfolioAnalyzer, parse_holdings, format_portfolio_summary, max_drawdown
+
+
+def make_history(symbols, days=252, seed=7):
+    """Random-walk closes with a benchmark and gaps from different exchange calendars."""
+    rng = np.random.default_rng(seed)
+    dates = [f"2025-{1 + i // 28:02d}-{1 + i % 28:02d}" for i in range(days)]
+    market = rng.normal(0.0004, 0.01, days)
+    closes = {"^GSPC": list(100 * np.cumprod(1 + market))}
+    for index, symbol in enumerate(symbols):
+        beta = 0.5 + index % 3 * 0.5
+        returns = beta * market + rng.normal(0, 0.01, days)
+        prices = 50 * np.cumprod(1 + returns)
+        prices[rng.integers(1, days, 5)] = np.nan
+        closes[symbol] = list(prices)
+    # Инструмент, торгующийся не весь период
+    closes[symbols[0]][:3] = [float('nan')] * 3
+    return {'dates': dates, 'closes': closes}
+
+
+class FakeHistoryClient:
+    def __init__(self, history):
+        self.history = history
+        self.calls = []
+
+    async def get_price_history(self, symbols, period):
+        self.calls.append(list(symbols))
+        closes = {s: v for s, v in self.history['closes'].items() if s in symbols}
+        return {'dates': self.history['dates'], 'closes': closes}
+
+
+def test_parse_holdings():
+    """Test tickers, aliases, weight formats and equal weights"""
+    assert parse_holdings("AAPL 40, msft:30%, золото 30") == [("AAPL", 40.0), ("MSFT", 30.0), ("GC=F", 30.0)]
+    assert parse_holdings("SBER.ME GAZP.ME") == [("SBER.ME", 1.0), ("GAZP.ME", 1.0)]
+    assert parse_holdings("BTC 0,5 доллар 0,5") == [("BTC-USD", 0.5), ("USDRUB=X", 0.5)]
+    assert parse_holdings("") == []
+
+
+def test_parse_holdings_multi_word_names():
+    """Test longest-alias names, leading amounts and rejected segments"""
+    assert parse_holdings("газпром нефть 20, сбербанк 80") == [("SIBN.ME", 20.0), ("SBER.ME", 80.0)]
+    assert parse_holdings("S&P 500 50, золото 50") == [("^GSPC", 50.0), ("GC=F", 50.0)]
+    assert parse_holdings("1000 AAPL; 500 MSFT\nPLTR 10") == [("AAPL", 1000.0), ("MSFT", 500.0), ("PLTR", 10.0)]
+
+    rejected = []
+    assert parse_holdings("мой любимый фонд 50, AAPL 50", rejected) == [("AAPL", 50.0)]
+    assert rejected == ["мой любимый фонд 50"]
+
+
+def test_max_drawdown():
+    """Test drawdown on a known path, including a loss from the first day"""
+    returns = np.array([0.1, -0.5, 0.2, 0.5])
+    assert max_drawdown(returns) == pytest.approx(-0.5)
+    assert max_drawdown(np.array([-0.2, 0.1])) == pytest.approx(-0.2)
+
+
+@pytest.mark.asyncio
+async def test_analyze_many_positions():
+    """Test metrics against per-column references and that the math is fast for 60 positions"""
+    symbols = [f"S{i}" for i in range(59)] + ["^GSPC"]
+    client = FakeHistoryClient(make_history(symbols[:-1]))
+    analyzer = PortfolioAnalyzer(period="1y", benchmark="^GSPC", cache_ttl=60, client=client)
+    holdings = [(symbol, 1.0) for symbol in symbols]
+
+    started = time.perf_counter()
+    result = await analyzer.analyze(holdings)
+    elapsed = time.perf_counter() - started
+    assert elapsed < 0.5
+
+    assert len(client.calls) == 1
+    assert result['symbols'] == sorted(symbols)
+    assert result['missing'] == []
+    assert result['days'] == 249
+
+    index = result['symbols'].index("^GSPC")
+    assert result['beta'][index] == pytest.approx(1.0)
+    assert result['top_correlations'][0][2] <= 1.0 + 1e-9
+
+    # Эталон для одной позиции простым циклом
+    closes = client.history['closes']["S5"]
+    last, filled = None, []
+    for value in closes[3:]:
+        last = value if value == value else last
+        filled.append(last)
+    s5 = result['symbols'].index("S5")
+    assert result['total_return'][s5] == pytest.approx(filled[-1] / filled[0] - 1)
+    peak, worst = filled[0], 0.0
+    for price in filled:
+        peak = max(peak, price)
+        worst = min(worst, price / peak - 1)
+    assert result['max_drawdown'][s5] == pytest.approx(worst)
+
+    summary = format_portfolio_summary(result)
+    assert "60 позиций" in summary
+    assert "S5" in summary
+
+
+@pytest.mark.asyncio
+async def test_matrix_cache_reused_for_new_weights():
+    """Test that a different weighting of the same symbols hits the cache"""
+    client = FakeHistoryClient(make_history(["AAPL", "MSFT"]))
+    analyzer = PortfolioAnalyzer(period="1y", benchmark="^GSPC", cache_ttl=60, client=client)
+
+    first = await analyzer.analyze([("AAPL", 1.0), ("MSFT", 1.0), ("NOPE", 1.0)])
+    second = await analyzer.analyze([("MSFT", 9.0), ("AAPL", 1.0), ("NOPE", 1.0)])
+    assert len(client.calls) == 1
+    assert first['missing'] == second['missing'] == ["NOPE"]
+    assert second['weights'] == pytest.approx([0.1, 0.9])
+    assert first['portfolio']['volatility'] != second['portfolio']['volatility']
+    assert "Нет данных: NOPE" in format_portfolio_summary(second)
@@ -0,0 +1,134 @@
+"""
+Tests for the WebSocket price feed and the in-memory quote table
+"""
+import asyncio
+import time
+import pytest
+from unittest.mock import patch
+from modules.price_feed import PriceFeed, QuoteTable, parse_feed_message
+from modules.finance_data import FinanceDataClient
+from tests.fake_price_feed import FakePriceFeedServer
+
+SYMBOLS = {"BTCUSDT": "BTC", "ETHUSDT": "ETH", "XAUUSD": "GOLD", "USDRUB": "USD"}
+
+
+async def wait_for_price(table, key, price, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        quote = table.get(key)
+        if quote and quote["price"] == price:
+            return quote
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{key} never reached {price}")
+
+
+def test_quote_table_and_message_formats():
+    """Test table updates, freshness and both supported message formats"""
+    table = QuoteTable(source="Test")
+    assert table.get("BTC") is None
+    assert not table.update("UNKNOWN", 1.0)
+
+    table.update("BTC", 67250.0, 66000.0)
+    quote = table.get("BTC", max_age=5)
+    assert quote["symbol"] == "BTC-USD" and quote["change"] == 1250.0 and quote["change_percent"] == 1.89
+    assert quote["source"] == "Test" and quote["age"] < 1
+
+    table.update("USD", 92.4512, timestamp=time.time() - 120)
+    assert table.get("USD", max_age=60) is None
+    assert table.get("USD")["symbol"] == "USD/RUB"
+
+    binance = b'{"stream":"btcusdt@miniTicker","data":{"e":"24hrMiniTicker","s":"BTCUSDT","c":"67250.10","o":"66000.00"}}'
+    assert list(parse_feed_message(binance)) == [("BTCUSDT", 67250.10, 66000.0)]
+    generic = b'[{"symbol":"xauusd","price":2150.3},{"symbol":"USDRUB","price":"bad"},{"foo":1}]'
+    assert list(parse_feed_message(generic)) == [("XAUUSD", 2150.3, None)]
+    assert list(parse_feed_message(b"not json")) == []
+
+
+@pytest.mark.asyncio
+async def test_feed_updates_table_and_reconnects():
+    """Test ticks land in the table and the consumer reconnects after a drop"""
+    server = await FakePriceFeedServer().start()
+    table = QuoteTable()
+    feed = PriceFeed(url=server.url, symbols=SYMBOLS, table=table, ping_interval=0.05,
+                     stale_after=1.0, backoff=0.01, backoff_max=0.05)
+    try:
+        feed.start()
+        await server.wait_connected()
+        await server.publish({"stream": "btcusdt@miniTicker", "data": {"s": "BTCUSDT", "c": "67000.5", "o": "66000"}})
+        await server.publish([{"symbol": "XAUUSD", "price": 2150.3, "open": 2140.0}])
+        await wait_for_price(table, "BTC", 67000.5)
+        await wait_for_price(table, "GOLD", 2150.3)
+        assert table.source == "127.0.0.1"
+
+        await asyncio.sleep(0.15)
+        assert server.pings >= 1
+
+        server.drop()
+        await asyncio.wait_for(server.wait_connected(2), 2)
+        await server.publish({"symbol": "BTCUSDT", "price": 67100})
+        await wait_for_price(table, "BTC", 67100)
+    finally:
+        await feed.stop()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_feed_reconnects_when_heartbeat_is_not_answered():
+    """Test a silent connection is treated as dead after stale_after"""
+    server = await FakePriceFeedServer(answer_pings=False).start()
+    feed = PriceFeed(url=server.url, symbols=SYMBOLS, table=QuoteTable(), ping_interval=0.02,
+                     stale_after=0.1, backoff=0.01, backoff_max=0.02)
+    try:
+        feed.start()
+        await asyncio.wait_for(server.wait_connected(2), 2)
+    finally:
+        await feed.stop()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_feed_survives_unexpected_errors():
+    """Test that a malformed message triggers a reconnect instead of ending the feed task"""
+    server = await FakePriceFeedServer().start()
+    table = QuoteTable()
+    feed = PriceFeed(url=server.url, symbols=SYMBOLS, table=table, ping_interval=0.05,
+                     stale_after=1.0, backoff=0.01, backoff_max=0.02)
+    calls = []
+
+    def flaky_parse(data):
+        calls.append(data)
+        if len(calls) == 1:
+            raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+        return parse_feed_message(data)
+
+    try:
+        with patch("modules.price_feed.parse_feed_message", flaky_parse):
+            feed.start()
+            await server.wait_connected()
+            await server.publish({"symbol": "BTCUSDT", "price": 1})
+            await asyncio.wait_for(server.wait_connected(2), 2)
+            assert feed.running
+            await server.publish({"symbol": "BTCUSDT", "price": 67100})
+            await wait_for_price(table, "BTC", 67100)
+    finally:
+        await feed.stop()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_finance_client_reads_live_quotes():
+    """Test FinanceDataClient serves fed instruments without network calls"""
+    table = QuoteTable(source="Binance")
+    table.update("ETH", 3521.4, 3561.3)
+    table.update("USD", 92.45)
+    client = FinanceDataClient()
+    client.supported_apis['price_feed'] = True
+
+    with patch("modules.finance_data.quote_table", table), \
+            patch.object(client, "_fetch_cbr_rate", side_effect=AssertionError("network")), \
+            patch("modules.finance_data.crypto_prices.get_price", side_effect=AssertionError("network")):
+        eth = await client.get_crypto_price("eth")
+        usd = await client.get_currency_rate("USD", "RUB")
+
+    assert eth["price"] == 3521.4 and eth["source"] == "Binance"
+    assert usd["symbol"] == "USD/RUB" and usd["price"] == 92.45
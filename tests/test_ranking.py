@@ -0,0 +1,51 @@
+"""
+Tests for search result deduplication and ranking
+"""
+import json
+from datetime import datetime
+from pathlib import Path
+from modules.ranking import canonical_url, minhash_signature, signature_similarity, rank_results, source_reliability
+
+FIXTURES = json.loads((Path(__file__).parent / "fixtures" / "search_results.json").read_text(encoding="utf-8"))
+
+
+def test_canonical_url_strips_noise():
+    """Test that cosmetic URL differences collapse"""
+    assert canonical_url("http://www.RBC.ru/finances/?utm_source=ddg&b=2&a=1#top") == \
+        canonical_url("https://rbc.ru/finances?a=1&b=2")
+    assert canonical_url("https://rbc.ru/a") != canonical_url("https://rbc.ru/b")
+    # Only exact tracking keys are dropped, not every key that starts with them
+    assert canonical_url("https://moex.com/q?from=tg&ref=x&fromDate=2024-01-01&reference=SBER") == \
+        "https://moex.com/q?fromDate=2024-01-01&reference=SBER"
+
+
+def test_minhash_detects_near_duplicates():
+    """Test snippet similarity estimate"""
+    base = "Аналитики прогнозируют колебания курса в диапазоне 85-100 рублей в ближайшие месяцы"
+    near = base + " по данным опроса"
+    other = "Сбербанк отчитался о рекордной прибыли по МСФО за год"
+    assert signature_similarity(minhash_signature(base), minhash_signature(near)) >= 0.6
+    assert signature_similarity(minhash_signature(base), minhash_signature(other)) < 0.2
+
+
+def test_rank_results_dedups_and_prefers_real_data():
+    """Test merge stage on recorded provider output"""
+    placeholder = {"title": "Поиск курса доллара", "snippet": "Найдена информация о курсе USD/RUB",
+                   "url": "https://www.google.com/finance", "source": "Web Search"}
+    duplicate_url = dict(FIXTURES[0]["general_info"][1], url="http://investing.com/currencies/usd-rub/",
+                         snippet="Другой текст о той же странице")
+    results = [placeholder] + FIXTURES[0]["general_info"] + [duplicate_url]
+
+    ranked = rank_results(results, top_k=5, now=datetime(2024, 3, 15, 12, 0))
+
+    assert ranked[0]["quote"]["symbol"] == "USD/RUB"
+    assert ranked[-1] is placeholder
+    # Same canonical URL and the near-identical snippet are both dropped
+    assert len(ranked) == 3
+    assert rank_results(results, top_k=1, now=datetime(2024, 3, 15, 12, 0))[0]["quote"]
+
+
+def test_source_reliability_subdomains():
+    """Test that subdomains inherit domain reliability"""
+    assert source_reliability({"url": "https://ru.investing.com/x"}) == 0.8
+    assert source_reliability({"url": "https://cbr.ru", "mock": True}) < 0.5
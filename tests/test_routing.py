@@ -0,0 +1,102 @@
+"""
+Tests for model routing module
+"""
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+import openai
+from modules.routing import (
+    classify_request, get_tier_params, is_long_analysis, TIER_QUOTE, TIER_FOLLOWUP, TIER_ANALYSIS
+)
+from modules.llm import llm_client
+from modules.metrics import metrics
+
+
+def test_classify_pure_quote():
+    """Test short price questions go to the cheap tier"""
+    assert classify_request("курс доллара?") == TIER_QUOTE
+    assert classify_request("Сколько стоит биткойн") == TIER_QUOTE
+
+
+def test_classify_analysis_and_followup():
+    """Test analysis markers win over price words"""
+    assert classify_request("Стоит ли покупать золото сейчас?") == TIER_ANALYSIS
+    assert classify_request("Проанализируй акции Сбербанка") == TIER_ANALYSIS
+    assert classify_request("а почему так?", has_history=True) == TIER_FOLLOWUP
+    assert classify_request("а почему так?", has_history=False) == TIER_ANALYSIS
+
+
+def test_tier_params_from_config():
+    """Test each tier has model, max_tokens and temperature"""
+    for tier in (TIER_QUOTE, TIER_FOLLOWUP, TIER_ANALYSIS):
+        params = get_tier_params(tier)
+        assert params['model'] and params['max_tokens'] > 0
+    assert get_tier_params("unknown") == get_tier_params(TIER_ANALYSIS)
+
+
+@pytest.mark.asyncio
+async def test_complete_falls_back_on_rate_limit():
+    """Test fallback to the secondary model and per-tier metrics"""
+    metrics.reset()
+    response = MagicMock()
+    response.usage.prompt_tokens = 100
+    response.usage.completion_tokens = 20
+    rate_limit = openai.RateLimitError("limit", response=MagicMock(status_code=429), body=None)
+    calls = []
+
+    async def fake_request(messages, model, max_tokens, temperature, timeout):
+        calls.append(model)
+        if len(calls) == 1:
+            raise rate_limit
+        return response
+
+    with patch.object(llm_client, "_request", side_effect=fake_request), \
+            patch("modules.llm.LLM_FALLBACK_MODEL", "fallback/model"):
+        result = await llm_client._complete([{"role": "user", "content": "hi"}], TIER_QUOTE)
+
+    assert result is response
+    assert calls == [get_tier_params(TIER_QUOTE)['model'], "fallback/model"]
+    assert metrics.counters["llm.quote.fallbacks"] == 1
+    assert metrics.counters.get("llm.quote.timeout_fallbacks", 0) == 0
+    assert metrics.counters["llm.quote.prompt_tokens"] == 100
+    assert metrics.percentile("llm.quote.latency", 50) is not None
+
+
+@pytest.mark.asyncio
+async def test_fallback_cancels_timed_out_primary_request(monkeypatch):
+    """Test that the primary request is cancelled, not left running, when the fallback model answers"""
+    response = MagicMock()
+    response.usage.prompt_tokens = 10
+    response.usage.completion_tokens = 5
+    cancelled = []
+    metrics.reset()
+
+    async def create(**kwargs):
+        if kwargs["model"] != "fallback/model":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(kwargs["model"])
+                raise
+        return response
+
+    fake_client = MagicMock()
+    fake_client.chat.completions.create = create
+    monkeypatch.setattr(llm_client, "async_client", fake_client)
+    monkeypatch.setattr("modules.llm.LLM_HEDGE_ENABLED", False)
+    monkeypatch.setattr("modules.llm.LLM_FALLBACK_MODEL", "fallback/model")
+    monkeypatch.setattr("modules.llm.LLM_PRIMARY_TIMEOUT_SHARE", 0.02)
+
+    result = await llm_client._complete([{"role": "user", "content": "hi"}], TIER_ANALYSIS, timeout=5)
+
+    assert result is response
+    assert cancelled == [get_tier_params(TIER_ANALYSIS)['model']]
+    assert metrics.counters["llm.analysis.timeout_fallbacks"] == 1
+
+
+def test_long_analysis_detection():
+    """Test which questions go to the background analysis queue"""
+    assert is_long_analysis("сравни 5 ETF на горизонте 10 лет")
+    assert is_long_analysis("Собери портфель из 3 акций на горизонте 5 лет")
+    assert not is_long_analysis("Проанализируй акции Сбербанка")
+    assert not is_long_analysis("курс доллара?")
@@ -0,0 +1,119 @@
+"""
+Tests for shared state module
+"""
+import asyncio
+import pytest
+from modules.state import MemoryStateBackend, RedisStateBackend, StateBackendError, ChatLocks, chat_shard
+from tests.fake_redis import FakeRedisServer
+
+
+@pytest.mark.asyncio
+async def test_redis_history_is_trimmed_in_one_round_trip():
+    """Test history append/trim against the in-process RESP stand-in"""
+    server = await FakeRedisServer().start()
+    backend = RedisStateBackend(server.url, history_ttl=60)
+    try:
+        for i in range(3):
+            await backend.append_history(1, [
+                {"role": "user", "content": f"вопрос {i}"},
+                {"role": "assistant", "content": f"ответ {i}"}
+            ], max_messages=4)
+
+        history = await backend.get_history(1)
+        assert [m["content"] for m in history] == ["вопрос 1", "ответ 1", "вопрос 2", "ответ 2"]
+        # RPUSH + LTRIM + EXPIRE arrive as a single pipelined batch
+        assert server.batches[0] == 3
+
+        await backend.set_summary(1, "сводка")
+        assert await backend.load_chat(1) == (history, "сводка")
+
+        await backend.clear_history(1)
+        assert await backend.load_chat(1) == ([], None)
+    finally:
+        await backend.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_redis_quote_cache_and_rate_limit():
+    """Test quote TTL cache and fixed-window rate limit counters"""
+    server = await FakeRedisServer().start()
+    backend = RedisStateBackend(server.url)
+    try:
+        await backend.set_quote("cbr:USD", {"price": 95.5}, ttl=0.05)
+        assert await backend.get_quote("cbr:USD") == {"price": 95.5}
+        await asyncio.sleep(0.1)
+        assert await backend.get_quote("cbr:USD") is None
+
+        results = [await backend.hit_rate_limit("chat:1", limit=2, window=60) for _ in range(3)]
+        assert results == [False, False, True]
+
+        with pytest.raises(StateBackendError):
+            await backend.execute("FLUSHALL")
+    finally:
+        await backend.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_redis_cancelled_request_does_not_leak_replies():
+    """Test that a request cancelled mid-reply does not hand its replies to the next caller"""
+    server = await FakeRedisServer().start()
+    backend = RedisStateBackend(server.url)
+    try:
+        await backend.set_quote("a", {"price": 1}, ttl=60)
+        await backend.set_quote("b", {"price": 2}, ttl=60)
+        server.delay = 0.1
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend.get_quote("a"), timeout=0.02)
+        server.delay = 0
+        await asyncio.sleep(0.15)
+        assert await backend.get_quote("b") == {"price": 2}
+        assert await backend.hit_rate_limit("chat:1", limit=5, window=60) is False
+    finally:
+        await backend.close()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_memory_rate_limit_windows_expire():
+    """Test that finished rate limit windows are dropped from memory"""
+    backend = MemoryStateBackend()
+    for chat_id in range(100):
+        await backend.hit_rate_limit(f"chat:{chat_id}", 1, 0.01)
+    await asyncio.sleep(0.02)
+    backend._next_purge = 0
+    assert await backend.hit_rate_limit("chat:0", 1, 0.01) is False
+    assert list(backend._counters) == ["chat:0"]
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_matches_redis_semantics():
+    """Test the default in-process backend"""
+    backend = MemoryStateBackend()
+    await backend.append_history(1, [{"role": "user", "content": str(i)} for i in range(5)], max_messages=3)
+    assert [m["content"] for m in await backend.get_history(1)] == ["2", "3", "4"]
+    assert [await backend.hit_rate_limit("k", 1, 60) for _ in range(2)] == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_chat_locks_keep_turn_order():
+    """Test that one chat's messages are processed sequentially"""
+    locks = ChatLocks()
+    order = []
+
+    async def turn(n, delay):
+        async with locks(42):
+            await asyncio.sleep(delay)
+            order.append(n)
+
+    await asyncio.gather(turn(1, 0.03), turn(2, 0))
+    assert order == [1, 2]
+    assert len(locks) == 0  # Locks are released once idle
+
+
+def test_chat_shard_is_stable():
+    """Test chat affinity routing"""
+    assert chat_shard(12345, 4) == chat_shard(12345, 4)
+    assert chat_shard(-100123, 1) == 0
+    assert {chat_shard(i, 3) for i in range(10)} == {0, 1, 2}
@@ -0,0 +1,184 @@
+"""
+Tests for web search parsing and enrichment rendering
+"""
+import asyncio
+import json
+import pytest
+from pathlib import Path
+from modules.web_search import (
+    format_search_results, estimate_tokens, DuckDuckGoLiteParser, WebSearchClient, SearchCache, stream_text
+)
+
+FIXTURES = json.loads((Path(__file__).parent / "fixtures" / "search_results.json").read_text(encoding="utf-8"))
+
+
+def test_enrichment_is_compact_and_deduplicated():
+    """Test quotes table, one-line news and sources listed once"""
+    text = format_search_results(FIXTURES[1])
+
+    assert "SBER.ME|281.5 RUB|-1.2|-0.42%|Yahoo Finance|2024-03-15T11:29" in text
+    assert text.count("рекордной прибыли") == 1
+    assert "Источники: finance.yahoo.com, moex.com, rbc.ru, finam.ru" in text
+    assert "===" not in text and "📊" not in text
+
+
+def test_enrichment_respects_token_budget():
+    """Test that lower priority sections are dropped first"""
+    full = format_search_results(FIXTURES[0])
+    small = format_search_results(FIXTURES[0], max_tokens=60)
+
+    assert "Новости:" in full
+    assert "USD/RUB|92.45 RUB" in small
+    assert "Новости:" not in small
+    assert estimate_tokens(small) <= 60 + small.count("\n") + 1
+
+
+def test_enrichment_empty_results():
+    """Test that errors and empty searches produce no block"""
+    assert format_search_results({}) == ""
+    assert format_search_results({"asset_name": "x", "error": "boom"}) == ""
+    assert format_search_results({"asset_name": "x", "general_info": [], "recent_news": [], "total_results": 0}) == ""
+
+
+DDG_LITE_PAGE = (Path(__file__).parent / "fixtures" / "ddg_lite.html").read_bytes()
+
+
+class FakeStreamResponse:
+    """requests.Response stand-in that records how much of the body was read."""
+
+    def __init__(self, body, chunk_size=1024, status_code=200):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.status_code = status_code
+        self.encoding = "utf-8"
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start:start + self.chunk_size]
+            self.read += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+def test_lite_parser_is_chunk_independent():
+    """Test streaming extraction regardless of chunk boundaries"""
+    def parse(chunk):
+        parser = DuckDuckGoLiteParser(max_results=10)
+        text = DDG_LITE_PAGE.decode("utf-8")
+        for start in range(0, len(text), chunk):
+            parser.feed(text[start:start + chunk])
+        parser.close()
+        return parser.results
+
+    results = parse(7)
+    assert results == parse(65536)
+    # Redirect links are unwrapped, short titles and non-finance links skipped
+    assert results[0]["url"] == "https://www.investing.com/currencies/usd-rub"
+    assert results[0]["snippet"].startswith("Курс доллара к рублю")
+    assert "Chart & News" in results[1]["title"]
+    assert all("wikipedia" not in r["url"] and r["title"] != "Short" for r in results)
+    assert len(results) == 6
+
+
+def test_lite_parser_stops_reading_early():
+    """Test that the download stops once max_results links are parsed"""
+    response = FakeStreamResponse(DDG_LITE_PAGE, chunk_size=4096)
+    parser = DuckDuckGoLiteParser(max_results=2)
+    received = stream_text(response, lambda text: parser.feed(text) or parser.done)
+
+    assert len(parser.results) == 2
+    # The rest of the results table and the page tail are never downloaded
+    assert received < DDG_LITE_PAGE.index(b"</table>")
+    assert response.closed
+
+
+@pytest.mark.asyncio
+async def test_simple_web_search_streams_page():
+    """Test the chunked currency check of the simple web search"""
+    client = WebSearchClient()
+    requested = []
+    page = ("x" * 5000 + "92,45 руб.").encode("utf-8")
+
+    def fake_get(url, timeout=None, stream=False):
+        requested.append(url)
+        # 4-byte chunks split the UTF-8 word across reads
+        return FakeStreamResponse(page, chunk_size=4)
+
+    client.session.get = fake_get
+    results = await client.search_simple_web("курс доллара")
+    assert results[0]["source"] == "Web Search"
+
+    assert await client.search_simple_web("золото") == []
+    assert len(requested) == 1
+
+
+@pytest.mark.asyncio
+async def test_search_cache_fresh_stale_and_single_flight():
+    """Test fresh hits, stale-while-revalidate and request coalescing"""
+    cache = SearchCache(max_entries=10, stale=60, ttls={"news": 0.05}, path="")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [{"title": f"result {len(calls)}"}]
+
+    first = await asyncio.gather(*(cache.get("news", "Сбербанк  новости", fetch) for _ in range(3)))
+    assert len(calls) == 1 and first[0] == first[2]
+    # Normalized query: case and punctuation do not matter, word order does
+    assert await cache.get("news", "сбербанк, новости!", fetch) == [{"title": "result 1"}]
+    assert cache.make_key("news", "рубль к доллару") != cache.make_key("news", "доллару к рубль")
+
+    await asyncio.sleep(0.06)
+    stale = await cache.get("news", "Сбербанк новости", fetch)
+    assert stale == [{"title": "result 1"}]  # Served instantly
+    await asyncio.sleep(0.03)
+    assert len(calls) == 2
+    assert await cache.get("news", "Сбербанк новости", fetch) == [{"title": "result 2"}]
+
+
+@pytest.mark.asyncio
+async def test_search_cache_cancelled_caller_does_not_cancel_others():
+    """Test that cancelling the caller that started a fetch leaves the shared fetch running"""
+    cache = SearchCache(max_entries=10, stale=60, ttls={"news": 600}, path="")
+    release = asyncio.Event()
+
+    async def fetch():
+        await release.wait()
+        return [{"title": "result"}]
+
+    leader = asyncio.create_task(cache.get("news", "нефть", fetch))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get("news", "нефть", fetch))
+    await asyncio.sleep(0)
+    leader.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await follower == [{"title": "result"}]
+    assert leader.cancelled()
+    assert await cache.get("news", "нефть", fetch) == [{"title": "result"}]
+
+
+@pytest.mark.asyncio
+async def test_search_cache_is_bounded_and_persists(tmp_path):
+    """Test LRU bound and the on-disk tier"""
+    path = str(tmp_path / "search_cache.json")
+    cache = SearchCache(max_entries=2, stale=60, ttls={"duckduckgo": 600}, path=path)
+
+    async def empty():
+        return []
+
+    for query in ("a", "b", "c"):
+        await cache.get("duckduckgo", query, lambda: asyncio.sleep(0, [{"q": query}]))
+    await cache.get("duckduckgo", "empty", empty)  # Failures are not cached
+    assert len(cache) == 2
+    cache.flush()
+
+    restored = SearchCache(max_entries=2, stale=60, ttls={"duckduckgo": 600}, path=path)
+    assert await restored.get("duckduckgo", "c", empty) == [{"q": "c"}]
+    assert await restored.get("duckduckgo", "a", empty) == []
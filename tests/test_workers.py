@@ -0,0 +1,152 @@
+"""
+Tests for multi-process worker pool module
+"""
+import asyncio
+import json
+import os
+import pytest
+from unittest.mock import MagicMock, patch
+from telegram import Update
+from modules.workers import WorkerPool, start_process, reshard_file, shard_path, _mp_context, PRICES_MESSAGE
+from modules.state import chat_shard
+
+
+def make_update(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": "курс доллара"
+        }
+    }, None)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_routes_chat_to_same_worker():
+    """Test that updates of one chat always go to the same worker queue"""
+    pool = WorkerPool("token", 3)
+    pool.queues = [MagicMock() for _ in range(3)]
+    pool.processes = [MagicMock(is_alive=MagicMock(return_value=True)) for _ in range(3)]
+
+    for update_id in range(4):
+        await pool.dispatch(make_update(update_id, 1001), None)
+
+    target = chat_shard(1001, 3)
+    assert pool.queues[target].put.call_count == 4
+    sent = pool.queues[target].put.call_args[0][0]
+    assert sent["message"]["chat"]["id"] == 1001
+    assert all(q.put.call_count == 0 for i, q in enumerate(pool.queues) if i != target)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_restarts_dead_worker():
+    """Test that a crashed worker is respawned before dispatch"""
+    pool = WorkerPool("token", 1)
+    pool.queues = [MagicMock()]
+    pool._spawn = MagicMock()
+
+    await pool.dispatch(make_update(1, 5), None)
+
+    pool._spawn.assert_called_once_with(0)
+    pool.queues[0].put.assert_called_once()
+
+
+def cpu_bound_in_worker(results):
+    """Entry point of a spawned worker: use the finance process pool like a real worker does."""
+    from modules.finance_data import run_cpu_bound, shutdown_process_pool
+    try:
+        results.put(asyncio.run(run_cpu_bound(abs, -3)))
+    except BaseException as e:
+        results.put(repr(e))
+    finally:
+        shutdown_process_pool()
+
+
+def test_worker_can_use_finance_process_pool():
+    """Test that a spawned worker may start the finance process pool (daemon processes cannot)"""
+    results = _mp_context.Queue()
+    with patch.dict(os.environ, {"FINANCE_PROCESS_WORKERS": "1"}):
+        process = start_process(cpu_bound_in_worker, (results,), "bot-worker-test")
+    try:
+        assert not process.daemon
+        assert results.get(timeout=60) == 3
+    finally:
+        process.join(30)
+        if process.is_alive():
+            process.terminate()
+    assert process.exitcode == 0
+
+
+def test_reshard_moves_records_to_their_chat_worker(tmp_path):
+    """Test that records follow chat_shard when WORKER_PROCESSES changes, without loss or id clashes"""
+    path = str(tmp_path / "alerts.json")
+    chats = list(range(100, 112))
+    # Two workers wrote their files; alert ids are per worker and clash
+    for index in range(2):
+        owned = [chat for chat in chats if chat_shard(chat, 2) == index]
+        with open(shard_path(path, index, 2), "w", encoding="utf-8") as f:
+            json.dump([{"id": i + 1, "chat_id": chat} for i, chat in enumerate(owned)], f)
+    (tmp_path / "alerts.json.bak").write_text("not a shard")
+
+    reshard_file(path, 3)
+
+    loaded = []
+    for index in range(3):
+        with open(shard_path(path, index, 3), encoding="utf-8") as f:
+            records = json.load(f)
+        assert all(chat_shard(r["chat_id"], 3) == index for r in records)
+        loaded.extend(records)
+    assert sorted(r["chat_id"] for r in loaded) == chats
+    assert len({r["id"] for r in loaded}) == len(chats)
+    assert sorted(os.listdir(tmp_path)) == ["alerts.json.0", "alerts.json.1", "alerts.json.2", "alerts.json.bak"]
+
+    # Already sharded: nothing is rewritten
+    before = os.path.getmtime(shard_path(path, 0, 3))
+    reshard_file(path, 3)
+    assert os.path.getmtime(shard_path(path, 0, 3)) == before
+
+    # Back to a single process: one plain file
+    reshard_file(path, 1)
+    with open(path, encoding="utf-8") as f:
+        assert sorted(r["chat_id"] for r in json.load(f)) == chats
+    assert not os.path.exists(shard_path(path, 0, 3))
+
+
+@pytest.mark.asyncio
+async def test_front_broadcasts_prices_to_workers():
+    """Test that price sources run once in the front and updated quotes reach every worker queue"""
+    from modules.price_feed import QuoteTable
+    from modules.coingecko import CoinGeckoPrices
+
+    front_table, worker_table = QuoteTable(source="Binance"), QuoteTable(source="Binance")
+    front_crypto, worker_crypto = CoinGeckoPrices(), CoinGeckoPrices()
+    worker_crypto.remote = True
+    pool = WorkerPool("token", 2)
+    pool.queues = [MagicMock() for _ in range(2)]
+
+    with patch("modules.price_feed.quote_table", front_table), \
+            patch("modules.coingecko.crypto_prices", front_crypto), \
+            patch("modules.workers.PRICE_BROADCAST_INTERVAL", 0.01), \
+            patch("modules.workers.PRICE_FEED_ENABLED", False), \
+            patch("modules.workers.COINGECKO_ENABLED", False):
+        pool.start_feeds()
+        front_table.update("BTC", 67000.0, 66000.0)
+        front_crypto.load({"SOL": {"symbol": "SOL-USD", "price": 150.0}}, 0.0)
+        await asyncio.sleep(0.05)
+        await pool.stop()
+
+    messages = [call.args[0] for call in pool.queues[1].put.call_args_list if call.args[0] is not None]
+    assert messages and all(m[0] == PRICES_MESSAGE for m in messages)
+    # Unchanged prices are sent once
+    assert len(messages) == 1
+    _, quotes, crypto = messages[0]
+    worker_table.load(quotes)
+    worker_crypto.load(*crypto)
+    assert worker_table.get("BTC")["price"] == 67000.0
+    assert worker_crypto.lookup("SOL")["price"] == 150.0
+    worker_crypto.start()
+    assert worker_crypto._task is None
+    front_crypto.session.close()
+    worker_crypto.session.close()